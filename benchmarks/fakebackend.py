@@ -0,0 +1,90 @@
+import json
+import time
+from typing import Any, Dict, Iterator, List, Literal, Optional
+
+from lmfunctions.base import Base
+from lmfunctions.message import Message
+
+
+def sample_from_schema(schema: Optional[Dict], defs: Optional[Dict] = None) -> Any:
+    """Returns a deterministic instance of a JSON schema."""
+    if not schema:
+        return "output"
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return sample_from_schema(defs[schema["$ref"].split("/")[-1]], defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            return sample_from_schema(schema[key][0], defs)
+    schema_type = schema.get("type", "string")
+    if isinstance(schema_type, list):
+        schema_type = schema_type[0]
+    if schema_type == "object":
+        return {
+            name: sample_from_schema(property, defs)
+            for name, property in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        items = schema.get("prefixItems") or [schema.get("items", {})]
+        return [sample_from_schema(item, defs) for item in items]
+    return {"integer": 1, "number": 1.0, "boolean": True, "null": None}.get(
+        schema_type, "output"
+    )
+
+
+class FakeBackend(Base):
+    """
+    A deterministic backend that answers with `response`, or with an instance of
+    the output schema, without calling a language model. The response is split
+    into tokens of `token_size` characters, generated after `latency` seconds at
+    `tokens_per_second` tokens per second (without delay if not set), and streamed
+    when `stream` is enabled. Prompts are counted in tokens of `token_size`
+    characters, in a context of `context_size` tokens.
+    """
+
+    name: Literal["fake"] = "fake"
+    model: str = "fake"
+    response: str | None = None
+    token_size: int = 4
+    tokens_per_second: float | None = None
+    latency: float = 0.0
+    stream: bool = True
+    context_size: int | None = None
+
+    def count_tokens(self, text: str) -> int:
+        return -(-len(text) // self.token_size)
+
+    def completion(self, schema: Optional[Dict] = None) -> str:
+        if self.response is not None:
+            return self.response
+        if schema is not None and schema.get("type") == "string":
+            return "output"
+        return json.dumps(sample_from_schema(schema))
+
+    def tokens(self, text: str) -> Iterator[str]:
+        if self.latency:
+            time.sleep(self.latency)
+        for i in range(0, len(text), self.token_size):
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            yield text[i : i + self.token_size]
+
+    def message(self, schema: Optional[Dict] = None) -> Message:
+        text = self.completion(schema)
+        if self.stream:
+            return Message(self.tokens(text))
+        return Message("".join(self.tokens(text)))
+
+    def __call__(
+        self,
+        input: str | List[str] | List[Message] | List[List[Message]] = "",
+        schema: Optional[Dict] = None,
+        **kwargs
+    ) -> Message | List[Message]:
+        if isinstance(input, list) and input and not isinstance(input[0], Message):
+            return [self.message(schema) for _ in input]
+        return self.message(schema)
@@ -0,0 +1,71 @@
+"""
+Benchmark of fast-forward decoding on extraction functions with a local model.
+
+Usage:
+    python -m benchmarks.fastforward [--backend llamacpp|transformers] [--model MODEL]
+        [--repeat N]
+
+Each extraction function is called on the same passages with greedy decoding,
+with the constrained decoding of the backend and with fast-forward decoding, and
+the output tokens per second are reported for each mode, together with the
+fraction of the output tokens that were fast-forwarded.
+"""
+
+import argparse
+
+import lmfunctions as lmf
+
+from .speculative import FUNCTIONS, MODELS, PASSAGES, measure
+
+
+def make_backend(args, fast_forward: bool):
+    if args.backend == "llamacpp":
+        return lmf.backends.LlamaCppBackend(
+            model=args.model or MODELS["llamacpp"],
+            n_ctx=4096,
+            fast_forward=fast_forward,
+            generation=dict(temperature=0, stream=False),
+        )
+    return lmf.backends.TransformersBackend(
+        model=args.model or MODELS["transformers"],
+        fast_forward=fast_forward,
+        generation=dict(do_sample=False, max_new_tokens=512),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--backend", choices=["llamacpp", "transformers"], default="llamacpp"
+    )
+    parser.add_argument("--model", help="Model of the backend")
+    parser.add_argument("--repeat", type=int, default=3, help="Calls per passage")
+    args = parser.parse_args()
+
+    for name, func in FUNCTIONS.items():
+        results = {}
+        for fast_forward in (False, True):
+            backend = make_backend(args, fast_forward)
+            results[fast_forward] = measure(func, backend, args.repeat)
+            if fast_forward:
+                decoding = backend.decoder(
+                    backend.prompt_tokens(func.render(PASSAGES[-1])),
+                    func.output_schema,
+                    temperature=0,
+                )
+                "".join(decoding)
+                forced = decoding.forced_tokens / max(
+                    decoding.forced_tokens + decoding.sampled_tokens, 1
+                )
+            del backend
+        baseline, result = results[False], results[True]
+        print(
+            f"{name:<10} constrained {baseline['tokens_per_second']:8.1f} tokens/s   "
+            f"fast-forward {result['tokens_per_second']:8.1f} tokens/s   "
+            f"speedup {result['tokens_per_second'] / baseline['tokens_per_second']:.2f}x"
+            f"   forced {forced:.0%} (last passage)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Benchmarks of the overhead of lmfunctions, using a deterministic fake backend.
+
+Usage:
+    python -m benchmarks.run [-k NAME] [--output results.json] [--compare baseline.json]
+
+The results are printed and optionally written as JSON, with the per-call time in
+seconds of each benchmark. When a baseline is given, the command fails if the
+median time of a benchmark regresses by more than the tolerance.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from importlib.metadata import version
+from typing import Callable, Dict, List, Tuple
+
+from pydantic import BaseModel
+
+import lmfunctions as lmf
+from lmfunctions.eventmanager import EventManager
+from lmfunctions.message import Message
+from lmfunctions.utils import json_dumps, json_loads
+from lmfunctions.utils.pydantic import model_from_json_schema
+
+from .fakebackend import FakeBackend
+
+
+class CityInfo(BaseModel):
+    name: str
+    country: str
+    population: int
+    landmarks: List[str]
+
+
+@lmf.lmdef
+def city_info(city: str) -> CityInfo:
+    """
+    Returns information about the city
+    """
+    ...  # pragma: no cover
+
+
+backend = FakeBackend()
+examples = [
+    (f"City {i}", CityInfo(name=f"City {i}", country="", population=i, landmarks=[]))
+    for i in range(20)
+]
+selector = lmf.ExampleSelector(examples=examples * 50, k=4)
+noop = EventManager()
+text = "".join(f"token{i % 10} " for i in range(10000))
+schema = {"type": "string"}
+
+
+def token_handler(**kwargs):
+    pass
+
+
+# A stack of composed event managers handling tokens
+composed = (
+    EventManager(handlers={"token_or_char": [token_handler]})
+    + EventManager(handlers={"token_or_char": [token_handler]})
+    + EventManager(handlers={"success": [token_handler]})
+    + EventManager(handlers={"exception": [token_handler]})
+)
+
+
+@lmf.lmdef
+def story(topic: str) -> str:
+    """
+    Returns a story about the topic
+    """
+    ...  # pragma: no cover
+
+
+# A response of 100k tokens streamed through a function call
+streaming_backend = FakeBackend(
+    response=json.dumps(dict(output="".join(f"tok{i % 10}" for i in range(100000))))
+)
+handled = EventManager(handlers={"token_or_char": [token_handler]})
+
+
+def import_time():
+    subprocess.run([sys.executable, "-c", "import lmfunctions"], check=True)
+
+
+def lmfunc_call():
+    city_info("Paris", backend=backend, event_manager=noop)
+
+
+def lmfunc_call_examples():
+    city_info("Paris", examples=examples, backend=backend, event_manager=noop)
+
+
+def lmfunc_call_selector():
+    city_info("City 7", examples=selector, backend=backend, event_manager=noop)
+
+
+def lmfunc_call_events():
+    city_info("Paris", backend=backend, event_manager=composed)
+
+
+def stream_tokens():
+    story("dragons", backend=streaming_backend, event_manager=noop)
+
+
+def stream_tokens_handlers():
+    story("dragons", backend=streaming_backend, event_manager=handled)
+
+
+def batch_call():
+    city_info(["Paris"] * 100, batch_call=True, backend=backend, event_manager=noop)
+
+
+def batch_call_fast():
+    city_info(
+        ["Paris"] * 100,
+        batch_call=True,
+        validation="fast",
+        backend=backend,
+        event_manager=noop,
+    )
+
+
+cities = None
+
+
+def apply_frame():
+    global cities
+    if cities is None:
+        import pandas as pd
+
+        cities = pd.DataFrame({"city": [f"City {i}" for i in range(1000)]})
+    city_info.apply_frame(
+        cities, ["city"], batch_size=100, backend=backend, event_manager=noop
+    )
+
+
+def message_process():
+    Message(iter(text.split(" "))).process(schema, handle_token_or_char=None)
+
+
+def message_process_json():
+    Message(iter(["{"] + text.split(" ") + ["}"])).process(
+        dict(type="object"), handle_token_or_char=None
+    )
+
+
+city_info_schema = CityInfo.model_json_schema()
+
+
+def model_from_schema():
+    lmf.utils.model_from_schema(city_info_schema)
+
+
+def model_generation():
+    # Bypasses the cache of generated models
+    model_from_json_schema.__wrapped__(json_dumps(city_info_schema))
+
+
+# A large nested input
+nested = {
+    f"key{i}": {"values": list(range(20)), "text": "value " * 10, "flag": i % 2 == 0}
+    for i in range(1000)
+}
+nested_json = json_dumps(nested)
+
+
+def json_dumps_nested():
+    city_info.to_json_str(nested)
+
+
+def json_loads_nested():
+    json_loads(nested_json)
+
+
+def event_dispatch():
+    for _ in range(1000):
+        composed("token_or_char", token_or_char="token")
+
+
+def yaml_dump():
+    city_info.dumps()
+
+
+serialized = city_info.dumps()
+
+
+def yaml_load():
+    lmf.from_string(serialized)
+
+
+# Name: (benchmark, number of calls per repetition, repetitions)
+BENCHMARKS: Dict[str, Tuple[Callable, int, int]] = {
+    "import_time": (import_time, 1, 5),
+    "lmfunc_call": (lmfunc_call, 100, 5),
+    "lmfunc_call_examples": (lmfunc_call_examples, 100, 5),
+    "lmfunc_call_selector": (lmfunc_call_selector, 100, 5),
+    "lmfunc_call_events": (lmfunc_call_events, 100, 5),
+    "stream_tokens": (stream_tokens, 1, 5),
+    "stream_tokens_handlers": (stream_tokens_handlers, 1, 5),
+    "batch_call": (batch_call, 5, 5),
+    "batch_call_fast": (batch_call_fast, 5, 5),
+    "apply_frame": (apply_frame, 1, 5),
+    "message_process": (message_process, 10, 5),
+    "message_process_json": (message_process_json, 10, 5),
+    "model_from_schema": (model_from_schema, 100, 5),
+    "model_generation": (model_generation, 5, 5),
+    "json_dumps_nested": (json_dumps_nested, 20, 5),
+    "json_loads_nested": (json_loads_nested, 20, 5),
+    "event_dispatch": (event_dispatch, 100, 5),
+    "yaml_dump": (yaml_dump, 100, 5),
+    "yaml_load": (yaml_load, 20, 5),
+}
+
+
+def run(names: List[str]) -> Dict:
+    results = {}
+    for name in names:
+        benchmark, number, repeat = BENCHMARKS[name]
+        # Warm up caches and lazily built models
+        benchmark()
+        times = [
+            t / number for t in timeit.repeat(benchmark, number=number, repeat=repeat)
+        ]
+        results[name] = dict(
+            number=number,
+            repeat=repeat,
+            min=min(times),
+            median=statistics.median(times),
+            mean=statistics.mean(times),
+        )
+        print(f"{name:<24} {results[name]['median'] * 1e6:>14.1f} us")
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Returns the names of the benchmarks regressing with respect to the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result["median"] / baseline[name]["median"]
+            print(f"{name:<24} {ratio:>8.2f}x")
+            if ratio > 1 + tolerance:
+                regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("-k", default="", help="Run the benchmarks matching NAME")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    parser.add_argument("--compare", help="Compare with the results in a JSON file")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed relative regression"
+    )
+    args = parser.parse_args()
+
+    results = dict(
+        metadata=dict(
+            lmfunctions=version("lmfunctions"),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            timestamp=time.time(),
+        ),
+        benchmarks=run([name for name in BENCHMARKS if args.k in name]),
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            results["benchmarks"], baseline["benchmarks"], args.tolerance
+        )
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
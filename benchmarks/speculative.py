@@ -0,0 +1,140 @@
+"""
+Benchmark of speculative decoding on extraction functions with a local model.
+
+Usage:
+    python -m benchmarks.speculative [--backend llamacpp|transformers] [--model MODEL]
+        [--num-tokens N] [--assistant-model MODEL] [--repeat N]
+
+Each extraction function is called on the same passages with greedy decoding,
+without and with speculative decoding (prompt lookup, or assisted generation
+when an assistant model is given), and the generated tokens per second are
+reported for each mode. Outputs are expected to be identical across modes.
+"""
+
+import argparse
+import time
+from typing import Dict, List
+
+from pydantic import BaseModel
+
+import lmfunctions as lmf
+from lmfunctions.eventmanager import EventManager
+
+
+class Entities(BaseModel):
+    people: List[str]
+    organizations: List[str]
+    locations: List[str]
+
+
+@lmf.lmdef
+def extract_entities(passage: str) -> Entities:
+    """
+    Extracts the names of people, organizations and locations mentioned in the
+    passage, exactly as they are written
+    """
+    ...  # pragma: no cover
+
+
+@lmf.lmdef
+def extract_quotes(passage: str) -> List[str]:
+    """
+    Returns the sentences of the passage that are quoted, verbatim
+    """
+    ...  # pragma: no cover
+
+
+PASSAGES = [
+    "Speaking at the Geneva offices of the World Health Organization, Dr. Maria "
+    'Van Kerkhove said: "We need to prepare for the next pandemic now." She added '
+    'that "the Global Influenza Surveillance and Response System remains our best '
+    'early warning tool", before travelling to Nairobi with Tedros Adhanom.',
+    "The European Central Bank, led by Christine Lagarde, kept rates unchanged in "
+    'Frankfurt. "Inflation is expected to return to our two percent target in the '
+    'second half of next year," Lagarde told reporters, while Philip Lane noted '
+    'that "wage growth in Germany and the Netherlands remains elevated."',
+    "Engineers from Toyota Motor Corporation and Panasonic met in Osaka to discuss "
+    'solid-state batteries. "Our prototype cells charge to eighty percent in ten '
+    'minutes," said Keiji Kaita, while Yuki Kusumi of Panasonic Energy added that '
+    '"production in Wakayama Prefecture will begin in 2027."',
+]
+
+FUNCTIONS = {"entities": extract_entities, "quotes": extract_quotes}
+
+# Small models, which can be run on CPU
+MODELS = {
+    "llamacpp": "hf://Qwen/Qwen2-0.5B-Instruct-GGUF/qwen2-0_5b-instruct-q4_k_m.gguf",
+    "transformers": "Qwen/Qwen2-0.5B-Instruct",
+}
+
+
+def make_backend(args, speculative: bool):
+    if args.backend == "llamacpp":
+        return lmf.backends.LlamaCppBackend(
+            model=args.model or MODELS["llamacpp"],
+            n_ctx=4096,
+            prompt_lookup_num_tokens=args.num_tokens if speculative else None,
+            generation=dict(temperature=0, stream=False),
+        )
+    return lmf.backends.TransformersBackend(
+        model=args.model or MODELS["transformers"],
+        prompt_lookup_num_tokens=(
+            args.num_tokens if speculative and not args.assistant_model else None
+        ),
+        assistant_model=args.assistant_model if speculative else None,
+        generation=dict(do_sample=False, max_new_tokens=512),
+    )
+
+
+def measure(func, backend, repeat: int) -> Dict:
+    completions: List[str] = []
+    event_manager = EventManager(
+        handlers={
+            "success": [lambda completion, **kwargs: completions.append(completion)]
+        }
+    )
+    # Warm up the model
+    func(PASSAGES[0], backend=backend, event_manager=EventManager())
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for passage in PASSAGES:
+            func(passage, backend=backend, event_manager=event_manager)
+    elapsed = time.perf_counter() - start
+    tokens = sum(backend.count_tokens(completion) for completion in completions)
+    return dict(
+        tokens=tokens,
+        seconds=elapsed,
+        tokens_per_second=tokens / elapsed,
+        completions=completions[: len(PASSAGES)],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--backend", choices=["llamacpp", "transformers"], default="llamacpp"
+    )
+    parser.add_argument("--model", help="Model of the backend")
+    parser.add_argument("--num-tokens", type=int, default=10, help="Draft tokens")
+    parser.add_argument("--assistant-model", help="Assistant model (transformers)")
+    parser.add_argument("--repeat", type=int, default=3, help="Calls per passage")
+    args = parser.parse_args()
+
+    for name, func in FUNCTIONS.items():
+        results = {}
+        for speculative in (False, True):
+            backend = make_backend(args, speculative)
+            results[speculative] = measure(func, backend, args.repeat)
+            del backend
+        baseline, result = results[False], results[True]
+        print(
+            f"{name:<10} baseline {baseline['tokens_per_second']:8.1f} tokens/s   "
+            f"speculative {result['tokens_per_second']:8.1f} tokens/s   "
+            f"speedup {result['tokens_per_second'] / baseline['tokens_per_second']:.2f}x"
+        )
+        if baseline["completions"] != result["completions"]:
+            print(f"{name:<10} warning: the outputs differ between the modes")
+
+
+if __name__ == "__main__":
+    main()
@@ -49,3 +49,9 @@ def tests(session) -> None:
         "--cov=lmfunctions",
         "--cov=tests",
     )
+
+
+@nox.session(python=["3.11"])
+def benchmarks(session) -> None:
+    session.install("pip", "--upgrade", ".")
+    session.run("python", "-m", "benchmarks.run", *session.posargs)
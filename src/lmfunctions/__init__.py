@@ -2,8 +2,11 @@ import logging
 from importlib.util import find_spec
 
 from . import backends, base, eventmanager, managers, retrypolicy, utils
-from .chat import chat
+from .cache import SemanticCache
+from .chat import ChatSession, chat
+from .chatserver import SessionStore
 from .default import default
+from .examples import ExampleSelector
 from .lmfunc import LMFunc, lmdef
 from .message import Message
 
@@ -36,6 +39,10 @@ class BackendSetter:
     def vllm(*args, **kwargs):
         default.backend = backends.VLLMBackend(*args, **kwargs)
 
+    @staticmethod
+    def composite(*args, **kwargs):
+        default.backend = backends.CompositeBackend(*args, **kwargs)
+
 
 set_backend = BackendSetter()
 
@@ -72,6 +79,14 @@ class EventManagerSetter:
     def timeevents():
         default.event_manager = managers.timeEvents()
 
+    @staticmethod
+    def latencymetrics():
+        default.event_manager = managers.latencyMetrics.event_manager()
+
+    @staticmethod
+    def prometheus():
+        default.event_manager = managers.prometheusMetrics.event_manager()
+
     @staticmethod
     def default():
         default.event_manager = eventmanager.EventManager()
@@ -83,10 +98,14 @@ __all__ = [
     "lmdef",
     "LMFunc",
     "chat",
+    "ChatSession",
+    "SessionStore",
     "from_string",
     "from_store",
     "from_file",
     "Message",
+    "ExampleSelector",
+    "SemanticCache",
     "eventmanager",
     "base",
     "retrypolicy",
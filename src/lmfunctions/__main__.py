@@ -0,0 +1,103 @@
+import argparse
+import sys
+
+from lmfunctions import runner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m lmfunctions")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser(
+        "run",
+        help="Run a language function over a dataset",
+        description=(
+            "Runs a language function over the records of a JSONL, CSV or Parquet "
+            "input and writes them with their outputs to a JSONL output. "
+            "Interrupted jobs resume from their last checkpoint."
+        ),
+    )
+    run.add_argument("function", help="Function file or URL, or object store path")
+    run.add_argument("input", help="Input file or URL")
+    run.add_argument("output", help="Output JSONL file")
+    run.add_argument("--backend", help="Backend configuration file or URL")
+    run.add_argument("--format", choices=runner.FORMATS, help="Input format")
+    run.add_argument("--column", help="Use a column as input instead of the record")
+    run.add_argument("--output-key", default="output", help="Key of the outputs")
+    run.add_argument("--batch-size", type=int, default=1, help="Records per call")
+    run.add_argument("--concurrency", type=int, default=1, help="Calls in flight")
+    run.add_argument(
+        "--validation", choices=["full", "fast", "trusted"], default="full"
+    )
+    run.add_argument("--fail-fast", action="store_true", help="Stop at the first error")
+    run.add_argument("--restart", action="store_true", help="Ignore the checkpoint")
+    run.add_argument(
+        "--progress-interval", type=float, default=5, help="Seconds between reports"
+    )
+
+    server = commands.add_parser(
+        "chat-server",
+        help="Serve chat sessions of a backend",
+        description=(
+            "Serves chat sessions keyed by ID over HTTP, keeping the least recently "
+            "used sessions on disk beyond the memory limits."
+        ),
+    )
+    server.add_argument("--backend", help="Backend configuration file or URL")
+    server.add_argument("--host", default="127.0.0.1", help="Host of the server")
+    server.add_argument("--port", type=int, default=8000, help="Port of the server")
+    server.add_argument("--system-message", help="System message of new sessions")
+    server.add_argument("--max-tokens", type=int, help="Token budget of histories")
+    server.add_argument(
+        "--max-sessions", type=int, default=64, help="Sessions kept in memory"
+    )
+    server.add_argument("--max-bytes", type=int, help="Bytes of histories in memory")
+    server.add_argument("--spill-dir", help="Directory of the evicted sessions")
+    server.add_argument(
+        "--max-concurrency", type=int, default=1, help="Backend calls in flight"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        kwargs = dict(validation=args.validation)
+        if args.backend:
+            kwargs["backend"] = runner.load_backend(args.backend)
+        progress = runner.run(
+            runner.load_function(args.function),
+            args.input,
+            args.output,
+            format=args.format,
+            column=args.column,
+            output_key=args.output_key,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            fail_fast=args.fail_fast,
+            restart=args.restart,
+            progress_interval=args.progress_interval,
+            **kwargs,
+        )
+        return 1 if progress.errors else 0
+
+    if args.command == "chat-server":
+        from lmfunctions.chat import ChatSession
+        from lmfunctions.chatserver import SessionStore, serve_chat
+
+        store = SessionStore(
+            template=ChatSession(
+                system_message=args.system_message, max_tokens=args.max_tokens
+            ),
+            max_sessions=args.max_sessions,
+            max_bytes=args.max_bytes,
+            spill_dir=args.spill_dir,
+        )
+        serve_chat(
+            runner.load_backend(args.backend) if args.backend else None,
+            store,
+            max_concurrency=args.max_concurrency,
+            uvicorn_params=dict(host=args.host, port=args.port),
+        )
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
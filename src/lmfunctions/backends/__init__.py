@@ -1,13 +1,21 @@
+from .composite import CompositeBackend
 from .litellm import LiteLLMBackend
 from .llamacpp import LlamaCppBackend
 from .transformers import TransformersBackend
 from .vllm import VLLMBackend
 
-LMBackend = LiteLLMBackend | LlamaCppBackend | TransformersBackend | VLLMBackend
+LMBackend = (
+    LiteLLMBackend
+    | LlamaCppBackend
+    | TransformersBackend
+    | VLLMBackend
+    | CompositeBackend
+)
 
 __all__ = [
     "LiteLLMBackend",
     "LlamaCppBackend",
     "TransformersBackend",
+    "CompositeBackend",
     "LMBackend",
 ]
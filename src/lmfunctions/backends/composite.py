@@ -0,0 +1,342 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Literal, Optional
+
+from pydantic import Field, model_validator
+from typing_extensions import Annotated
+
+from lmfunctions.base import Base
+from lmfunctions.eventmanager import call_context
+from lmfunctions.message import Message
+from lmfunctions.utils import model_from_schema
+
+from .litellm import LiteLLMBackend
+from .llamacpp import LlamaCppBackend
+from .transformers import TransformersBackend
+from .vllm import VLLMBackend
+
+SingleBackend = Annotated[
+    LiteLLMBackend | LlamaCppBackend | TransformersBackend | VLLMBackend,
+    Field(discriminator="name"),
+]
+
+
+class HedgeCancelled(Exception):
+    """Raised to abort the generation of a hedged request which lost the race."""
+
+
+class CompositeBackend(Base):
+    """
+    A backend that chains an ordered list of backends.
+
+    Backends are tried in order: when a backend raises an exception, the request
+    fails over to the next one and a `retry` event is emitted on the event manager
+    of the language function call. If all the backends fail, the last exception is
+    raised, so that the retry policy of the language function retries the whole
+    chain. Streamed responses also fail over when their stream fails before its
+    first token, while a stream failing after some tokens raises the exception.
+
+    When `hedge` is enabled, a request that has not completed after the hedging
+    delay is duplicated on the next backend (emitting a `hedge` event), and the
+    first successful response is returned. Pending requests which have not started
+    are cancelled and streamed requests are aborted at their next token, whereas
+    requests which are not streamed run to completion in the background and their
+    responses are discarded. The delay is either fixed (`hedge_delay`) or estimated
+    as the `hedge_quantile` of the latencies observed on the primary backend. Hedged
+    responses are fully generated and validated against the schema before the first
+    valid one is returned, after which its tokens are streamed from memory.
+    """
+
+    name: Literal["composite"] = "composite"
+    backends: List[SingleBackend] = []
+    hedge: bool = False
+    hedge_delay: float | None = None
+    hedge_quantile: float = 0.95
+    hedge_min_samples: int = 20
+    latency_window: int = 1000
+
+    _latencies: Any = None
+    _latency_backends: Any = None
+
+    @model_validator(mode="after")
+    def reset_latencies(self):
+        # Latency statistics are reset when the backends or the window are changed
+        if (
+            self._latencies is None
+            or self._latency_backends is not self.backends
+            or self._latencies.maxlen != self.latency_window
+        ):
+            self._latencies = deque(maxlen=self.latency_window)
+            self._latency_backends = self.backends
+        return self
+
+    @property
+    def model(self) -> str:
+        """The model of the primary backend."""
+        return self.backends[0].model if self.backends else ""
+
+    def count_tokens(self, text: str) -> int:
+        """Returns the number of tokens of the text for the primary backend."""
+        from lmfunctions.examples import count_tokens
+
+        return count_tokens(self.backends[0] if self.backends else None, text)
+
+    @property
+    def context_size(self) -> int | None:
+        """The smallest context size of the backends in tokens, if known."""
+        from lmfunctions.examples import context_size
+
+        sizes = [context_size(backend) for backend in self.backends]
+        sizes = [size for size in sizes if size]
+        return min(sizes) if sizes else None
+
+    @property
+    def delay(self) -> float | None:
+        """The delay in seconds after which a request is hedged."""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[int(self.hedge_quantile * (len(latencies) - 1))]
+
+    def emit(self, context: Dict, event_name: str, **kwargs) -> None:
+        """Emits an event on the event manager of the call, or else the default one."""
+        from lmfunctions.default import default
+
+        event_manager = context.get("event_manager") or default.event_manager
+        if event_manager.has_handlers(event_name):
+            event_manager(event_name, span=context.get("span"), **kwargs)
+
+    def retry(
+        self,
+        context: Dict,
+        i: int,
+        input: Any,
+        exception: Exception,
+        failover_backend: Any,
+        **kwargs,
+    ) -> None:
+        """
+        Emits the `retry` event of a failover from the i-th backend to the failover
+        backend, with the state of the failed attempt like the retries of the
+        language functions.
+        """
+        from tenacity import RetryCallState
+
+        backend = self.backends[i]
+        retry_call_state = RetryCallState(
+            None, backend, (input,), kwargs  # type: ignore
+        )
+        retry_call_state.attempt_number = i + 1
+        retry_call_state.set_exception(
+            (type(exception), exception, exception.__traceback__)
+        )
+        self.emit(
+            context,
+            "retry",
+            retry_call_state=retry_call_state,
+            backend=backend,
+            exception=exception,
+            failover_backend=failover_backend,
+        )
+
+    def failover(
+        self,
+        input: Any,
+        schema: Optional[Dict] = None,
+        first: int = 0,
+        context: Dict = {},
+        **kwargs,
+    ) -> Message | List[Message]:
+        """Calls the backends in order, from the `first` one, until one succeeds."""
+        for i in range(first, len(self.backends)):
+            backend = self.backends[i]
+            try:
+                start = time.monotonic()
+                response = backend(input, schema=schema, **kwargs)
+            except Exception as exception:
+                if i == len(self.backends) - 1:
+                    raise exception
+                self.retry(
+                    context,
+                    i,
+                    input,
+                    exception,
+                    self.backends[i + 1],
+                    schema=schema,
+                    **kwargs,
+                )
+                continue
+            responses = response if isinstance(response, list) else [response]
+            inputs = input if isinstance(response, list) else [input]
+            streamed = [
+                isinstance(message._unprocessed, Iterator) for message in responses
+            ]
+            if i == 0 and not any(streamed):
+                self._latencies.append(time.monotonic() - start)
+            if any(streamed) and i < len(self.backends) - 1:
+                responses = [
+                    (
+                        Message(
+                            self.stream(
+                                message, i, item, schema, start, context, **kwargs
+                            ),
+                            role=message.role,
+                        )
+                        if is_stream
+                        else message
+                    )
+                    for message, item, is_stream in zip(responses, inputs, streamed)
+                ]
+            return responses if isinstance(response, list) else responses[0]
+        raise ValueError("No backends available")
+
+    def stream(
+        self,
+        message: Message,
+        i: int,
+        input: Any,
+        schema: Optional[Dict],
+        start: float,
+        context: Dict,
+        **kwargs,
+    ) -> Iterator[str]:
+        """
+        Yields the tokens of a response streamed by the i-th backend, failing over
+        to the next backends if the stream fails before its first token. The latency
+        of the primary backend is measured until the end of the stream.
+        """
+        started = False
+        try:
+            for token in message._unprocessed:
+                started = True
+                yield token
+        except Exception as exception:
+            if started:
+                raise exception
+            self.retry(
+                context,
+                i,
+                input,
+                exception,
+                self.backends[i + 1],
+                schema=schema,
+                **kwargs,
+            )
+            response = self.failover(input, schema, i + 1, context, **kwargs)
+            assert isinstance(response, Message)
+            unprocessed = response._unprocessed
+            yield from [unprocessed] if isinstance(unprocessed, str) else unprocessed
+            return
+        if i == 0:
+            self._latencies.append(time.monotonic() - start)
+
+    def hedged(
+        self, input: Any, schema: Optional[Dict] = None, context: Dict = {}, **kwargs
+    ) -> Message | List[Message]:
+        """Calls the backends concurrently, hedging the requests that are slow."""
+        cancelled = threading.Event()
+
+        def collect(message: Message) -> Message:
+            """
+            Generates the response and validates it against the schema. Returns an
+            unprocessed copy, whose tokens are streamed to the handlers of the call.
+            """
+            unprocessed = message.content or message._unprocessed
+            tokens = []
+            for token in [unprocessed] if isinstance(unprocessed, str) else unprocessed:
+                if cancelled.is_set():
+                    raise HedgeCancelled()
+                tokens.append(token)
+            if schema:
+                output = Message("".join(tokens)).process(
+                    schema, handle_token_or_char=None
+                )
+                model_from_schema(schema).model_validate(output)
+            return Message(
+                "".join(tokens) if isinstance(unprocessed, str) else iter(tokens),
+                role=message.role,
+            )
+
+        def call(backend):
+            start = time.monotonic()
+            response = backend(input, schema=schema, **kwargs)
+            if isinstance(response, list):
+                response = [collect(message) for message in response]
+            else:
+                response = collect(response)
+            return response, time.monotonic() - start
+
+        pending: Dict[Future, int] = {}
+        remaining = list(enumerate(self.backends))
+
+        def record(future):
+            # Primary latencies are recorded even when the request loses the race
+            if not future.cancelled() and future.exception() is None:
+                self._latencies.append(future.result()[1])
+
+        # The requests which lost the race finish in the background, after the
+        # executor is shut down
+        executor = ThreadPoolExecutor(
+            max_workers=len(self.backends), thread_name_prefix="lmfunctions"
+        )
+
+        def submit():
+            i, backend = remaining.pop(0)
+            future = executor.submit(call, backend)
+            if i == 0:
+                future.add_done_callback(record)
+            pending[future] = i
+
+        try:
+            submit()
+            delay = self.delay
+            exception: Exception | None = None
+            while pending:
+                done, _ = wait(
+                    pending,
+                    timeout=delay if remaining else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                if not done:
+                    # The pending requests are slow: hedge on the next backend
+                    self.emit(context, "hedge", backend=remaining[0][1], delay=delay)
+                    submit()
+                    continue
+                for future in done:
+                    i = pending.pop(future)
+                    try:
+                        response, _ = future.result()
+                    except Exception as e:
+                        exception = e
+                        if remaining:
+                            self.retry(
+                                context,
+                                i,
+                                input,
+                                e,
+                                remaining[0][1],
+                                schema=schema,
+                                **kwargs,
+                            )
+                            submit()
+                        continue
+                    return response
+            raise exception or ValueError("No backends available")
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __call__(
+        self,
+        input: str | List[str] | List[Message] | List[List[Message]] = "",
+        schema: Optional[Dict] = None,
+        **kwargs,
+    ) -> Message | List[Message]:
+        context = call_context.get()
+        if self.hedge and len(self.backends) > 1:
+            return self.hedged(input, schema, context, **kwargs)
+        return self.failover(input, schema, context=context, **kwargs)
@@ -0,0 +1,243 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from lmformatenforcer import CharacterLevelParserConfig, JsonSchemaParser
+from lmformatenforcer.characterlevelparser import CharacterLevelParser
+
+# Fields in the order of the schema and no optional whitespace, so that keys,
+# separators and the remaining characters of enum literals are determined
+PARSER_CONFIG = CharacterLevelParserConfig(
+    force_json_field_order=True, max_consecutive_whitespaces=0
+)
+
+
+def schema_parser(schema: Dict) -> CharacterLevelParser:
+    return JsonSchemaParser(schema, PARSER_CONFIG)
+
+
+def advance(parser: CharacterLevelParser, text: str) -> Optional[CharacterLevelParser]:
+    """Returns the parser after the text, or None if the text is not allowed."""
+    for character in text:
+        if character not in parser.get_allowed_characters():
+            return None
+        parser = parser.add_character(character)
+    return parser
+
+
+def forced_text(parser: CharacterLevelParser) -> Tuple[str, CharacterLevelParser]:
+    """
+    Returns the text determined by the parser, i.e. the longest sequence of
+    characters which are the only ones allowed, and the parser after the text.
+    """
+    text = ""
+    while not parser.can_end():
+        allowed = parser.get_allowed_characters()
+        if len(allowed) != 1:
+            break
+        text += allowed
+        parser = parser.add_character(allowed)
+    return text, parser
+
+
+class FastForwardDecoder:
+    """
+    Decoder of outputs constrained by a JSON schema, which fast-forwards the text
+    determined by the schema. The keys, separators and the remaining characters of
+    enum literals are appended to the output without sampling, and their tokens are
+    evaluated in a single batched forward pass, so that the model is only sampled
+    where it has a choice.
+
+    The forced text is tokenized on its own, so the tokens at its boundaries with
+    the sampled text may differ from the ones the model would generate (e.g. a
+    quote merged with the following characters), which can slightly change the
+    sampled text with respect to constrained decoding.
+
+    The decoder works with any model given as a tokenizer and two functions
+    returning the logits of the next token, after the prompt tokens and after
+    tokens appended to the sequence. The state of the sequence (e.g. a KV cache, or
+    its tokens) is returned with the logits and passed back to `extend`, so that it
+    belongs to the call, like the counts of forced and sampled tokens of the
+    `FastForwardDecoding` returned by each call.
+
+    Args:
+        tokenizer_data (TokenEnforcerTokenizerData): The vocabulary of the model.
+        tokenize (Callable): Returns the tokens of a text, without special tokens.
+        prefill (Callable): Evaluates the prompt tokens, returning the logits and
+            the state of the sequence.
+        extend (Callable): Evaluates tokens appended to the sequence with the given
+            state, returning the logits and the state of the sequence.
+    """
+
+    def __init__(
+        self,
+        tokenizer_data: Any,
+        tokenize: Callable[[str], List[int]],
+        prefill: Callable[[List[int]], Tuple[Any, Any]],
+        extend: Callable[[List[int], Any], Tuple[Any, Any]],
+    ):
+        # numpy is a dependency of the model libraries, imported with them
+        import numpy
+
+        self.np = numpy
+        self.tokenize = tokenize
+        self.prefill = prefill
+        self.extend = extend
+        # Tokens decoded to replacement characters are parts of multibyte
+        # characters, which the parser cannot validate on their own
+        self.token_text = {
+            token: text
+            for token, text, _ in tokenizer_data.regular_tokens
+            if text and "�" not in text
+        }
+        eos = tokenizer_data.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, list) else [eos])
+
+    def candidates(self, logits: Any) -> Iterator[int]:
+        """Yields the tokens in order of decreasing logits."""
+        np = self.np
+        size = min(64, len(logits))
+        top = np.argpartition(-logits, size - 1)[:size]
+        yield from top[np.argsort(-logits[top])].tolist()
+        if size < len(logits):
+            rest = np.argsort(-logits).tolist()[size:]
+            yield from rest
+
+    def choose(
+        self,
+        logits: Any,
+        parser: CharacterLevelParser,
+        temperature: float,
+        top_k: int,
+        top_p: float,
+        rng: Any,
+    ) -> Tuple[Optional[int], Optional[CharacterLevelParser]]:
+        """
+        Samples among the `top_k` allowed tokens with the highest logits. Returns
+        the token and the parser after it, or a None token at the end of the output.
+        """
+        np = self.np
+        allowed: List[Tuple[int, CharacterLevelParser]] = []
+        for token in self.candidates(logits):
+            if token in self.eos_token_ids:
+                if parser.can_end():
+                    allowed.append((token, parser))
+            elif token in self.token_text:
+                next_parser = advance(parser, self.token_text[token])
+                if next_parser is not None:
+                    allowed.append((token, next_parser))
+            if allowed and (
+                temperature <= 0
+                or len(allowed) >= max(top_k, 1)
+                # Tokens much less likely than the most likely allowed one
+                or logits[allowed[0][0]] - logits[token] > 20 * temperature
+            ):
+                break
+        if not allowed:
+            return None, None
+        index = 0
+        if temperature > 0 and len(allowed) > 1:
+            scores = logits[[token for token, _ in allowed]] / temperature
+            probabilities = np.exp(scores - scores.max())
+            probabilities /= probabilities.sum()
+            # Nucleus of the allowed tokens
+            cumulative = np.cumsum(probabilities)
+            size = int(np.searchsorted(cumulative, top_p)) + 1
+            probabilities = probabilities[:size] / probabilities[:size].sum()
+            index = int(rng.choice(size, p=probabilities))
+        token, parser = allowed[index]
+        return (None if token in self.eos_token_ids else token), parser
+
+    def __call__(
+        self,
+        prompt_tokens: List[int],
+        schema: Dict,
+        temperature: float = 0.8,
+        top_k: int = 40,
+        top_p: float = 0.95,
+        max_tokens: Optional[int] = None,
+        seed: Optional[int] = None,
+    ) -> "FastForwardDecoding":
+        """
+        Returns the iterator of the pieces of text of the output for the prompt
+        tokens, constrained by the schema.
+
+        Args:
+            prompt_tokens (List[int]): The tokens of the prompt.
+            schema (Dict): The JSON schema of the output.
+            temperature (float, optional): The sampling temperature, where 0 is
+                greedy decoding.
+            top_k (int, optional): The number of allowed tokens sampled from.
+            top_p (float, optional): The probability mass of the allowed tokens
+                sampled from.
+            max_tokens (int, optional): The maximum number of output tokens.
+            seed (int, optional): The seed of the sampling.
+        """
+        return FastForwardDecoding(
+            self, prompt_tokens, schema, temperature, top_k, top_p, max_tokens, seed
+        )
+
+
+class FastForwardDecoding:
+    """
+    Iterator of the pieces of text of an output of the `FastForwardDecoder`, which
+    counts the `forced_tokens` and the `sampled_tokens` of the output.
+    """
+
+    def __init__(
+        self,
+        decoder: FastForwardDecoder,
+        prompt_tokens: List[int],
+        schema: Dict,
+        temperature: float,
+        top_k: int,
+        top_p: float,
+        max_tokens: Optional[int],
+        seed: Optional[int],
+    ):
+        self.forced_tokens = self.sampled_tokens = 0
+        self.pieces = self.decode(
+            decoder, prompt_tokens, schema, temperature, top_k, top_p, max_tokens, seed
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        return next(self.pieces)
+
+    def decode(
+        self,
+        decoder: FastForwardDecoder,
+        prompt_tokens: List[int],
+        schema: Dict,
+        temperature: float,
+        top_k: int,
+        top_p: float,
+        max_tokens: Optional[int],
+        seed: Optional[int],
+    ) -> Iterator[str]:
+        rng = decoder.np.random.default_rng(seed)
+        parser = schema_parser(schema)
+        logits, state = decoder.prefill(prompt_tokens)
+        while (
+            max_tokens is None or self.forced_tokens + self.sampled_tokens < max_tokens
+        ):
+            text, parser = forced_text(parser)
+            if text:
+                yield text
+                if not parser.get_allowed_characters():
+                    # The output is complete, without evaluating the forced tokens
+                    return
+                tokens = decoder.tokenize(text)
+                self.forced_tokens += len(tokens)
+                logits, state = decoder.extend(tokens, state)
+                continue
+            if not parser.get_allowed_characters() and parser.can_end():
+                return
+            token, parser = decoder.choose(
+                logits, parser, temperature, top_k, top_p, rng
+            )
+            if token is None:
+                return
+            self.sampled_tokens += 1
+            yield decoder.token_text[token]
+            logits, state = decoder.extend([token], state)
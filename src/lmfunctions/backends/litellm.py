@@ -1,11 +1,72 @@
-from typing import Any, Dict, Iterator, List, Literal, Optional
+import asyncio
+import hashlib
+import time
+import weakref
+from typing import Any, AsyncIterator, Dict, Iterator, List, Literal, Optional
+
+from pydantic import model_validator
 
 from lmfunctions.base import Base
 from lmfunctions.message import Message, is_message_list
-from lmfunctions.utils import lazy_import, model_from_schema
+from lmfunctions.utils import (
+    json_dumps,
+    json_loads,
+    lazy_import,
+    model_from_schema,
+    token_bucket,
+)
+
+# Fields controlling the client behavior, which are not passed to litellm
+CLIENT_FIELDS = {
+    "name",
+    "chat",
+    "max_concurrency",
+    "max_connections",
+    "requests_per_minute",
+    "batch_api",
+    "batch_poll_interval",
+}
+
+# Request body fields supported by the OpenAI-compatible batch API
+BATCH_BODY_FIELDS = {
+    "temperature",
+    "top_p",
+    "n",
+    "stop",
+    "max_tokens",
+    "presence_penalty",
+    "frequency_penalty",
+    "logit_bias",
+    "user",
+    "seed",
+    "tools",
+    "tool_choice",
+    "logprobs",
+    "top_logprobs",
+    "functions",
+    "function_call",
+}
+
+# Final states of a batch job
+BATCH_END_STATES = {"completed", "failed", "expired", "cancelled"}
 
 
 class LiteLLMBackend(Base):
+    """
+    LiteLLM backend configuration. Requests are sent synchronously with `__call__`
+    or asynchronously with `acall`.
+
+    Async requests of the backend share an HTTP connection pool of at most
+    `max_connections` connections for each event loop, which is closed with
+    `aclose`, and at most `max_concurrency` requests are in flight at the same time
+    for each event loop. When `requests_per_minute` is set, both sync and async
+    requests are rate limited with a token bucket shared by the backends with the
+    same model, endpoint, API key and rate.
+
+    When `batch_api` is enabled, lists of inputs in chat mode are submitted as a
+    single job to the OpenAI-compatible batch API at `base_url`, which is polled
+    every `batch_poll_interval` seconds until the job ends.
+    """
 
     name: Literal["litellm"] = "litellm"
     model: str = "gpt-4o-mini"
@@ -37,21 +98,132 @@ class LiteLLMBackend(Base):
     mock_response: str | None = None
     drop_params: bool = True
     chat: bool = True
+    max_concurrency: int | None = None
+    max_connections: int = 100
+    requests_per_minute: float | None = None
+    batch_api: bool = False
+    batch_poll_interval: float = 30
+
+    _semaphores: Any = None
+    _sessions: Any = None
+    _limits: Any = None
+
+    @model_validator(mode="after")
+    def reset_semaphores(self):
+        # Semaphores are recreated when the concurrency limit is changed, while the
+        # requests in flight release the semaphores they acquired
+        if self._limits != self.max_concurrency:
+            self._semaphores, self._limits = None, self.max_concurrency
+        return self
+
+    def params(self, schema: Optional[Dict] = None, **kwargs) -> Dict[str, Any]:
+        """Returns the arguments passed to litellm."""
+        return (
+            self.model_dump(exclude=CLIENT_FIELDS)
+            | dict(response_format=model_from_schema(schema) if schema else None)
+            | kwargs
+        )
+
+    def count_tokens(self, text: str) -> int:
+        """Returns the number of tokens of the text with the tokenizer of the model."""
+        lazy_import("litellm")
+        import litellm
+
+        return litellm.token_counter(model=self.model, text=text)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Returns the embeddings of the texts with an embedding model."""
+        lazy_import("litellm")
+        import litellm
+
+        response = litellm.embedding(
+            model=self.model,
+            input=texts,
+            api_key=self.api_key,
+            api_base=self.base_url,
+        )
+        return [item["embedding"] for item in response.data]
+
+    @property
+    def context_size(self) -> int | None:
+        """The maximum number of input tokens of the model, if known."""
+        lazy_import("litellm")
+        import litellm
+
+        try:
+            return litellm.get_model_info(self.model).get("max_input_tokens")
+        except Exception:
+            return None
+
+    @property
+    def rate_key(self) -> str:
+        """The key of the token bucket, shared by backends with the same limit."""
+        config = (
+            f"{self.model}|{self.base_url}|{self.api_key}|{self.requests_per_minute}"
+        )
+        return "litellm:" + hashlib.sha256(config.encode("utf-8")).hexdigest()
+
+    def rate_limit(self, requests: int = 1) -> None:
+        """Blocks until the given number of requests is allowed by the rate limit."""
+        if self.requests_per_minute:
+            token_bucket(self.rate_key, self.requests_per_minute / 60).acquire(requests)
+
+    async def arate_limit(self) -> None:
+        """Waits until a request is allowed by the rate limit."""
+        if self.requests_per_minute:
+            await token_bucket(self.rate_key, self.requests_per_minute / 60).aacquire()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore | None:
+        """The semaphore limiting the requests in flight on the running event loop."""
+        if not self.max_concurrency:
+            return None
+        if self._semaphores is None:
+            self._semaphores = weakref.WeakKeyDictionary()
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    @property
+    def session(self) -> Any:
+        """
+        The HTTP session of the backend on the running event loop, with a pool of at
+        most `max_connections` connections.
+        """
+        aiohttp = lazy_import("aiohttp")
+        if self._sessions is None:
+            self._sessions = weakref.WeakKeyDictionary()
+        # Sessions are kept by connection limit, so that changing the limit does not
+        # close the connections of the requests in flight
+        sessions = self._sessions.setdefault(asyncio.get_running_loop(), {})
+        session = sessions.get(self.max_connections)
+        if session is None or session.closed:
+            session = sessions[self.max_connections] = aiohttp.ClientSession(  # type: ignore
+                connector=aiohttp.TCPConnector(limit=self.max_connections)  # type: ignore
+            )
+        return session
+
+    async def aclose(self) -> None:
+        """Closes the HTTP sessions of the backend on the running event loop."""
+        if self._sessions is not None:
+            sessions = self._sessions.pop(asyncio.get_running_loop(), {})
+            for session in sessions.values():
+                await session.close()
 
     def __call__(
         self,
         input: str | List[str] | List[Message] | List[List[Message]] = "",
         schema: Optional[Dict] = None,
-        **kwargs
+        **kwargs,
     ) -> Message | List[Message]:
         lazy_import("litellm")
         import litellm
 
-        params = (
-            self.model_dump(exclude={"name", "chat"})
-            | dict(response_format=model_from_schema(schema) if schema else None)
-            | kwargs
-        )
+        params = self.params(schema, **kwargs)
+        # Batch API jobs count as a single request
+        batch = isinstance(input, list) and not is_message_list(input)
+        self.rate_limit(len(input) if batch and not self.batch_api else 1)
         if self.chat:
             # Chat mode
             if is_message_list(input):
@@ -60,10 +232,12 @@ class LiteLLMBackend(Base):
                         messages=[message.dump() for message in input], **params
                     )
                 ]
+            elif isinstance(input, list) and self.batch_api:
+                output = self.batch_call(input, schema, **kwargs)
             elif isinstance(input, list):
                 output = litellm.batch_completion(
                     messages=[[dict(role="user", content=_in)] for _in in input],
-                    **params
+                    **params,
                 )
             else:
                 output = [
@@ -71,7 +245,10 @@ class LiteLLMBackend(Base):
                         messages=[dict(role="user", content=input)], **params
                     )
                 ]
-            output = [Message.from_openai_v1(_out) for _out in output]
+            output = [
+                _out if isinstance(_out, Message) else Message.from_openai_v1(_out)
+                for _out in output
+            ]
         else:
             # Text generation mode
             if isinstance(input, str):
@@ -86,3 +263,142 @@ class LiteLLMBackend(Base):
         if isinstance(output, list) and len(output) == 1:
             return output[0]
         return output
+
+    def batch_call(
+        self, input: List[str], schema: Optional[Dict] = None, **kwargs
+    ) -> List[Message]:
+        """
+        Runs chat completions through the OpenAI-compatible batch API. The requests
+        are uploaded as a JSONL file, the batch job is polled until it ends, and the
+        responses are returned in the same order as the inputs.
+        """
+        lazy_import("openai")
+        import openai
+
+        client = openai.OpenAI(
+            base_url=self.base_url,
+            api_key=self.api_key,
+            max_retries=self.max_retries,
+            timeout=self.timeout,
+        )
+        body = {
+            key: value
+            for key, value in (self.model_dump() | kwargs).items()
+            if key in BATCH_BODY_FIELDS and value is not None
+        }
+        body["model"] = self.model.removeprefix("openai/")
+        if schema:
+            body["response_format"] = dict(
+                type="json_schema",
+                json_schema=dict(name=schema.get("title", "Output"), schema=schema),
+            )
+        requests = "".join(
+            json_dumps(
+                dict(
+                    custom_id=str(i),
+                    method="POST",
+                    url="/v1/chat/completions",
+                    body=body | dict(messages=[dict(role="user", content=_in)]),
+                )
+            )
+            + "\n"
+            for i, _in in enumerate(input)
+        )
+        input_file = client.files.create(
+            file=("batch.jsonl", requests.encode()), purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        while batch.status not in BATCH_END_STATES:
+            time.sleep(self.batch_poll_interval)
+            batch = client.batches.retrieve(batch.id)
+        if batch.status != "completed" or not batch.output_file_id:
+            raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+
+        # Map the responses back to the inputs
+        output: List[Optional[Message]] = [None] * len(input)
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json_loads(line)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                continue
+            message = response["body"]["choices"][0]["message"]
+            output[int(result["custom_id"])] = Message(
+                unprocessed=message.get("content") or "",
+                role=message.get("role", "assistant"),
+            )
+        failed = [i for i, _out in enumerate(output) if _out is None]
+        if failed:
+            raise RuntimeError(f"Batch {batch.id} failed for the inputs {failed}")
+        return output  # type: ignore
+
+    async def acall(
+        self,
+        input: str | List[str] | List[Message] | List[List[Message]] = "",
+        schema: Optional[Dict] = None,
+        **kwargs,
+    ) -> Message | List[Message]:
+        """
+        Asynchronous version of `__call__`. Lists of inputs are sent as concurrent
+        requests, subject to the concurrency and rate limits. Streamed responses are
+        collected before returning.
+        """
+        lazy_import("litellm")
+        import litellm
+
+        params = self.params(schema, **kwargs)
+        session = self.session
+
+        async def request(messages=None, prompt=None) -> Message:
+            semaphore = self.semaphore
+            if semaphore:
+                await semaphore.acquire()
+            try:
+                await self.arate_limit()
+                if messages is not None:
+                    response = await litellm.acompletion(
+                        messages=messages, shared_session=session, **params
+                    )
+                    if isinstance(response, AsyncIterator):
+                        content = [
+                            c.choices[0].delta.content or "" async for c in response
+                        ]
+                        return Message("".join(content))
+                    return Message.from_openai_v1(response)
+                response = await litellm.atext_completion(prompt, **params)
+                if isinstance(response, AsyncIterator):
+                    content = [c["choices"][0]["text"] or "" async for c in response]
+                    return Message("".join(content))
+                content = response["choices"][0]["text"]
+                return Message(content if isinstance(content, str) else "")
+            finally:
+                if semaphore:
+                    semaphore.release()
+
+        if self.chat:
+            # Chat mode
+            if is_message_list(input):
+                output = [await request(messages=[message.dump() for message in input])]
+            elif isinstance(input, list):
+                output = await asyncio.gather(
+                    *(
+                        request(messages=[dict(role="user", content=_in)])
+                        for _in in input
+                    )
+                )
+            else:
+                output = [await request(messages=[dict(role="user", content=input)])]
+        else:
+            # Text generation mode
+            if isinstance(input, str):
+                output = [await request(prompt=input)]
+            else:
+                raise ValueError("The input must be a string")
+        if len(output) == 1:
+            return output[0]
+        return list(output)
@@ -2,14 +2,14 @@ import json
 import multiprocessing
 import os
 from importlib import import_module
-from typing import Any, Dict, Iterator, List, Literal, Optional
+from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple
 
 import huggingface_hub
 from pydantic import model_validator
 
 from lmfunctions.base import Base
 from lmfunctions.message import Message, is_message_list
-from lmfunctions.utils import cuda_check, lazy_import, pip_install
+from lmfunctions.utils import changed_keys, cuda_check, lazy_import, pip_install
 
 
 def llama_cpp_install():
@@ -29,6 +29,18 @@ def llama_ccp_import():
     lazy_import("llama_cpp", import_error_callback=import_error_callback)
 
 
+def fast_forward_supported(llama: Any) -> bool:
+    """
+    Returns whether the model exposes the evaluated tokens, the context and the
+    logits used by fast-forward decoding, as llama-cpp-python 0.3 does.
+    """
+    import llama_cpp
+
+    return hasattr(llama_cpp, "llama_get_logits_ith") and all(
+        hasattr(llama, name) for name in ("input_ids", "n_tokens", "ctx", "eval")
+    )
+
+
 class LLamaCppGenerationParams(Base):
     """
     Parameters controlling generation with the LLamaCpp model.
@@ -58,7 +70,33 @@ class LLamaCppGenerationParams(Base):
 class LlamaCppBackend(Base):
     """
     LLamaCpp model configuration.  The model is loaded lazily, only when it is accessed.
-    If any of the arguments get modified, the current model is unloaded.
+    If any of the load parameters get modified, the current model is unloaded and a
+    ``model_reload`` event is emitted on the default event manager. Changes to the
+    generation parameters or to the chat mode do not unload the model.
+
+    When `prompt_lookup_num_tokens` is set, generation uses prompt lookup decoding:
+    up to `prompt_lookup_num_tokens` draft tokens are copied from the prompt after
+    a match of the last `prompt_lookup_max_ngram_size` tokens, and are verified in
+    a single forward pass, which speeds up outputs that copy spans of the input.
+
+    When `fast_forward` is set, outputs constrained by a schema are generated with
+    fast-forward decoding: the text determined by the schema (keys, separators and
+    the remaining characters of enum literals) is appended without sampling, and
+    its tokens are evaluated in a single batched forward pass. Fields are generated
+    in the order of the schema, without optional whitespace. Only the temperature,
+    top-k, top-p, maximum tokens, seed and streaming generation parameters apply.
+    With versions of llama-cpp-python not exposing the state of the model used by
+    the decoder, outputs are generated with the constrained decoding instead.
+    The decodings share the context of the model: the tokens of each sequence are
+    kept with the decoding, and the part of the sequence replaced in the context by
+    other calls is evaluated again, so decodings can be interleaved in a thread but
+    not run concurrently in several threads, like the other calls to the model.
+
+    The model reuses the KV cache of the longest prefix shared with the previous
+    prompt, e.g. the earlier turns of a conversation. When `prompt_cache` is set,
+    the model states after each completion are also kept in a cache in memory
+    (``"ram"``) or on disk (``"disk"``) of at most `prompt_cache_bytes` bytes, so that
+    the prefix is reused when prompts of several conversations are interleaved.
     """
 
     name: Literal["llamacpp"] = "llamacpp"
@@ -97,10 +135,17 @@ class LlamaCppBackend(Base):
     numa: bool = False
     chat_format: str | None = None
     verbose: bool = False
+    prompt_lookup_num_tokens: int | None = None
+    prompt_lookup_max_ngram_size: int = 2
+    prompt_cache: Literal["ram", "disk"] | None = None
+    prompt_cache_bytes: int = 2 << 30
     chat: bool = True
+    fast_forward: bool = False
     generation: LLamaCppGenerationParams = LLamaCppGenerationParams()
 
     _llama: Any = None
+    _decoder: Any = None
+    _loaded_params: Dict[str, Any] | None = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -113,30 +158,166 @@ class LlamaCppBackend(Base):
         if self.n_threads is None:
             self.n_threads = multiprocessing.cpu_count() // 2
 
+    @property
+    def load_params(self) -> Dict[str, Any]:
+        """Parameters used to load the model."""
+        return self.model_dump(exclude={"name", "generation", "chat", "fast_forward"})
+
     @property
     def llama(self):
         if self._llama is None:
             llama_ccp_import()
             from llama_cpp import Llama
 
-            model_reference = self.model
+            load_params = self.load_params
+            model_reference = load_params.pop("model")
+            num_pred_tokens = load_params.pop("prompt_lookup_num_tokens")
+            max_ngram_size = load_params.pop("prompt_lookup_max_ngram_size")
+            prompt_cache = load_params.pop("prompt_cache")
+            prompt_cache_bytes = load_params.pop("prompt_cache_bytes")
+            if num_pred_tokens:
+                from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+                load_params["draft_model"] = LlamaPromptLookupDecoding(
+                    max_ngram_size=max_ngram_size, num_pred_tokens=num_pred_tokens
+                )
             if model_reference.startswith("hf://"):
                 components = model_reference.split("://")[1].split("/")
                 repo_id, filename = "/".join(components[0:2]), components[-1]
                 model_path = huggingface_hub.hf_hub_download(repo_id, filename)
             else:
                 model_path = model_reference
-            self._llama = Llama(
-                model_path=model_path,
-                **self.model_dump(exclude={"name", "model", "generation", "chat"})
-            )
+            self._llama = Llama(model_path=model_path, **load_params)
+            if prompt_cache:
+                from llama_cpp import LlamaDiskCache, LlamaRAMCache
+
+                cache_class = LlamaRAMCache if prompt_cache == "ram" else LlamaDiskCache
+                self._llama.set_cache(cache_class(capacity_bytes=prompt_cache_bytes))
+            self._loaded_params = self.load_params
         return self._llama
 
+    def count_tokens(self, text: str) -> int:
+        """Returns the number of tokens of the text."""
+        return len(self.llama.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Returns the embeddings of the texts, which requires `embedding` enabled."""
+        if not self.embedding:
+            raise ValueError("Embeddings require a model loaded with embedding=True.")
+        return self.llama.embed(texts)
+
+    @property
+    def context_size(self) -> int:
+        """The context size of the loaded model in tokens."""
+        return self.llama.n_ctx()
+
+    @property
+    def decoder(self) -> Any:
+        """The `FastForwardDecoder` of the loaded model."""
+        if self._decoder is None:
+            from lmformatenforcer.integrations.llamacpp import (
+                build_token_enforcer_tokenizer_data,
+            )
+
+            from lmfunctions.backends.fastforward import FastForwardDecoder
+
+            llama = self.llama
+            self._decoder = FastForwardDecoder(
+                build_token_enforcer_tokenizer_data(llama),
+                tokenize=lambda text: llama.tokenize(
+                    text.encode("utf-8"), add_bos=False
+                ),
+                prefill=self._extend,
+                extend=self._extend,
+            )
+        return self._decoder
+
+    def _extend(
+        self, tokens: List[int], sequence: List[int] = []
+    ) -> Tuple[Any, List[int]]:
+        """
+        Evaluates the tokens appended to the sequence of a decoding, returning the
+        logits and the extended sequence. The KV cache of the longest prefix of the
+        sequence shared with the context of the model is reused, so that the part
+        replaced by other calls (e.g. interleaved decodings) is evaluated again.
+        """
+        import numpy as np
+        from llama_cpp import llama_get_logits_ith
+
+        llama = self.llama
+        sequence = sequence + tokens
+        # At least the last token is evaluated, for its logits
+        size = min(llama.n_tokens, len(sequence) - 1)
+        mismatches = np.flatnonzero(
+            llama.input_ids[:size] != np.asarray(sequence[:size])
+        )
+        llama.n_tokens = int(mismatches[0]) if len(mismatches) else size
+        llama.eval(sequence[llama.n_tokens :])
+        logits = llama_get_logits_ith(llama.ctx, -1)
+        logits = np.ctypeslib.as_array(logits, shape=(llama.n_vocab(),)).copy()
+        return logits, sequence
+
+    def prompt_tokens(self, input: str | List[Message]) -> List[int]:
+        """Returns the tokens of the prompt, formatted with the chat template."""
+        llama = self.llama
+        if self.chat and "tokenizer.chat_template" in llama.metadata:
+            from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+
+            def token_text(token: int) -> str:
+                if token == -1:
+                    return ""
+                text = llama.detokenize([token], special=True)
+                return text.decode("utf-8", errors="ignore")
+
+            formatter = Jinja2ChatFormatter(
+                template=llama.metadata["tokenizer.chat_template"],
+                eos_token=token_text(llama.token_eos()),
+                bos_token=token_text(llama.token_bos()),
+            )
+            prompt = formatter(
+                messages=(
+                    [message.dump() for message in input]
+                    if is_message_list(input)
+                    else [dict(role="user", content=input)]
+                )
+            )
+            return llama.tokenize(
+                prompt.prompt.encode("utf-8"),
+                add_bos=not prompt.added_special,
+                special=True,
+            )
+        if not isinstance(input, str):
+            raise ValueError("The input must be a string.")
+        return llama.tokenize(input.encode("utf-8"))
+
+    def fast_forward_call(
+        self, input: str | List[Message], schema: Dict, **kwargs
+    ) -> Message:
+        """Generates an output constrained by the schema with fast-forward decoding."""
+        params = self.generation.model_dump() | kwargs
+        pieces = self.decoder(
+            self.prompt_tokens(input),
+            schema,
+            temperature=params["temperature"],
+            top_k=params["top_k"],
+            top_p=params["top_p"],
+            max_tokens=params["max_tokens"],
+            seed=params["seed"],
+        )
+        return Message(pieces if params["stream"] else "".join(pieces))
+
     @model_validator(mode="after")
     def unload(self):
-        # Force the model to be reloaded when the parameters are changed
-        if self._llama:
-            self._llama = None
+        # Force the model to be reloaded only when the load parameters are changed
+        load_params = self.load_params
+        if self._llama and self._loaded_params != load_params:
+            changed_params = changed_keys(self._loaded_params, load_params)
+            self._llama = self._decoder = None
+            from lmfunctions.default import default
+
+            default.event_manager(
+                "model_reload", backend=self, changed_params=changed_params
+            )
         return self
 
     def __call__(
@@ -147,6 +328,9 @@ class LlamaCppBackend(Base):
     ) -> Message:
         llama_ccp_import()
 
+        if self.fast_forward and schema and fast_forward_supported(self.llama):
+            return self.fast_forward_call(input, schema, **kwargs)
+
         if self.chat and "tokenizer.chat_template" in self.llama.metadata:
             # Chat mode
             params = (
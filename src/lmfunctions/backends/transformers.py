@@ -1,16 +1,35 @@
 import gc
 from importlib import import_module
-from typing import Any, Dict, List, Literal, Optional
+from typing import Any, Dict, List, Literal, Optional, Tuple
 
 from lmformatenforcer import JsonSchemaParser
 from pydantic import model_validator
 
 from lmfunctions.base import Base
 from lmfunctions.message import Message, is_message_list
-from lmfunctions.utils import cuda_check, lazy_import, pip_install
+from lmfunctions.utils import changed_keys, cuda_check, lazy_import, pip_install
 
 
 class TransformersBackend(Base):
+    """
+    Transformers pipeline configuration. The pipeline is loaded lazily, only when it
+    is accessed. If any of the load parameters get modified, the current pipeline is
+    unloaded and a ``model_reload`` event is emitted on the default event manager.
+    Changes to the generation parameters or to the chat mode do not unload the model.
+
+    Generation can be sped up with speculative decoding: with prompt lookup
+    decoding, up to `prompt_lookup_num_tokens` draft tokens are copied from the
+    prompt, while with assisted generation the draft tokens are generated by the
+    smaller `assistant_model`, sharing the tokenizer of the model. Draft tokens are
+    verified by the model in a single forward pass.
+
+    When `fast_forward` is set, outputs constrained by a schema are generated with
+    fast-forward decoding: the text determined by the schema is appended without
+    sampling, and its tokens are evaluated in a single batched forward pass. Only
+    the sampling, temperature, top-k, top-p and maximum new tokens generation
+    parameters apply.
+    """
+
     name: Literal["transformers"] = "transformers"
     model: str = "Qwen/Qwen2-0.5B-Instruct"
     config: str | None = None
@@ -27,8 +46,14 @@ class TransformersBackend(Base):
     pipeline_class: Any | None = None
     chat: bool = True
     generation: Dict[str, Any] = {}
+    prompt_lookup_num_tokens: int | None = None
+    assistant_model: str | None = None
+    fast_forward: bool = False
 
     _pipeline: Any = None
+    _assistant: Any = None
+    _decoder: Any = None
+    _loaded_params: Dict[str, Any] | None = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -38,6 +63,20 @@ class TransformersBackend(Base):
             if gpu_info["cuda_available"]:
                 self.device = "cuda"
 
+    @property
+    def load_params(self) -> Dict[str, Any]:
+        """Parameters used to load the pipeline."""
+        return self.model_dump(
+            exclude={
+                "name",
+                "generation",
+                "chat",
+                "prompt_lookup_num_tokens",
+                "fast_forward",
+            },
+            exclude_none=True,
+        )
+
     @property
     def pipeline(self):
         def import_error_callback(name, package):
@@ -50,17 +89,21 @@ class TransformersBackend(Base):
 
                 tokenizer = transformers.AutoTokenizer.from_pretrained(self.model)
 
+                load_params = self.load_params
+                assistant_model = load_params.pop("assistant_model", None)
                 self._pipeline = transformers.pipeline(
                     task="text-generation",
                     tokenizer=tokenizer,
-                    **self.model_dump(
-                        exclude={"name", "generation", "chat"},
-                        exclude_none=True,
-                    ),
+                    **load_params,
                 )
+                if assistant_model:
+                    self._assistant = transformers.AutoModelForCausalLM.from_pretrained(
+                        assistant_model, token=self.token
+                    ).to(self._pipeline.model.device)
                 self._pipeline.model.generation_config.pad_token_id = (
                     tokenizer.eos_token_id
                 )
+                self._loaded_params = self.load_params
 
             else:
                 raise ImportError(
@@ -68,8 +111,18 @@ class TransformersBackend(Base):
                 )  # pragma: no cover
         return self._pipeline
 
+    def count_tokens(self, text: str) -> int:
+        """Returns the number of tokens of the text."""
+        return len(self.pipeline.tokenizer.encode(text, add_special_tokens=False))
+
+    @property
+    def context_size(self) -> int | None:
+        """The maximum sequence length of the model in tokens, if known."""
+        return getattr(self.pipeline.model.config, "max_position_embeddings", None)
+
     def _unload(self):
         self._pipeline = None
+        self._assistant = self._decoder = None
         gc.collect()
         try:
             import torch
@@ -79,11 +132,96 @@ class TransformersBackend(Base):
             pass  # pragma: no cover
         return self
 
+    @property
+    def decoder(self) -> Any:
+        """The `FastForwardDecoder` of the loaded model."""
+        if self._decoder is None:
+            from lmformatenforcer.integrations.transformers import (
+                build_token_enforcer_tokenizer_data,
+            )
+
+            from lmfunctions.backends.fastforward import FastForwardDecoder
+
+            tokenizer = self.pipeline.tokenizer
+            self._decoder = FastForwardDecoder(
+                build_token_enforcer_tokenizer_data(tokenizer),
+                tokenize=lambda text: tokenizer.encode(text, add_special_tokens=False),
+                prefill=self._extend,
+                extend=self._extend,
+            )
+        return self._decoder
+
+    def _extend(self, tokens: List[int], past: Any = None) -> Tuple[Any, Any]:
+        # The KV cache of the sequence belongs to the call
+        import torch
+
+        model = self.pipeline.model
+        with torch.no_grad():
+            output = model(
+                input_ids=torch.tensor([tokens], device=model.device),
+                past_key_values=past,
+                use_cache=True,
+            )
+        return output.logits[0, -1].float().cpu().numpy(), output.past_key_values
+
+    def prompt_tokens(self, input: str | List[Message]) -> List[int]:
+        """Returns the tokens of the prompt, formatted with the chat template."""
+        tokenizer = self.pipeline.tokenizer
+        if self.chat and getattr(tokenizer, "chat_template", None):
+            return tokenizer.apply_chat_template(
+                (
+                    [message.dump() for message in input]
+                    if is_message_list(input)
+                    else [dict(role="user", content=input)]
+                ),
+                add_generation_prompt=True,
+                tokenize=True,
+            )
+        if not isinstance(input, str):
+            raise ValueError("The input must be a string or a list of strings.")
+        return tokenizer.encode(input)
+
+    def fast_forward_call(
+        self, input: str | List[str] | List[Message], schema: Dict, **kwargs
+    ) -> Message | List[Message]:
+        """Generates outputs constrained by the schema with fast-forward decoding."""
+        params = self.generation | kwargs
+        sample = params.get("do_sample", False)
+        output = [
+            Message(
+                "".join(
+                    self.decoder(
+                        self.prompt_tokens(_in),
+                        schema,
+                        temperature=params.get("temperature", 1.0) if sample else 0,
+                        top_k=params.get("top_k", 50),
+                        top_p=params.get("top_p", 1.0),
+                        max_tokens=params.get("max_new_tokens"),
+                    )
+                )
+            )
+            for _in in (
+                input
+                if isinstance(input, list) and not is_message_list(input)
+                else [input]
+            )
+        ]
+        if len(output) == 1:
+            return output[0]
+        return output
+
     @model_validator(mode="after")
     def unload(self):
-        # Force the model to be reloaded when the parameters are changed
-        if self._pipeline:
+        # Force the model to be reloaded only when the load parameters are changed
+        load_params = self.load_params
+        if self._pipeline and self._loaded_params != load_params:
+            changed_params = changed_keys(self._loaded_params, load_params)
             self._unload()
+            from lmfunctions.default import default
+
+            default.event_manager(
+                "model_reload", backend=self, changed_params=changed_params
+            )
         return self
 
     @property
@@ -110,6 +248,9 @@ class TransformersBackend(Base):
         ):
             self.generation["max_new_tokens"] = 4096
 
+        if self.fast_forward and schema:
+            return self.fast_forward_call(input, schema, **kwargs)
+
         if schema and self.pipeline.tokenizer:
             prefix_function = self.prefix_fn(
                 self.pipeline.tokenizer, JsonSchemaParser(schema)
@@ -117,8 +258,16 @@ class TransformersBackend(Base):
         else:
             prefix_function = None
 
+        speculative = (
+            dict(prompt_lookup_num_tokens=self.prompt_lookup_num_tokens)
+            if self.prompt_lookup_num_tokens
+            else {}
+        ) | (dict(assistant_model=self._assistant) if self._assistant else {})
         params = (
-            self.generation | dict(prefix_allowed_tokens_fn=prefix_function) | kwargs
+            self.generation
+            | speculative
+            | dict(prefix_allowed_tokens_fn=prefix_function)
+            | kwargs
         )
 
         if (
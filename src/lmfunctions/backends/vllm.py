@@ -6,10 +6,16 @@ from pydantic import model_validator
 
 from lmfunctions.base import Base
 from lmfunctions.message import Message, is_message_list
-from lmfunctions.utils import lazy_import, pip_install
+from lmfunctions.utils import changed_keys, lazy_import, pip_install
 
 
 class VLLMBackend(Base):
+    """
+    vLLM engine configuration. The engine is loaded lazily, only when it is accessed.
+    If any of the load parameters get modified, the current engine is unloaded and a
+    ``model_reload`` event is emitted on the default event manager. Changes to the
+    sampling parameters or to the chat mode do not unload the model.
+    """
 
     name: Literal["vllm"] = "vllm"
     model: str = "Qwen/Qwen2-0.5B-Instruct"
@@ -37,6 +43,14 @@ class VLLMBackend(Base):
     sampling_params: Dict[str, Any] = {}
 
     _lm: Any = None
+    _loaded_params: Dict[str, Any] | None = None
+
+    @property
+    def load_params(self) -> Dict[str, Any]:
+        """Parameters used to load the engine."""
+        return self.model_dump(
+            exclude={"name", "sampling_params", "chat"}, exclude_none=True
+        )
 
     @property
     def lm(self):
@@ -48,15 +62,21 @@ class VLLMBackend(Base):
             if lazy_import("vllm", import_error_callback=import_error_callback):
                 from vllm import LLM
 
-                params = self.model_dump(
-                    exclude={"name", "sampling_params", "chat"},
-                    exclude_none=True,
-                )
-                self._lm = LLM(**params)
+                self._lm = LLM(**self.load_params)
+                self._loaded_params = self.load_params
             else:
                 raise ImportError("The package 'vllm' is required")  # pragma: no cover
         return self._lm
 
+    def count_tokens(self, text: str) -> int:
+        """Returns the number of tokens of the text."""
+        return len(self.lm.get_tokenizer().encode(text, add_special_tokens=False))
+
+    @property
+    def context_size(self) -> int:
+        """The maximum sequence length of the engine in tokens."""
+        return self.lm.llm_engine.model_config.max_model_len
+
     def _unload(self):
         self._lm = None
         gc.collect()
@@ -71,9 +91,16 @@ class VLLMBackend(Base):
 
     @model_validator(mode="after")
     def unload(self):
-        # Force the model to be reloaded when the parameters are changed
-        if self._lm:
+        # Force the model to be reloaded only when the load parameters are changed
+        load_params = self.load_params
+        if self._lm and self._loaded_params != load_params:
+            changed_params = changed_keys(self._loaded_params, load_params)
             self._unload()
+            from lmfunctions.default import default
+
+            default.event_manager(
+                "model_reload", backend=self, changed_params=changed_params
+            )
         return self
 
     def __call__(
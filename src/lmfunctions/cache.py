@@ -0,0 +1,204 @@
+import copy
+import hashlib
+import logging
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, model_validator
+from typing_extensions import Annotated
+
+from lmfunctions.backends import LiteLLMBackend, LlamaCppBackend
+from lmfunctions.base import Base
+from lmfunctions.examples import ExampleSelector
+from lmfunctions.message import is_message_list
+from lmfunctions.utils import VectorIndex, json_dumps
+
+EmbeddingBackend = Annotated[
+    LlamaCppBackend | LiteLLMBackend, Field(discriminator="name")
+]
+
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+
+DEFAULT_EMBEDDING_MODEL = (
+    "hf://nomic-ai/nomic-embed-text-v1.5-GGUF/nomic-embed-text-v1.5.Q4_K_M.gguf"
+)
+
+logger = logging.getLogger(__name__)
+
+
+def jsonable(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (list, tuple)):
+        return [jsonable(item) for item in obj]
+    return obj
+
+
+class SemanticCache(Base):
+    """
+    A cache of the outputs of language functions, which also returns the output of
+    near-duplicate inputs.
+
+    Inputs are normalized to a canonical text (JSON with sorted keys, collapsed
+    whitespace) and looked up exactly first. Otherwise, the input is embedded with
+    the embedding `backend` (by default, a nomic-embed-text model run with
+    llama.cpp) and the output of the most similar cached input is returned if
+    their cosine similarity is at least `threshold`. Thresholds can be set for
+    each function name in `thresholds`, a threshold above 1 disabling
+    near-duplicate matches and the embedding of inputs. When `match_numbers` is
+    enabled, near-duplicate inputs must also contain the same numbers, since
+    embeddings hardly tell them apart. If the embedding backend fails, the cache
+    falls back to exact matches.
+
+    Outputs are cached separately for each definition of a function call, i.e. the
+    name, description, schemas and metaprompt of the function, the examples and the
+    backend model, so that a changed function never returns the outputs of its
+    previous definition. Each definition caches at most `max_entries` outputs in an
+    in-memory vector index, the oldest being evicted first. Outputs are copied when
+    they are returned.
+    """
+
+    backend: EmbeddingBackend | None = None
+    threshold: float = 0.95
+    thresholds: Dict[str, float] = {}
+    match_numbers: bool = True
+    max_entries: int = 10000
+
+    _indexes: Dict[str, VectorIndex] = {}
+    _index_params: Dict[str, Any] | None = None
+    _lock: Any = None
+    _default_backend: Any = None
+
+    @model_validator(mode="after")
+    def reset_indexes(self):
+        # The cached outputs are dropped when the embeddings or the capacity change
+        index_params = self.model_dump(include={"backend", "max_entries"})
+        if self._index_params != index_params:
+            self._indexes = {}
+            self._index_params = index_params
+        if self._lock is None:
+            self._lock = threading.Lock()
+        return self
+
+    @property
+    def embedding_backend(self) -> LlamaCppBackend | LiteLLMBackend:
+        """The embedding backend, the default one being created when first used."""
+        if self.backend is not None:
+            return self.backend
+        if self._default_backend is None:
+            self._default_backend = LlamaCppBackend(
+                model=DEFAULT_EMBEDDING_MODEL, embedding=True
+            )
+        return self._default_backend
+
+    @staticmethod
+    def definition_key(func: Any, examples: Any = None, backend: Any = None) -> str:
+        """Returns the hash of the definition of a function call."""
+        if isinstance(examples, ExampleSelector):
+            examples = examples.examples
+        definition = dict(
+            name=func.name,
+            description=func.description,
+            input_schema=func.input_schema,
+            output_schema=func.output_schema,
+            metaprompt=func.metaprompt,
+            examples=jsonable(examples or []),
+            backend=[getattr(backend, "name", None), getattr(backend, "model", None)],
+        )
+        return hashlib.sha256(
+            json_dumps(definition, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def index(
+        self, func: Any, examples: Any = None, backend: Any = None
+    ) -> VectorIndex:
+        key = self.definition_key(func, examples, backend)
+        index = self._indexes.get(key)
+        if index is None:
+            with self._lock:
+                index = self._indexes.setdefault(key, VectorIndex(self.max_entries))
+        return index
+
+    @staticmethod
+    def key(input: Any) -> str:
+        """Returns the canonical text of an input."""
+        if isinstance(input, BaseModel):
+            input = input.model_dump(mode="json")
+        text = input if isinstance(input, str) else json_dumps(input, sort_keys=True)
+        return " ".join(text.split())
+
+    def match(self, key: str, cached_key: Optional[str]) -> bool:
+        """Returns whether a near-duplicate input passes the precision guardrails."""
+        return cached_key is not None and (
+            not self.match_numbers
+            or NUMBER_PATTERN.findall(key) == NUMBER_PATTERN.findall(cached_key)
+        )
+
+    def get(
+        self, func: Any, inputs: List[Any], examples: Any = None, backend: Any = None
+    ) -> Tuple[Dict[int, Tuple[Any, float]], List[Optional[Tuple[str, Any]]]]:
+        """
+        Looks up the outputs of a function call for a list of inputs.
+
+        Args:
+            func (LMFunc): The language function.
+            inputs (List[Any]): The inputs.
+            examples (List | ExampleSelector, optional): The examples of the call.
+            backend (LMBackend, optional): The backend of the call.
+
+        Returns:
+            Tuple: The cached outputs with their similarity, by position of the input,
+            and for each input that missed the cache, its key and embedding (None
+            if not embedded) to store its output with `put` (None for inputs that
+            cannot be cached).
+        """
+        index = self.index(func, examples, backend)
+        threshold = self.thresholds.get(func.name, self.threshold)
+        hits, misses = {}, {}
+        for i, input in enumerate(inputs):
+            if is_message_list(input):
+                continue
+            key = self.key(input)
+            found, output = index.get(key)
+            if found:
+                hits[i] = (copy.deepcopy(output), 1.0)
+            else:
+                misses[i] = key
+        # Inputs missing the exact lookup are embedded in a single call
+        vectors: List[Any] = [None] * len(misses)
+        if misses and threshold <= 1:
+            try:
+                vectors = self.embedding_backend.embed(list(misses.values()))
+            except Exception as exception:
+                logger.warning(
+                    "Embedding failed, falling back to exact matches: %s", exception
+                )
+        entries = {}
+        for (i, key), vector in zip(misses.items(), vectors):
+            if vector is not None:
+                similarity, cached_key, output = index.search(vector)
+                if similarity >= threshold and self.match(key, cached_key):
+                    hits[i] = (copy.deepcopy(output), similarity)
+                    continue
+            entries[i] = (key, vector)
+        return hits, [entries.get(i) for i in range(len(inputs)) if i not in hits]
+
+    def put(
+        self,
+        func: Any,
+        entries: List[Optional[Tuple[str, Any]]],
+        outputs: List[Any],
+        examples: Any = None,
+        backend: Any = None,
+    ) -> None:
+        """Stores the outputs of the inputs that missed the cache."""
+        index = self.index(func, examples, backend)
+        for entry, output in zip(entries, outputs):
+            if entry is not None:
+                key, vector = entry
+                index.add(key, vector, copy.deepcopy(output))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes = {}
@@ -1,15 +1,20 @@
 from functools import partial
-from typing import Callable, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from rich import print
 
 from lmfunctions.backends import LMBackend
+from lmfunctions.base import Base
 from lmfunctions.default import default
 from lmfunctions.eventmanager import EventManager
+from lmfunctions.examples import context_size, count_tokens
 from lmfunctions.lmfunc import lmdef
 from lmfunctions.managers import tokenStream
 from lmfunctions.message import Message
 
+# Estimated tokens added by the chat template to each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
 
 def multiline_input(terminators=tuple()):
     """
@@ -56,6 +61,164 @@ def initialize_chat(backend: LMBackend):
 def chatmessage(messages: List[Message]) -> Message: ...  # type: ignore
 
 
+@lmdef
+def summarize_conversation(summary: str, messages: List[Message]) -> str:  # type: ignore
+    """
+    Updates the summary of a conversation with the new messages, keeping the facts,
+    decisions, preferences and open questions needed to continue the conversation
+    """
+    ...  # pragma: no cover
+
+
+class ChatSession(Base):
+    """
+    A conversation with a language model, with a history bounded by a token budget.
+
+    The budget is `max_tokens` tokens, counted with the tokenizer of the backend,
+    or by default the context size of the backend minus `reserve_tokens` tokens
+    left for the response. The number of messages can also be bounded by
+    `max_messages`. When the history exceeds the budget, the oldest messages are
+    dropped at once, down to a `keep_fraction` of the budget, rather than one at a
+    time. The beginning of the conversation then stays the same for several turns,
+    so that backends reusing the cached prefix of the previous prompt (the
+    `prompt_cache` of the llamacpp backend, the prefix caching of vLLM) only
+    evaluate the new messages, keeping a constant latency per turn.
+
+    When `summarize` is enabled, the dropped messages are folded into a running
+    summary of the conversation, sent in its own message after the system message,
+    so that the system message stays the same prefix of every prompt.
+    """
+
+    system_message: str | None = None
+    messages: List[Message] = []
+    summary: str = ""
+    max_tokens: int | None = None
+    max_messages: int | None = None
+    reserve_tokens: int = 1024
+    keep_fraction: float = 0.5
+    summarize: bool = False
+
+    _token_counts: Dict[Tuple[Any, str, str], int] = {}
+
+    @property
+    def context(self) -> List[Message]:
+        """
+        The messages sent to the backend: the system message, the summary and the
+        history.
+        """
+        context = []
+        if self.system_message:
+            context.append(Message(role="system", content=self.system_message))
+        if self.summary:
+            content = "Summary of the earlier conversation:\n" + self.summary
+            context.append(Message(role="system", content=content))
+        return context + self.messages
+
+    def count_tokens(self, message: Message, backend: Any) -> int:
+        """Returns the number of tokens of a message, including the template."""
+        key = (getattr(backend, "model", None), message.role, message.content)
+        if key not in self._token_counts:
+            self._token_counts[key] = (
+                count_tokens(backend, message.content) + MESSAGE_OVERHEAD_TOKENS
+            )
+        return self._token_counts[key]
+
+    def budget(self, backend: Any) -> Optional[int]:
+        """The maximum number of tokens of the context."""
+        budget = self.max_tokens
+        size = context_size(backend)
+        if size is not None:
+            limit = max(size - self.reserve_tokens, 0)
+            budget = limit if budget is None else min(budget, limit)
+        return budget
+
+    def truncate(self, backend: Any) -> List[Message]:
+        """
+        Drops the oldest messages if the history exceeds the budget, updating the
+        summary if enabled. Returns the dropped messages.
+        """
+        budget = self.budget(backend)
+        counts = [self.count_tokens(message, backend) for message in self.messages]
+        context = self.context
+        fixed = sum(
+            self.count_tokens(message, backend)
+            for message in context[: len(context) - len(self.messages)]
+        )
+        if not (
+            (budget is not None and fixed + sum(counts) > budget)
+            or (self.max_messages is not None and len(counts) > self.max_messages)
+        ):
+            return []
+        target_tokens = (
+            None if budget is None else max(budget * self.keep_fraction - fixed, 0)
+        )
+        target_messages = (
+            None
+            if self.max_messages is None
+            else int(self.max_messages * self.keep_fraction)
+        )
+        # The last message is always kept, and the history starts with a user turn
+        start, total = 0, sum(counts)
+        while start < len(counts) - 1 and (
+            (target_tokens is not None and total > target_tokens)
+            or (target_messages is not None and len(counts) - start > target_messages)
+            or self.messages[start].role != "user"
+        ):
+            total -= counts[start]
+            start += 1
+        dropped = self.messages[:start]
+        if self.summarize and dropped:
+            # The history is unchanged if the summary fails
+            self.summary = summarize_conversation(
+                self.summary, dropped, backend=backend
+            )
+        self.messages = self.messages[start:]
+        retained = {(message.role, message.content) for message in self.messages}
+        self._token_counts = {
+            key: count
+            for key, count in self._token_counts.items()
+            if key[1:] in retained
+        }
+        return dropped
+
+    def send(
+        self,
+        content: str,
+        backend: Optional[LMBackend] = None,
+        event_manager: Optional[EventManager] = None,
+        **kwargs,
+    ) -> Message:
+        """
+        Sends a user message and returns the response, adding both to the history.
+
+        Args:
+            content (str): The content of the user message.
+            backend (LMBackend, optional): The backend, by default the default one.
+            event_manager (EventManager, optional): The event manager of the call.
+            **kwargs: Additional arguments of the call.
+
+        Returns:
+            Message: The response.
+        """
+        backend = backend or default.backend
+        self.messages.append(Message(role="user", content=content))
+        try:
+            self.truncate(backend)
+            response = chatmessage(
+                self.context, backend=backend, event_manager=event_manager, **kwargs
+            )
+        except BaseException:
+            # The message without a response is not kept in the history
+            self.messages.pop()
+            raise
+        self.messages.append(Message(role=response.role, content=response.content))
+        return response
+
+    def clear(self) -> None:
+        """Clears the history and the summary."""
+        self.messages, self.summary = [], ""
+
+
 def chat(
     backend: Optional[LMBackend] = None,
     event_manager: Optional[EventManager] = None,
@@ -64,17 +227,17 @@ def chat(
         multiline_input, terminators=("", "\n", "/exit", "/clear", "/history")
     ),
     system_message=" ",
+    session: Optional[ChatSession] = None,
 ):
     """
-    A minimal chat loop that interacts with the specified backend
+    A minimal chat loop that interacts with the specified backend, keeping the
+    history in a chat session
     """
     backend = backend or default.backend
     event_manager = event_manager or tokenStream
     if initialize_chat:
         initialize_chat(backend)
-    messages: List = []
-    if system_message:
-        messages.append(Message(role="system", content=system_message))
+    session = session or ChatSession(system_message=system_message)
     while True:
         user_message = user_input()
         if not user_message:
@@ -83,18 +246,13 @@ def chat(
             if user_message == "/exit":
                 return
             else:
-                messages = []
+                session.clear()
         elif user_message == "/history":
-            print(messages)
+            print(session.context)
         else:
-            messages.append(Message(role="user", content=user_message))
             try:
-                response = chatmessage(
-                    messages,
-                    event_manager=event_manager,
-                )
+                session.send(user_message, backend=backend, event_manager=event_manager)
             except KeyboardInterrupt:  # pragma: no cover
                 pass  # pragma: no cover
             finally:
                 print()
-                messages.append(response)
@@ -0,0 +1,336 @@
+import hashlib
+import os
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from pydantic import BaseModel, model_validator
+
+from lmfunctions.backends import LMBackend
+from lmfunctions.base import Base
+from lmfunctions.chat import ChatSession
+from lmfunctions.default import default
+from lmfunctions.eventmanager import EventManager
+from lmfunctions.message import Message
+from lmfunctions.utils import lazy_import
+
+
+class SessionStore(Base):
+    """
+    Chat sessions keyed by ID, kept in memory up to `max_sessions` sessions and
+    `max_bytes` bytes of serialized histories. The least recently used sessions are
+    evicted beyond these limits, and spilled to JSON files in `spill_dir` if given
+    (otherwise discarded), from which they are reloaded when they are used again.
+
+    New sessions are copies of the `template` session, e.g. with a system message
+    and a token budget. The turns of each session are serialized by a lock of the
+    session, while the turns of different sessions can run concurrently. The locks
+    are kept for the sessions in memory and dropped when they are evicted or
+    deleted.
+    """
+
+    template: ChatSession = ChatSession()
+    max_sessions: int = 64
+    max_bytes: int | None = None
+    spill_dir: str | None = None
+
+    _sessions: Any = None
+    _sizes: Dict[str, int] = {}
+    _active: Set[str] = set()
+    _lock: Any = None
+    _session_locks: Dict[str, List] = {}
+
+    @model_validator(mode="after")
+    def initialize(self):
+        if self._sessions is None:
+            self._sessions, self._sizes, self._active = OrderedDict(), {}, set()
+            self._lock = threading.Lock()
+            # The lock of each session, with its number of holders and waiters
+            self._session_locks = {}
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        return self
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def spill_path(self, session_id: str) -> Optional[str]:
+        """The path of the spilled session, named after the hash of its ID."""
+        if not self.spill_dir:
+            return None
+        digest = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, digest + ".json")
+
+    def drop_lock(self, session_id: str) -> None:
+        """Drops the lock of a session that is not in memory, unless it is used."""
+        entry = self._session_locks.get(session_id)
+        if entry is not None and entry[1] == 0 and session_id not in self._sessions:
+            del self._session_locks[session_id]
+
+    @contextmanager
+    def session_lock(self, session_id: str) -> Iterator[None]:
+        """Context manager holding the lock of the session."""
+        with self._lock:
+            entry = self._session_locks.get(session_id)
+            if entry is None:
+                entry = self._session_locks[session_id] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                self.drop_lock(session_id)
+
+    def exists(self, session_id: str) -> bool:
+        """Returns whether the session exists, including during its turns."""
+        with self._lock:
+            if session_id in self._sessions or session_id in self._active:
+                return True
+            path = self.spill_path(session_id)
+            return bool(path and os.path.exists(path))
+
+    def load(self, session_id: str, create: bool = True) -> Optional[ChatSession]:
+        """
+        Removes the session from the memory or from the spill directory and returns
+        it, or returns a new session if it does not exist and `create` is set.
+        """
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            self._sizes.pop(session_id, None)
+        if session is not None:
+            return session
+        path = self.spill_path(session_id)
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                session = ChatSession.model_validate_json(file.read())
+            os.remove(path)
+            return session
+        return self.template.model_copy(deep=True) if create else None
+
+    def store(self, session_id: str, session: ChatSession) -> None:
+        """
+        Stores the session as the most recently used, evicting the least ones. The
+        evicted sessions are spilled before the store is unlocked, so that they
+        always exist either in memory or in the spill directory.
+        """
+        size = len(session.model_dump_json())
+        with self._lock:
+            self._sessions[session_id] = session
+            self._sizes[session_id] = size
+            while len(self._sessions) > 1 and (
+                len(self._sessions) > self.max_sessions
+                or (
+                    self.max_bytes is not None
+                    and sum(self._sizes.values()) > self.max_bytes
+                )
+            ):
+                evicted_id, evicted_session = self._sessions.popitem(last=False)
+                self._sizes.pop(evicted_id)
+                self.spill(evicted_id, evicted_session)
+                self.drop_lock(evicted_id)
+
+    def spill(self, session_id: str, session: ChatSession) -> None:
+        path = self.spill_path(session_id)
+        if path:
+            # Written atomically, so that a session is never read half-written
+            temporary = path + ".tmp"
+            with open(temporary, "w", encoding="utf-8") as file:
+                file.write(session.model_dump_json())
+            os.replace(temporary, path)
+
+    @contextmanager
+    def session(self, session_id: str) -> Iterator[ChatSession]:
+        """
+        Context manager holding the session for a turn, which is stored back as the
+        most recently used session at the end of the turn.
+        """
+        with self.session_lock(session_id):
+            # Checked out sessions still exist while they are not in the store
+            with self._lock:
+                self._active.add(session_id)
+            try:
+                session = self.load(session_id)
+            except BaseException:
+                with self._lock:
+                    self._active.discard(session_id)
+                raise
+            try:
+                yield session
+            finally:
+                self.store(session_id, session)
+                with self._lock:
+                    self._active.discard(session_id)
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        """
+        Returns a copy of the session, after its turn in progress if any, or None if
+        it does not exist.
+        """
+        with self.session_lock(session_id):
+            session = self.load(session_id, create=False)
+            if session is None:
+                return None
+            self.store(session_id, session)
+            return session.model_copy(deep=True)
+
+    def delete(self, session_id: str) -> bool:
+        """Deletes the session, returning whether it existed."""
+        with self.session_lock(session_id):
+            return self.load(session_id, create=False) is not None
+
+    def clear(self) -> None:
+        """
+        Deletes the sessions in memory and in the spill directory. Sessions in the
+        middle of a turn are stored back at the end of their turn.
+        """
+        with self._lock:
+            self._sessions.clear()
+            self._sizes.clear()
+            for session_id in list(self._session_locks):
+                self.drop_lock(session_id)
+            if self.spill_dir:
+                for name in os.listdir(self.spill_dir):
+                    if name.endswith(".json"):
+                        os.remove(os.path.join(self.spill_dir, name))
+
+
+class ChatRequest(BaseModel):
+    content: str
+    stream: bool = False
+
+
+def chat_app(
+    backend: Optional[LMBackend] = None,
+    store: Optional[SessionStore] = None,
+    max_concurrency: int = 1,
+    fast_api_params: Dict = {},
+):
+    """
+    Creates a FastAPI application serving chat sessions of the backend:
+
+    - ``POST /sessions/{session_id}/messages`` sends a user message, with a JSON
+      body ``{"content": ..., "stream": false}``, and returns the response message,
+      or streams the response text if ``stream`` is true.
+    - ``GET /sessions/{session_id}`` returns the session.
+    - ``DELETE /sessions/{session_id}`` deletes the session.
+
+    Args:
+        backend (LMBackend, optional): The backend, by default the default one.
+        store (SessionStore, optional): The store of the sessions.
+        max_concurrency (int, optional): The maximum number of backend calls in
+            flight, e.g. 1 for local backends running a single model.
+        fast_api_params (Dict, optional): Additional parameters of the FastAPI
+            application.
+
+    Returns:
+        FastAPI: The created FastAPI application.
+    """
+    lazy_import("fastapi")
+    import fastapi
+    from fastapi.responses import StreamingResponse
+
+    store = SessionStore() if store is None else store
+    calls = threading.BoundedSemaphore(max_concurrency)
+    app = fastapi.FastAPI(**fast_api_params)
+
+    def turn(
+        session_id: str, content: str, event_manager: Optional[EventManager] = None
+    ) -> Message:
+        with store.session(session_id) as session, calls:
+            return session.send(
+                content, backend=backend or default.backend, event_manager=event_manager
+            )
+
+    def stream(session_id: str, content: str) -> Iterator[str]:
+        """
+        Runs the turn in a worker thread and returns the iterator of its chunks,
+        once the first chunk is generated. An exception of the turn is raised before
+        the first chunk, or by the iterator, which aborts the response.
+        """
+        chunks: queue.Queue = queue.Queue()
+        # The composed manager dispatches synchronously like its left operand, so
+        # that no chunk is queued by a threaded default manager after the turn ends
+        event_manager = (
+            EventManager(
+                handlers={
+                    "token_or_char": [
+                        lambda token_or_char, **kwargs: chunks.put(token_or_char)
+                    ]
+                }
+            )
+            + default.event_manager
+        )
+
+        def run():
+            try:
+                turn(session_id, content, event_manager)
+            except Exception as exception:
+                chunks.put(exception)
+            finally:
+                chunks.put(None)
+
+        def generate(chunk):
+            while chunk is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+                chunk = chunks.get()
+
+        # The turn completes and is stored even if the client disconnects
+        threading.Thread(target=run, daemon=True).start()
+        first = chunks.get()
+        if isinstance(first, Exception):
+            raise first
+        return generate(first)
+
+    @app.post("/sessions/{session_id}/messages")
+    def send(session_id: str, request: ChatRequest):
+        if request.stream:
+            return StreamingResponse(
+                stream(session_id, request.content), media_type="text/plain"
+            )
+        response = turn(session_id, request.content)
+        return dict(role=response.role, content=response.content)
+
+    @app.get("/sessions/{session_id}")
+    def get(session_id: str):
+        session = store.get(session_id)
+        if session is None:
+            raise fastapi.HTTPException(status_code=404, detail="Session not found")
+        return session.model_dump(mode="json")
+
+    @app.delete("/sessions/{session_id}")
+    def delete(session_id: str):
+        if not store.delete(session_id):
+            raise fastapi.HTTPException(status_code=404, detail="Session not found")
+        return dict(deleted=session_id)
+
+    return app
+
+
+def serve_chat(
+    backend: Optional[LMBackend] = None,
+    store: Optional[SessionStore] = None,
+    max_concurrency: int = 1,
+    fast_api_params: Dict = {},
+    uvicorn_params: Dict = {},
+):
+    """
+    Serves chat sessions of the backend using FastAPI and Uvicorn.
+
+    Args:
+        backend (LMBackend, optional): The backend, by default the default one.
+        store (SessionStore, optional): The store of the sessions.
+        max_concurrency (int, optional): The maximum number of backend calls in flight.
+        fast_api_params (dict): Parameters to be passed to the FastAPI application.
+        uvicorn_params (dict): Parameters to be passed to the Uvicorn server.
+    """
+    lazy_import("uvicorn")
+    import uvicorn
+
+    app = chat_app(backend, store, max_concurrency, fast_api_params)
+    return uvicorn.run(app, **uvicorn_params)
@@ -11,3 +11,4 @@ class default:
     )
     event_manager = EventManager()
     retry_policy = RetryPolicy()
+    cache = None
@@ -1,8 +1,187 @@
-from typing import Dict, List
+import logging
+import queue
+import threading
+import time
+import weakref
+from contextvars import ContextVar
+from enum import Enum
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Tuple
+
+import yaml
+from pydantic import Field, PrivateAttr, field_validator
 
 from lmfunctions.base import Base
 from lmfunctions.handlers import Handler
 
+logger = logging.getLogger(__name__)
+
+# The event manager and the span of the language function call in progress, with
+# which the backends emit the events of the call
+call_context: ContextVar[Dict[str, Any]] = ContextVar("call_context", default={})
+
+
+class DispatchType(str, Enum):
+    sync = "sync"
+    thread = "thread"
+
+
+class OverflowType(str, Enum):
+    block = "block"
+    drop = "drop"
+
+
+class HandlerList(list):
+    """
+    A list of handlers which drops the compiled dispatch table of its handler map
+    when it is modified in place.
+    """
+
+    def __init__(self, handlers=(), owner: "HandlerMap | None" = None):
+        super().__init__(handlers)
+        self.owner = owner
+
+    def changed(self):
+        if self.owner is not None:
+            self.owner.table = None
+
+    def append(self, handler):
+        super().append(handler)
+        self.changed()
+
+    def extend(self, handlers):
+        super().extend(handlers)
+        self.changed()
+
+    def insert(self, index, handler):
+        super().insert(index, handler)
+        self.changed()
+
+    def remove(self, handler):
+        super().remove(handler)
+        self.changed()
+
+    def pop(self, *args):
+        self.changed()
+        return super().pop(*args)
+
+    def clear(self):
+        super().clear()
+        self.changed()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.changed()
+
+    def reverse(self):
+        super().reverse()
+        self.changed()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.changed()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.changed()
+
+    def __iadd__(self, handlers):
+        self.extend(handlers)
+        return self
+
+    def __imul__(self, times):
+        super().__imul__(times)
+        self.changed()
+        return self
+
+
+class HandlerMap(dict):
+    """
+    A dictionary of handlers that caches its compiled dispatch table, which maps
+    each event name to a tuple of bound handlers. The lists of handlers are wrapped
+    in `HandlerList`, and the table is recompiled after handlers are set or removed,
+    including when a list of handlers is modified in place.
+    """
+
+    table: Mapping[str, Tuple[Callable, ...]] | None = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.update(*args, **kwargs)
+
+    def wrap(self, handlers) -> HandlerList:
+        if isinstance(handlers, HandlerList) and handlers.owner is self:
+            return handlers
+        return HandlerList(handlers, owner=self)
+
+    def compile(self) -> Mapping[str, Tuple[Callable, ...]]:
+        self.table = MappingProxyType(
+            {
+                event_name: tuple(
+                    handler.__call__ if isinstance(handler, Base) else handler
+                    for handler in handlers
+                )
+                for event_name, handlers in self.items()
+                if handlers
+            }
+        )
+        return self.table
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, self.wrap(value))
+        self.table = None
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.table = None
+
+    def pop(self, *args):
+        self.table = None
+        return super().pop(*args)
+
+    def popitem(self):
+        self.table = None
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self.table = None
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+        self.table = None
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = [] if default is None else default
+        return self[key]
+
+
+class BatchPolicy(Base):
+    """
+    Batching of an event. Every `size` occurrences of the event, or at the first
+    occurrence after `interval` seconds since the batch started, the batch event
+    `event_name` is emitted with the arguments of the last event, the list of the
+    arguments of all the batched events as `events`, and the time in nanoseconds
+    since the epoch at which the batch started as `batch_start`. The values of the
+    arguments listed in `join` are concatenated across the batch.
+    """
+
+    event_name: str
+    size: int = 64
+    interval: float | None = None
+    join: List[str] = []
+
+
+def stop_worker(event_queue: queue.Queue):
+    """Stops the worker thread of the queue, once the queued events are handled."""
+    try:
+        event_queue.put_nowait(None)
+    except queue.Full:
+        # The worker stops at the next event, which finds the manager collected
+        pass
+
 
 class EventManager(Base):
     """
@@ -12,19 +191,261 @@ class EventManager(Base):
     There are two types of handlers: standard handlers and custom handlers. Standard
     handlers are predefined functions which can be serialized, whereas custom
     handlers are arbitrary callables.
+
+    The handlers are compiled into a frozen dispatch table, which is recompiled when
+    the fields are assigned, when items of `handlers` are set or removed, or when
+    a list of handlers is modified in place.
+
+    Events listed in `batching` are also delivered in batches to the handlers of
+    the corresponding batch event. The events of each call, identified by their
+    `span` argument or else by the emitting thread, are batched separately, and the
+    pending batches of a call are emitted before any of its `flush_events`.
+
+    By default, handlers run synchronously in the thread that emits the event. With
+    the `thread` dispatch, events are put on a queue of at most `queue_size` events
+    and handled by a worker thread. When the queue is full, the emitting thread
+    either blocks or the event is dropped, according to `overflow`. Emitting one of
+    the `flush_events` waits until the queued events of the same call have been
+    handled, and `flush` until all the queued events have been handled. The worker
+    thread stops when the event manager is closed or garbage collected, and
+    is started again by the next event.
     """
 
-    handlers: Dict[str, List[Handler]] = dict()
+    handlers: Dict[str, List[Handler]] = Field(default_factory=HandlerMap)
+    batching: Dict[str, BatchPolicy] = dict()
+    dispatch: DispatchType = DispatchType.sync
+    queue_size: int = 10000
+    overflow: OverflowType = OverflowType.block
+    flush_events: List[str] = ["success", "exception"]
+
+    _buffers: Any = None
+    _queue: Any = None
+    _worker: Any = None
+    _stop_worker: Any = None
+    _dropped: int = 0
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+    # Numbers of queued events by call, with a condition notified as they drop
+    _pending: Dict[Tuple[str, int], int] = PrivateAttr(default_factory=dict)
+    _handled: Any = PrivateAttr(default_factory=threading.Condition)
+
+    @field_validator("handlers", mode="after")
+    @classmethod
+    def track_handlers(cls, handlers):
+        return HandlerMap(handlers)
+
+    def compile(self) -> Mapping[str, Tuple[Callable, ...]]:
+        """
+        Compiles the handlers into a frozen dispatch table, which maps each event
+        name to a tuple of bound handlers.
+        """
+        return self.handlers.compile()
+
+    @property
+    def table(self) -> Mapping[str, Tuple[Callable, ...]]:
+        """The compiled dispatch table."""
+        table = self.handlers.table
+        return self.handlers.compile() if table is None else table
+
+    def has_handlers(self, event_name: str) -> bool:
+        """
+        Returns whether any handler is registered for the event or for its batch
+        event. Callers can check it before building the event arguments, so that
+        events without handlers cost nothing.
+        """
+        table = self.table
+        if event_name in table:
+            return True
+        policy = self.batching.get(event_name)
+        return policy is not None and policy.event_name in table
+
+    @property
+    def dropped(self) -> int:
+        """The number of events dropped because the queue was full."""
+        return self._dropped
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of events waiting in the queue."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def handle(self, event_name, **kwargs):
+        for handler in self.table.get(event_name, ()):
+            handler(**kwargs)
+
+    @staticmethod
+    def worker(manager: "weakref.ref[EventManager]", event_queue: queue.Queue):
+        # The worker only refers to the manager while handling an event, so that
+        # the manager can be garbage collected, which stops the worker
+        while True:
+            item = event_queue.get()
+            try:
+                event_manager = manager()
+                if item is None or event_manager is None:
+                    return
+                event_name, kwargs, _ = item
+                event_manager.handle(event_name, **kwargs)
+            except Exception:
+                logger.exception(f"Handler failed for event {item[0]}")
+            finally:
+                if event_manager is not None and item is not None:
+                    event_manager.handled(item[2])
+                event_manager = item = kwargs = None
+                event_queue.task_done()
+
+    @property
+    def event_queue(self) -> queue.Queue:
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._worker = threading.Thread(
+                    target=self.worker,
+                    args=(weakref.ref(self), self._queue),
+                    name="lmfunctions-events",
+                    daemon=True,
+                )
+                self._worker.start()
+                self._stop_worker = weakref.finalize(self, stop_worker, self._queue)
+        return self._queue
+
+    def close(self):
+        """
+        Emits the pending batches, waits until all queued events are handled and
+        stops the worker thread, if any.
+        """
+        self.flush()
+        with self._lock:
+            event_queue, worker, stop = self._queue, self._worker, self._stop_worker
+            self._queue = self._worker = self._stop_worker = None
+        if worker is not None:
+            stop.detach()
+            event_queue.put(None)
+            worker.join()
+
+    def emit(self, event_name, kwargs):
+        """Dispatches an event to its handlers, according to the dispatch type."""
+        if event_name not in self.table:
+            return
+        if self.dispatch == DispatchType.sync:
+            self.handle(event_name, **kwargs)
+            return
+        call_key = self.call_key(kwargs)
+        with self._handled:
+            self._pending[call_key] = self._pending.get(call_key, 0) + 1
+        if self.overflow == OverflowType.block:
+            self.event_queue.put((event_name, kwargs, call_key))
+        else:
+            try:
+                self.event_queue.put_nowait((event_name, kwargs, call_key))
+            except queue.Full:
+                self.handled(call_key)
+                self._dropped += 1
+
+    def handled(self, call_key: Tuple[str, int]):
+        """Records that a queued event of the call has been handled or dropped."""
+        with self._handled:
+            pending = self._pending[call_key] - 1
+            if pending:
+                self._pending[call_key] = pending
+            else:
+                del self._pending[call_key]
+                self._handled.notify_all()
+
+    def wait_handled(self, call_key: Tuple[str, int]):
+        """Waits until the queued events of the call have been handled."""
+        with self._handled:
+            self._handled.wait_for(lambda: call_key not in self._pending)
+
+    def emit_batch(self, policy: BatchPolicy, batch_start: int, events: List[Dict]):
+        kwargs = events[-1] | {
+            key: "".join(str(event.get(key, "")) for event in events)
+            for key in policy.join
+        }
+        self.emit(
+            policy.event_name, kwargs | dict(events=events, batch_start=batch_start)
+        )
+
+    @staticmethod
+    def call_key(kwargs) -> Tuple[str, int]:
+        """
+        Identifies the call emitting an event, by its span or else by its thread.
+        Spans which are not recorded share the invalid span ID, so they identify
+        calls by thread.
+        """
+        span = kwargs.get("span")
+        get_span_context = getattr(span, "get_span_context", None)
+        if get_span_context is not None:
+            context = get_span_context()
+            if context.is_valid:
+                return ("span", context.span_id)
+        elif span is not None:
+            return ("span", id(span))
+        return ("thread", threading.get_ident())
+
+    def batch(self, event_name, policy: BatchPolicy, kwargs):
+        now = time.time_ns()
+        key = (self.call_key(kwargs), event_name)
+        with self._lock:
+            if self._buffers is None:
+                self._buffers = {}
+            batch_start, events = self._buffers.setdefault(key, (now, []))
+            events.append(kwargs)
+            if len(events) < policy.size and (
+                policy.interval is None or now - batch_start < policy.interval * 1e9
+            ):
+                return
+            del self._buffers[key]
+        self.emit_batch(policy, batch_start, events)
+
+    def flush_batches(self, call_key: Tuple[str, int] | None = None):
+        """Emits the pending batches of the call, or of all calls by default."""
+        with self._lock:
+            buffers = self._buffers or {}
+            flushed = [key for key in buffers if call_key is None or key[0] == call_key]
+            batches = [(key[1], buffers.pop(key)) for key in flushed]
+        for event_name, (batch_start, events) in batches:
+            self.emit_batch(self.batching[event_name], batch_start, events)
+
+    def flush(self):
+        """Emits the pending batches and waits until all queued events are handled."""
+        self.flush_batches()
+        if self._queue is not None:
+            self._queue.join()
 
     def __call__(self, event_name, **kwargs):
-        [handler(**kwargs) for handler in self.handlers.get(event_name, [])]
+        flush = event_name in self.flush_events
+        if flush:
+            call_key = self.call_key(kwargs)
+            self.flush_batches(call_key)
+        policy = self.batching.get(event_name)
+        if policy is not None and policy.event_name in self.table:
+            self.batch(event_name, policy, kwargs)
+        self.emit(event_name, kwargs)
+        if flush and self._queue is not None:
+            self.wait_handled(call_key)
         return None
 
     def __add__(self, other):
         if isinstance(other, EventManager):
-            handlers = {}
+            handlers = HandlerMap()
             for d in (self.handlers, other.handlers):
                 for key, value in d.items():
                     handlers.setdefault(key, []).extend(value)
-            return EventManager(handlers=handlers)
+            # Both operands are validated already, so validation is skipped
+            return EventManager.model_construct(
+                handlers=handlers,
+                batching=self.batching | other.batching,
+                dispatch=self.dispatch,
+                queue_size=self.queue_size,
+                overflow=self.overflow,
+                flush_events=self.flush_events,
+            )
         raise NotImplementedError
+
+
+# Workaround for issue with YAML serialization of enums
+# See https://github.com/yaml/pyyaml/issues/722
+for enumtype in [DispatchType, OverflowType]:
+    yaml.SafeDumper.add_representer(
+        enumtype,  # type: ignore
+        yaml.representer.SafeRepresenter.represent_str,
+    )
@@ -0,0 +1,175 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import model_validator
+
+from lmfunctions.base import Base
+
+# Parameters of the BM25 ranking function
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TERM_PATTERN = re.compile(r"\w+")
+
+
+def terms(text: str) -> List[str]:
+    return TERM_PATTERN.findall(text.lower())
+
+
+def count_tokens(backend: Any, text: str) -> int:
+    """
+    Counts the tokens of a text with the tokenizer of the backend, or estimates them
+    as one token every four characters if the backend does not expose a tokenizer.
+    """
+    counter = getattr(backend, "count_tokens", None)
+    if counter is None:
+        return len(text) // 4 + 1
+    return counter(text)
+
+
+def context_size(backend: Any) -> Optional[int]:
+    """Returns the context size of the backend in tokens, if known."""
+    return getattr(backend, "context_size", None)
+
+
+class ExampleSelector(Base):
+    """
+    Selects the examples of a language function call from a larger pool.
+
+    Examples are ranked by the lexical similarity (BM25) of their inputs to the
+    input of the call, using an inverted index built once for the pool. The most
+    relevant examples are then packed, up to `k` examples, under a budget of
+    `max_tokens` tokens counted with the tokenizer of the backend. When
+    `fit_context` is enabled and the context size of the backend is known, the
+    budget is further limited so that the prompt leaves `reserve_tokens` tokens for
+    the output. Selected examples are rendered from the least to the most relevant,
+    so that the most relevant one is the closest to the input.
+
+    The selector can be passed as the `examples` of a call in place of a list.
+    """
+
+    examples: List[Tuple[Any, Any]] = []
+    k: int | None = 4
+    max_tokens: int | None = None
+    fit_context: bool = True
+    reserve_tokens: int = 1024
+
+    _index: Any = None
+    _token_counts: Dict[Tuple[str, str], List[int]] = {}
+    _context_sizes: Dict[Tuple[str, str], Optional[int]] = {}
+
+    @model_validator(mode="after")
+    def reset_index(self):
+        # The index and the token counts are rebuilt when the parameters are changed
+        self._index = None
+        self._token_counts = {}
+        self._context_sizes = {}
+        return self
+
+    @staticmethod
+    def example_strings(example: Tuple[Any, Any]) -> Tuple[str, str]:
+        from lmfunctions.lmfunc import LMFunc
+
+        return tuple(LMFunc.to_json_str(item) or "" for item in example)
+
+    @property
+    def index(self) -> Tuple[Dict[str, List[Tuple[int, int]]], List[int], float]:
+        """The postings of each term, the length of each input and the mean length."""
+        if self._index is None:
+            postings: Dict[str, List[Tuple[int, int]]] = {}
+            lengths = []
+            for i, example in enumerate(self.examples):
+                example_terms = terms(self.example_strings(example)[0])
+                lengths.append(len(example_terms))
+                for term, frequency in Counter(example_terms).items():
+                    postings.setdefault(term, []).append((i, frequency))
+            mean_length = sum(lengths) / len(lengths) if lengths else 0
+            self._index = (postings, lengths, mean_length or 1)
+        return self._index
+
+    def scores(self, input: Any) -> List[float]:
+        """Returns the BM25 score of each example for the input."""
+        from lmfunctions.lmfunc import LMFunc
+
+        postings, lengths, mean_length = self.index
+        scores = [0.0] * len(lengths)
+        for term in set(terms(LMFunc.to_json_str(input) or "")):
+            documents = postings.get(term)
+            if not documents:
+                continue
+            idf = math.log(
+                1 + (len(lengths) - len(documents) + 0.5) / (len(documents) + 0.5)
+            )
+            for i, frequency in documents:
+                norm = 1 - BM25_B + BM25_B * lengths[i] / mean_length
+                scores[i] += (
+                    idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * norm)
+                )
+        return scores
+
+    def context_size(self, backend: Any) -> Optional[int]:
+        """
+        Returns the context size of the backend, which is looked up once for each
+        backend model (e.g. in the model info of litellm).
+        """
+        key = (getattr(backend, "name", ""), getattr(backend, "model", ""))
+        if key not in self._context_sizes:
+            self._context_sizes[key] = context_size(backend)
+        return self._context_sizes[key]
+
+    def token_counts(self, backend: Any) -> List[int]:
+        """Returns the number of tokens of each example with the backend tokenizer."""
+        key = (getattr(backend, "name", ""), getattr(backend, "model", ""))
+        counts = self._token_counts.get(key)
+        if counts is None:
+            counts = self._token_counts[key] = [
+                count_tokens(backend, "\n".join(self.example_strings(example)))
+                for example in self.examples
+            ]
+        return counts
+
+    def budget(self, backend: Any, prompt_tokens: Optional[int] = None) -> float:
+        """
+        Returns the number of tokens available for the examples, given the number of
+        tokens of the prompt without examples.
+        """
+        budget = math.inf if self.max_tokens is None else self.max_tokens
+        size = self.context_size(backend) if self.fit_context else None
+        if size and prompt_tokens is not None:
+            budget = min(budget, size - prompt_tokens - self.reserve_tokens)
+        return budget
+
+    def select(
+        self, input: Any, backend: Any = None, prompt_tokens: Optional[int] = None
+    ) -> List[Tuple[Any, Any]]:
+        """
+        Selects the examples for the input.
+
+        Args:
+            input (Any): The input of the call.
+            backend (Any, optional): The backend whose tokenizer counts the tokens.
+            prompt_tokens (int, optional): The number of tokens of the prompt without
+            examples, used to fit the context of the backend.
+
+        Returns:
+            List[Tuple[Any, Any]]: The selected examples.
+        """
+        budget = self.budget(backend, prompt_tokens)
+        scores = self.scores(input)
+        token_counts = self.token_counts(backend)
+        if self.k is not None and budget == math.inf:
+            ranking = heapq.nlargest(self.k, range(len(scores)), key=scores.__getitem__)
+        else:
+            ranking = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        selected, used = [], 0
+        for i in ranking:
+            if self.k is not None and len(selected) >= self.k:
+                break
+            # Examples exceeding the remaining budget are skipped for smaller ones
+            if used + token_counts[i] <= budget:
+                selected.append(i)
+                used += token_counts[i]
+        return [self.examples[i] for i in reversed(selected)]
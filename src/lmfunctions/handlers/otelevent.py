@@ -4,12 +4,17 @@ from lmfunctions.base import Base
 
 
 class OtelEventHandler(Base):
-    """Callback handler that sends events and attributes to an OpenTelemetry span."""
+    """
+    Callback handler that sends events and attributes to an OpenTelemetry span. The
+    event timestamp (in nanoseconds since the epoch) is read from `timestamp_var`
+    when set, e.g. to record batched events at the time the batch started.
+    """
 
     name: Literal["otelevent"] = "otelevent"
     span_name: str = "span"
     event_name: str = "event"
     attributes_vars: Dict[str, str] = {}
+    timestamp_var: str | None = None
 
     def __call__(self, **kwargs):
         span = kwargs.get(self.span_name, None)
@@ -17,5 +22,6 @@ class OtelEventHandler(Base):
             key: kwargs.get(varname, None)
             for key, varname in self.attributes_vars.items()
         }
+        timestamp = kwargs.get(self.timestamp_var) if self.timestamp_var else None
         if span:
-            span.add_event(self.event_name, attributes=attributes)
+            span.add_event(self.event_name, attributes=attributes, timestamp=timestamp)
@@ -1,7 +1,12 @@
 import inspect
-import json
 import os
 import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from enum import Enum
+from functools import partial
 from types import NoneType
 from typing import (
     Any,
@@ -9,6 +14,7 @@ from typing import (
     Dict,
     Generic,
     List,
+    Literal,
     Optional,
     ParamSpec,
     Type,
@@ -18,21 +24,84 @@ from typing import (
 
 from jinja2 import Template
 from opentelemetry import trace
-from pydantic import BaseModel, create_model
+from pydantic import BaseModel, TypeAdapter, create_model
 from tenacity import Retrying
 
 from lmfunctions.backends import LMBackend
 from lmfunctions.base import Base
+from lmfunctions.cache import SemanticCache
 from lmfunctions.default import default
-from lmfunctions.eventmanager import EventManager
+from lmfunctions.eventmanager import EventManager, call_context
+from lmfunctions.examples import ExampleSelector, count_tokens
 from lmfunctions.message import Message, is_message_list
 from lmfunctions.retrypolicy import RetryPolicy
-from lmfunctions.utils import lazy_import, model_from_schema
+from lmfunctions.utils import json_dumps, lazy_import, model_from_schema
 
 curdir = os.path.dirname(os.path.realpath(__file__))
 with open(os.path.join(curdir, "metaprompt.jinja"), "r") as f:
     default_metaprompt = f.read()
 
+
+@contextmanager
+def phase(
+    name: str,
+    tracer: trace.Tracer,
+    span: trace.Span,
+    event_manager: EventManager,
+    **kwargs,
+):
+    """
+    Times a phase of a language function call. When the call span is recording, the
+    phase is traced in a child span. When the event manager handles `phase` events,
+    a `phase` event is emitted at the end of the phase with its name, its start time
+    (from `time.perf_counter`) and its duration in seconds.
+    """
+    emit = event_manager.has_handlers("phase")
+    if not emit and not span.is_recording():
+        yield
+        return
+    start = time.perf_counter()
+    if span.is_recording():
+        with tracer.start_as_current_span(
+            name, context=trace.set_span_in_context(span)
+        ):
+            yield
+    else:
+        yield
+    if emit:
+        event_manager(
+            "phase",
+            span=span,
+            phase=name,
+            start=start,
+            duration=time.perf_counter() - start,
+            **kwargs,
+        )
+
+
+class ValidationMode(str, Enum):
+    """
+    How outputs are built from the responses of the backend:
+
+    - full: the response is parsed as JSON and the output model is validated.
+    - fast: JSON object responses are validated directly from the raw text,
+      without parsing them beforehand.
+    - trusted: the response is parsed as JSON and the output model is built
+      without validation (nested models are left as dictionaries). Suitable for
+      backends that enforce the output schema with constrained decoding.
+    """
+
+    full = "full"
+    fast = "fast"
+    trusted = "trusted"
+
+
+# Placeholder for the input in prompts rendered ahead of the call
+INPUT_PLACEHOLDER = "\x00inputs\x00"
+# Maximum number of contents of examples with a cached prompt
+MAX_CACHED_PROMPTS = 16
+prompts_lock = threading.Lock()
+
 InputArgs = ParamSpec("InputArgs")
 ReturnType = TypeVar("ReturnType")
 
@@ -71,7 +140,9 @@ class LMFunc(Base, Generic[InputArgs, ReturnType]):
 
     _input_model: Optional[Type[BaseModel]] = None
     _output_model: Optional[Type[BaseModel]] = None
+    _output_field: Optional[str] = None
     _template: Optional[Template] = None
+    _prompts: Optional[OrderedDict] = None
 
     @staticmethod
     def to_json_str(obj: Any) -> Optional[str]:
@@ -82,7 +153,7 @@ class LMFunc(Base, Generic[InputArgs, ReturnType]):
         if obj is None:
             return None
         elif isinstance(obj, dict):
-            return json.dumps(obj, default=str)
+            return json_dumps(obj)
         elif isinstance(obj, BaseModel):
             return obj.model_dump_json()
         else:
@@ -97,7 +168,14 @@ class LMFunc(Base, Generic[InputArgs, ReturnType]):
     @property
     def output_model(self) -> Type[BaseModel]:
         if self._output_model is None:
-            self._output_model = model_from_schema(self.output_schema or {})
+            output_model = model_from_schema(self.output_schema or {})
+            # Outputs wrapped in a model are unwrapped from its only field
+            self._output_field = (
+                next(iter(output_model.model_fields))
+                if output_model.__name__ == "OutputWrapper"
+                else None
+            )
+            self._output_model = output_model
         return self._output_model
 
     @property
@@ -111,6 +189,69 @@ class LMFunc(Base, Generic[InputArgs, ReturnType]):
             self._template = Template(template)
         return self._template
 
+    def render(self, input: Any, examples: List = [], cache: bool = True) -> str:
+        """
+        Renders the prompt for the given input and examples.
+
+        The parts of the prompt that do not depend on the input (description,
+        schemas and examples) are rendered once for each content of the examples and
+        cached for the `MAX_CACHED_PROMPTS` most recently used ones, so that only the
+        input is formatted at each call. With `cache` disabled, e.g. for examples
+        selected for each input, the prompt is rendered without the cache.
+        """
+        examples_string = tuple(
+            (self.to_json_str(i), self.to_json_str(o)) for i, o in examples
+        )
+        input_string = self.to_json_str(input)
+        if cache and input_string:
+            with prompts_lock:
+                if self._prompts is None:
+                    self._prompts = OrderedDict()
+                parts = self._prompts.get(examples_string)
+                if parts is not None:
+                    self._prompts.move_to_end(examples_string)
+            if parts is None:
+                parts = tuple(
+                    self.template.render(
+                        inputs=INPUT_PLACEHOLDER, examples=examples_string
+                    ).split(INPUT_PLACEHOLDER)
+                )
+                with prompts_lock:
+                    self._prompts[examples_string] = parts
+                    while len(self._prompts) > MAX_CACHED_PROMPTS:
+                        self._prompts.popitem(last=False)
+            if len(parts) == 2:
+                return parts[0] + input_string + parts[1]
+        # The template does not interpolate the input verbatim, or the input is empty
+        return self.template.render(inputs=input_string, examples=examples_string)
+
+    def select_examples(
+        self, inputs: List[Any], examples: List | ExampleSelector, backend: Any = None
+    ) -> List[List]:
+        """
+        Returns the examples of the call for each input, which are selected from the
+        pool when `examples` is an `ExampleSelector`. To fit the context of the
+        backend, the tokens of the prompt without input are counted once for all the
+        inputs, and only the tokens of each input are counted separately.
+        """
+        if not isinstance(examples, ExampleSelector):
+            return [examples] * len(inputs)
+        base_tokens = None
+        if examples.fit_context and examples.context_size(backend):
+            prompt = self.render(INPUT_PLACEHOLDER).replace(INPUT_PLACEHOLDER, "")
+            base_tokens = count_tokens(backend, prompt)
+        selected = []
+        for input in inputs:
+            if is_message_list(input):
+                selected.append([])
+                continue
+            prompt_tokens = None
+            if base_tokens is not None:
+                input_string = self.to_json_str(input) or ""
+                prompt_tokens = base_tokens + count_tokens(backend, input_string)
+            selected.append(examples.select(input, backend, prompt_tokens))
+        return selected
+
     def __init__(
         self, func: Optional[Callable[InputArgs, ReturnType]] = None, **kwargs
     ):
@@ -193,16 +334,19 @@ class LMFunc(Base, Generic[InputArgs, ReturnType]):
         self._input_model = None
         self._output_model = None
         self._template = None
+        self._prompts = None
 
     def __call__(
         self,
         *args,
-        examples: List = [],
+        examples: List | ExampleSelector = [],
         backend: Optional[LMBackend] = None,
         retry_policy: Optional[RetryPolicy] = None,
         event_manager: Optional[EventManager] = None,
         extra_args={},
         batch_call=False,
+        validation: ValidationMode | str = ValidationMode.full,
+        cache: Optional[SemanticCache] = None,
         **kwargs,
     ) -> ReturnType | List[ReturnType]:
         """
@@ -211,183 +355,439 @@ class LMFunc(Base, Generic[InputArgs, ReturnType]):
         Args:
             *args: Variable length argument list.
             **kwargs: Arbitrary keyword arguments.
-            examples (List[Tuple[Any, ReturnType]], optional): A list of examples to provide to the language model. Defaults to [].
+            examples (List[Tuple[Any, ReturnType]] | ExampleSelector, optional): A list of examples to provide to the language model, or a selector of the examples for each input. Defaults to [].
             backend (LMBackend, optional): The language model backend to use for the computation.
             retry_policy (RetryPolicy, optional): The retry policy to use for handling exceptions.
             event_manager (EventManager, optional): The event manager to use for handling callbacks.
             extra_args (Dict, optional): Additional arguments that may be used by the callback handlers. Defaults to {}.
+            validation (ValidationMode, optional): How outputs are validated: "full", "fast" or "trusted". Defaults to "full".
+            cache (SemanticCache, optional): The cache of the outputs of the language function.
         """
         tracer = trace.get_tracer(__name__)
         with tracer.start_span(f"Calling {self.name}") as span:
             backend = backend or default.backend
             event_manager = event_manager or default.event_manager
             retry_policy = retry_policy or default.retry_policy
+            cache = cache or default.cache
 
             # Call Start
-            event_manager(
-                "call_start",
-                func=self,
-                args=args,
-                kwargs=kwargs,
-                examples=examples,
-                backend=backend,
-                retry_policy=retry_policy,
-                event_manager=event_manager,
-                extra_args=extra_args,
-                tracer=tracer,
-                span=span,
-            )
+            if event_manager.has_handlers("call_start"):
+                event_manager(
+                    "call_start",
+                    func=self,
+                    args=args,
+                    kwargs=kwargs,
+                    examples=examples,
+                    backend=backend,
+                    retry_policy=retry_policy,
+                    event_manager=event_manager,
+                    extra_args=extra_args,
+                    tracer=tracer,
+                    span=span,
+                )
 
             # Assemble all input arguments into a single input object.
-            input = None
-            if args or kwargs:
-                arg0 = args[0] if args else next(iter(kwargs.values()), None)
-                if len(args) + len(kwargs) == 1 and (
-                    isinstance(arg0, str)  # String
-                    or (batch_call and isinstance(arg0, list))  # Batch
-                    or is_message_list(arg0)  # List of Messages
-                    or isinstance(arg0, BaseModel)  # Pydantic model
-                ):
-                    # Use the only argument directly as input
-                    input = arg0
-                else:
-                    # Otherwise, create a dictionary with the input arguments
-                    input = {
-                        **dict(zip(self.input_model.model_fields.keys(), args)),
-                        **kwargs,
-                    }
+            with phase("assemble", tracer, span, event_manager, func=self):
+                input = None
+                if args or kwargs:
+                    arg0 = args[0] if args else next(iter(kwargs.values()), None)
+                    if len(args) + len(kwargs) == 1 and (
+                        isinstance(arg0, str)  # String
+                        or (batch_call and isinstance(arg0, list))  # Batch
+                        or is_message_list(arg0)  # List of Messages
+                        or isinstance(arg0, BaseModel)  # Pydantic model
+                    ):
+                        # Use the only argument directly as input
+                        input = arg0
+                    else:
+                        # Otherwise, create a dictionary with the input arguments
+                        input = {
+                            **dict(zip(self.input_model.model_fields.keys(), args)),
+                            **kwargs,
+                        }
+            inputs = input if batch_call and isinstance(input, list) else [input]
+
+            def cached_success(all_inputs: List) -> None:
+                # Calls served from the cache emit a success event for each hit
+                if not event_manager.has_handlers("success"):
+                    return
+                for i, (output, similarity) in hits.items():
+                    event_manager(
+                        "success",
+                        func=self,
+                        args=args,
+                        kwargs=kwargs,
+                        examples=examples,
+                        backend=backend,
+                        retry_policy=retry_policy,
+                        event_manager=event_manager,
+                        extra_args=extra_args,
+                        tracer=tracer,
+                        span=span,
+                        input=all_inputs[i],
+                        backend_input=None,
+                        attempt=None,
+                        response=None,
+                        completion="",
+                        output=output,
+                        batch_size=len(all_inputs),
+                        cached=True,
+                        similarity=similarity,
+                    )
+
+            # Look up the outputs of the inputs in the cache
+            hits, entries, all_inputs = {}, [], inputs
+            if cache is not None:
+                with phase("cache", tracer, span, event_manager, func=self):
+                    hits, entries = cache.get(self, inputs, examples, backend)
+
+                if hits:
+                    if event_manager.has_handlers("cache_hit"):
+                        event_manager(
+                            "cache_hit",
+                            func=self,
+                            backend=backend,
+                            span=span,
+                            inputs=[inputs[i] for i in hits],
+                            outputs=[output for output, _ in hits.values()],
+                            similarities=[
+                                similarity for _, similarity in hits.values()
+                            ],
+                            complete=len(hits) == len(inputs),
+                        )
+                    if len(hits) == len(inputs):
+                        cached_success(inputs)
+                        outputs = [hits[i][0] for i in range(len(inputs))]
+                        return outputs if batch_call else outputs[0]
+                    inputs = [item for i, item in enumerate(inputs) if i not in hits]
+
             try:
+                # Examples are selected once for each input, not at each attempt
+                if isinstance(examples, ExampleSelector):
+                    with phase("render", tracer, span, event_manager, func=self):
+                        selected_examples = self.select_examples(
+                            inputs, examples, backend
+                        )
+                else:
+                    selected_examples = [examples] * len(inputs)
                 for attempt in Retrying(
                     **retry_policy.args,
-                    before_sleep=lambda x: event_manager("retry", retry_call_state=x),
+                    before_sleep=lambda x: (
+                        event_manager("retry", retry_call_state=x, span=span)
+                        if event_manager.has_handlers("retry")
+                        else None
+                    ),
                 ):
                     with attempt:
-                        inputs = (
-                            input if batch_call and isinstance(input, list) else [input]
-                        )
                         backend_inputs = []
-                        for input in inputs:
-                            if is_message_list(input):
-                                backend_input = input
-
-                            else:
-                                # Render Input as a string
-                                input_string = self.to_json_str(input)
-                                # Render Examples as strings
-                                examples_string = [
-                                    (self.to_json_str(i), self.to_json_str(o))
-                                    for i, o in examples
-                                ]
-                                # Render Prompt
-                                prompt = self.template.render(
-                                    inputs=input_string,
-                                    examples=examples_string,
+                        for item, item_examples in zip(inputs, selected_examples):
+                            with phase(
+                                "render", tracer, span, event_manager, func=self
+                            ):
+                                backend_input = (
+                                    item
+                                    if is_message_list(item)
+                                    else self.render(
+                                        item,
+                                        item_examples,
+                                        # Selected examples vary with the input
+                                        cache=not isinstance(examples, ExampleSelector),
+                                    )
                                 )
-                                backend_input = prompt
                             backend_inputs.append(backend_input)
 
                             # Language Model Prompt Template Render Callback
-                            event_manager(
-                                "input_render",
-                                func=self,
-                                args=args,
-                                kwargs=kwargs,
-                                examples=examples,
-                                backend=backend,
-                                retry_policy=retry_policy,
-                                event_manager=event_manager,
-                                extra_args=extra_args,
-                                tracer=tracer,
-                                span=span,
-                                ##
-                                input=input,
-                                attempt=attempt,
-                                backend_input=backend_input,
-                            )
+                            if event_manager.has_handlers("input_render"):
+                                with phase(
+                                    "callbacks", tracer, span, event_manager, func=self
+                                ):
+                                    event_manager(
+                                        "input_render",
+                                        func=self,
+                                        args=args,
+                                        kwargs=kwargs,
+                                        examples=examples,
+                                        backend=backend,
+                                        retry_policy=retry_policy,
+                                        event_manager=event_manager,
+                                        extra_args=extra_args,
+                                        tracer=tracer,
+                                        span=span,
+                                        ##
+                                        input=item,
+                                        attempt=attempt,
+                                        backend_input=backend_input,
+                                    )
 
                         # Call Backend
-                        backend_response = backend(
-                            backend_inputs if batch_call else backend_inputs[0],
-                            schema=self.output_schema,
+                        retry_policy.before_call(backend)
+                        context = call_context.set(
+                            dict(event_manager=event_manager, span=span)
                         )
+                        try:
+                            with phase(
+                                "backend", tracer, span, event_manager, func=self
+                            ):
+                                backend_response = backend(
+                                    backend_inputs if batch_call else backend_inputs[0],
+                                    schema=self.output_schema,
+                                )
+                        except Exception as exception:
+                            retry_policy.after_call(backend, success=False)
+                            raise exception
+                        finally:
+                            call_context.reset(context)
 
                         responses = (
                             backend_response
                             if isinstance(backend_response, list)
                             else [backend_response]
                         )
+                        # Streamed calls can still fail while being consumed
+                        streamed = any(
+                            getattr(response, "streamed", False)
+                            for response in responses
+                        )
+                        if not streamed:
+                            retry_policy.after_call(backend, success=True)
                         # Process the responses
                         outputs = []
-                        for backend_input, response in zip(backend_inputs, responses):
-                            parsed_response = response.process(
-                                self.output_schema,
-                                handle_token_or_char=lambda **kwargs: event_manager(
-                                    "token_or_char", span=span, **kwargs
-                                ),
-                            )
+                        handle_token_or_char = (
+                            partial(event_manager, "token_or_char", span=span)
+                            if event_manager.has_handlers("token_or_char")
+                            else None
+                        )
+                        # With fast validation, JSON objects are validated from the text
+                        parse = not (
+                            validation == ValidationMode.fast
+                            and (self.output_schema or {}).get("type") == "object"
+                        )
+                        for index, (item, backend_input, response) in enumerate(
+                            zip(inputs, backend_inputs, responses)
+                        ):
+                            # Streamed responses are generated while being parsed
+                            try:
+                                with phase(
+                                    "parse", tracer, span, event_manager, func=self
+                                ):
+                                    parsed_response = response.process(
+                                        self.output_schema,
+                                        handle_token_or_char=handle_token_or_char,
+                                        parse=parse,
+                                    )
+                            except Exception as exception:
+                                if streamed:
+                                    retry_policy.after_call(backend, success=False)
+                                raise exception
+                            if streamed and index == len(responses) - 1:
+                                retry_policy.after_call(backend, success=True)
                             if not (self.description) and self.output_schema is None:
                                 # If description and output schema are empty, output is the backend output
                                 output = response
                             else:
-                                if isinstance(parsed_response, dict):
-                                    # If the response is a dictionary, build a Pydantic object
-                                    output_model = self.output_model(**parsed_response)
-                                    if self.output_model.__name__ == "OutputWrapper":
-                                        # If the object is a wrapper, unwrap it
-                                        first_field = next(
-                                            iter(output_model.model_fields.keys())
-                                        )
-                                        output = getattr(output_model, first_field)
-                                    else:
-                                        output = output_model
-                                else:
-                                    # Otherwise, the output is the processed response
-                                    output = parsed_response
+                                with phase(
+                                    "validate", tracer, span, event_manager, func=self
+                                ):
+                                    output = self.validate_output(
+                                        parsed_response, validation, parsed=parse
+                                    )
 
                             # Success Callback
-                            event_manager(
-                                "success",
-                                func=self,
-                                args=args,
-                                kwargs=kwargs,
-                                examples=examples,
-                                backend=backend,
-                                retry_policy=retry_policy,
-                                event_manager=event_manager,
-                                extra_args=extra_args,
-                                tracer=tracer,
-                                span=span,
-                                input=input,
-                                backend_input=backend_input,
-                                attempt=attempt,
-                                ##
-                                response=response,
-                                completion=response.content,
-                                output=output,
-                            )
+                            if event_manager.has_handlers("success"):
+                                with phase(
+                                    "callbacks", tracer, span, event_manager, func=self
+                                ):
+                                    event_manager(
+                                        "success",
+                                        func=self,
+                                        args=args,
+                                        kwargs=kwargs,
+                                        examples=examples,
+                                        backend=backend,
+                                        retry_policy=retry_policy,
+                                        event_manager=event_manager,
+                                        extra_args=extra_args,
+                                        tracer=tracer,
+                                        span=span,
+                                        input=item,
+                                        backend_input=backend_input,
+                                        attempt=attempt,
+                                        ##
+                                        response=response,
+                                        completion=response.content,
+                                        output=output,
+                                        batch_size=len(all_inputs),
+                                    )
                             outputs.append(output)
 
             except Exception as exception:
                 # Exception Callback
-                event_manager("exception", exception=exception, vars=locals())
+                if event_manager.has_handlers("exception"):
+                    event_manager(
+                        "exception", exception=exception, vars=locals(), span=span
+                    )
                 raise exception
-            finally:
-                if batch_call:
-                    return outputs
-                else:
-                    return outputs[0]
+            if cache is not None:
+                cache.put(self, entries, outputs, examples, backend)
+                if hits:
+                    cached_success(all_inputs)
+                    generated = iter(outputs)
+                    outputs = [
+                        hits[i][0] if i in hits else next(generated)
+                        for i in range(len(all_inputs))
+                    ]
+            if batch_call:
+                return outputs
+            else:
+                return outputs[0]
 
-    def async_handler(self):
+    def validate_output(
+        self,
+        parsed_response: Any,
+        validation: ValidationMode | str = ValidationMode.full,
+        parsed: bool = True,
+    ) -> Any:
+        """
+        Builds the output of the language function from the processed response.
+
+        Args:
+            parsed_response (Any): The processed response.
+            validation (ValidationMode, optional): How the output is validated.
+            parsed (bool, optional): Whether the response was parsed as JSON, or is
+            the raw text of a JSON object to be validated directly.
+
+        Returns:
+            Any: The output.
+        """
+        output_model = self.output_model
+        if not parsed:
+            output = output_model.model_validate_json(parsed_response)
+        elif isinstance(parsed_response, dict):
+            # If the response is a dictionary, build a Pydantic object
+            if validation == ValidationMode.trusted:
+                if self._output_field is not None:
+                    return parsed_response.get(self._output_field)
+                return output_model.model_construct(**parsed_response)
+            output = output_model(**parsed_response)
+        else:
+            # Otherwise, the output is the processed response
+            return parsed_response
+        if self._output_field is not None:
+            # If the object is a wrapper, unwrap it
+            return getattr(output, self._output_field)
+        return output
+
+    def apply_frame(
+        self,
+        frame: Any,
+        columns: Optional[List[str] | Dict[str, str]] = None,
+        batch_size: int = 64,
+        output_prefix: str = "",
+        on_error: Literal["raise", "null"] = "raise",
+        **kwargs,
+    ) -> Any:
+        """
+        Applies the language function to the rows of a pandas DataFrame or an Arrow
+        table, with batch calls of `batch_size` rows.
+
+        The input columns are read in chunks of rows, which are validated against
+        the input model at once, or used directly as inputs for functions of a single
+        string. The output fields are written back as columns typed after the output
+        schema (named after the fields, with `output_prefix`), or as a single
+        `output` column for outputs that are not objects.
+
+        Args:
+            frame (DataFrame | Table): The pandas DataFrame or Arrow table.
+            columns (List[str] | Dict[str, str], optional): The input columns, or a
+            mapping of the input fields to the columns. Defaults to the input fields,
+            and must be given for functions of a single string.
+            batch_size (int, optional): The number of rows of each call.
+            output_prefix (str, optional): The prefix of the output column names.
+            on_error (str, optional): "raise" to raise the exceptions of the calls, or
+            "null" to leave the outputs of the failing batches empty.
+            **kwargs: Additional arguments of the calls, e.g. the backend.
+
+        Returns:
+            DataFrame | Table: A copy of the frame with the output columns.
+        """
+        from lmfunctions.utils.frames import (
+            column_chunks,
+            record_chunks,
+            resolve_schema,
+            to_column,
+            with_columns,
+        )
+
+        if columns is None:
+            columns = list((self.input_schema or {}).get("properties", {}))
+            if not columns:
+                raise ValueError("The input columns must be specified.")
+        fields = dict(zip(columns, columns)) if isinstance(columns, list) else columns
+
+        if self.input_schema is None:
+            # Functions of a single string take the values of the column as inputs
+            if len(fields) != 1:
+                raise ValueError("Functions of a single string take a single column.")
+            chunks = (
+                chunk[0]
+                for chunk in column_chunks(frame, list(fields.values()), batch_size)
+            )
+            adapter = None
+        else:
+            chunks = record_chunks(frame, fields, batch_size)
+            adapter = TypeAdapter(List[self.input_model])  # type: ignore
+
+        outputs: List[Any] = []
+        for chunk in chunks:
+            try:
+                inputs = chunk if adapter is None else adapter.validate_python(chunk)
+                outputs.extend(self(inputs, batch_call=True, **kwargs))
+            except Exception:
+                if on_error == "raise":
+                    raise
+                outputs.extend([None] * len(chunk))
+
+        # Outputs wrapped in a model are written as a single column
+        wrapped = self.output_model and self._output_field is not None
+        schema = self.output_schema or {}
+        properties = schema.get("properties", {})
+        defs = schema.get("$defs", {})
+        if not wrapped and properties:
+            output_columns = {
+                output_prefix
+                + name: to_column(
+                    frame,
+                    [getattr(output, name, None) for output in outputs],
+                    resolve_schema(property, defs),
+                )
+                for name, property in properties.items()
+            }
+        else:
+            property = properties.get(self._output_field or "", {})
+            output_columns = {
+                output_prefix
+                + "output": to_column(frame, outputs, resolve_schema(property, defs))
+            }
+        return with_columns(frame, output_columns)
+
+    def async_handler(self, event_manager: Optional[Callable[[], EventManager]] = None):
         """
         Returns an async route handler for the language function that can be used with
         FastAPI.
 
+        Args:
+            event_manager (Callable, optional): Returns the event manager of each
+            request. Defaults to the default event manager.
+
         Returns:
             Callable: A FastAPI route handler for the language function.
         """
 
         async def handler(input=None):
-            return self(**input) if isinstance(input, dict) else self(input)
+            manager = event_manager() if event_manager is not None else None
+            if isinstance(input, dict):
+                return self(**input, event_manager=manager)
+            return self(input, event_manager=manager)
 
         handler.__annotations__["input"] = self.input_model
         if self.output_model.__name__ == "OutputWrapper":
@@ -398,7 +798,13 @@ class LMFunc(Base, Generic[InputArgs, ReturnType]):
             handler.__annotations__["return"] = self.output_model
         return handler
 
-    def fastapi_app(self, fast_api_params: Dict = {}):
+    def fastapi_app(
+        self,
+        fast_api_params: Dict = {},
+        metrics: bool = False,
+        profile: bool = False,
+        profile_interval: float = 0.01,
+    ):
         """
         Creates a FastAPI application with the specified parameters and registers
         a POST route for the current instance.
@@ -406,6 +812,17 @@ class LMFunc(Base, Generic[InputArgs, ReturnType]):
         Args:
             fast_api_params (Dict, optional): Additional parameters to be passed to the
             FastAPI application. Defaults to {}.
+            metrics (bool, optional): Whether to register a GET /metrics route exposing
+            the Prometheus metrics. The requests of the route of the function are
+            handled with the default event manager plus the prometheusMetrics preset,
+            leaving the default event manager unchanged. Defaults to False.
+            profile (bool, optional): Whether to sample the stacks of the busy server
+            threads every `profile_interval` seconds while the application runs
+            (from its startup to its shutdown) and register a GET /debug/profile
+            route returning the samples in the folded stacks format (with
+            `reset=true` clearing them). Defaults to False.
+            profile_interval (float, optional): The sampling interval in seconds.
+            Defaults to 0.01.
 
         Returns:
             FastAPI: The created FastAPI application.
@@ -413,22 +830,79 @@ class LMFunc(Base, Generic[InputArgs, ReturnType]):
         lazy_import("fastapi")
         import fastapi
 
+        profiler = None
+        if profile:
+            from lmfunctions.utils import SamplingProfiler
+
+            profiler = SamplingProfiler(interval=profile_interval)
+            fast_api_params = fast_api_params | dict(
+                lifespan=profiled_lifespan(profiler, fast_api_params.get("lifespan"))
+            )
+
         app = fastapi.FastAPI(**fast_api_params)
+        event_manager: Optional[Callable[[], EventManager]] = None
+
+        if metrics:
+            from fastapi.responses import PlainTextResponse
+
+            from lmfunctions.managers import prometheusMetrics
+
+            recorder = prometheusMetrics.event_manager()
+            composed: Dict[str, EventManager] = {}
+
+            def metrics_event_manager() -> EventManager:
+                # Composed again only when the default event manager is replaced
+                manager = default.event_manager
+                if prometheusMetrics.installed(manager):
+                    return manager
+                if composed.get("default") is not manager:
+                    composed.update(default=manager, composed=manager + recorder)
+                return composed["composed"]
+
+            event_manager = metrics_event_manager
+
+            @app.get("/metrics", response_class=PlainTextResponse)
+            def metrics_handler():
+                return PlainTextResponse(
+                    prometheusMetrics.render(metrics_event_manager()),
+                    media_type="text/plain; version=0.0.4; charset=utf-8",
+                )
+
         app.post(
             f"/{self.name}",
             name=self.name,
             description=self.description,
-        )(self.async_handler())
+        )(self.async_handler(event_manager))
+
+        if profiler is not None:
+            from fastapi.responses import PlainTextResponse
+
+            @app.get("/debug/profile", response_class=PlainTextResponse)
+            def profile_handler(reset: bool = False):
+                folded = profiler.folded()
+                if reset:
+                    profiler.reset()
+                return PlainTextResponse(folded)
 
         return app
 
-    def serve(self, fast_api_params={}, uvicorn_params={}):
+    def serve(
+        self,
+        fast_api_params={},
+        uvicorn_params={},
+        metrics=False,
+        profile=False,
+        profile_interval=0.01,
+    ):
         """
         Serves the lmfunc using FastAPI and Uvicorn.
 
         Args:
             fast_api_params (dict): Parameters to be passed to the FastAPI application.
             uvicorn_params (dict): Parameters to be passed to the Uvicorn server.
+            metrics (bool): Whether to expose the Prometheus metrics on /metrics.
+            profile (bool): Whether to expose sampled stacks on /debug/profile.
+            profile_interval (float): The profiler sampling interval in seconds.
 
         Returns:
             None
@@ -440,11 +914,37 @@ class LMFunc(Base, Generic[InputArgs, ReturnType]):
 
             return uvicorn.run(app, **kwargs)
 
-        app = self.fastapi_app(fast_api_params)
+        app = self.fastapi_app(
+            fast_api_params,
+            metrics=metrics,
+            profile=profile,
+            profile_interval=profile_interval,
+        )
         if app:
             return start_uvicorn_server(app, **uvicorn_params)
 
 
+def profiled_lifespan(profiler: Any, lifespan: Optional[Callable] = None):
+    """
+    Returns the lifespan of a FastAPI application running the profiler from the
+    startup to the shutdown of the application, around its own lifespan if any.
+    """
+
+    @asynccontextmanager
+    async def profiled(app):
+        profiler.start()
+        try:
+            if lifespan is None:
+                yield
+            else:
+                async with lifespan(app) as state:
+                    yield state
+        finally:
+            profiler.stop()
+
+    return profiled
+
+
 def lmdef(func: Callable[InputArgs, ReturnType]):
     """
     Decorator that creates an LMFunc instance from a regular Python function.
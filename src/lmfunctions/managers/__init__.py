@@ -1,7 +1,19 @@
 from .consolerich import consoleRich
 from .filelog import fileLog
+from .latencymetrics import LatencyMetrics, latencyMetrics
 from .panelprint import panelPrint
+from .prometheusmetrics import PrometheusMetrics, prometheusMetrics
 from .timeevents import timeEvents
 from .tokenstream import tokenStream
 
-__all__ = ["consoleRich", "fileLog", "panelPrint", "tokenStream", "timeEvents"]
+__all__ = [
+    "consoleRich",
+    "fileLog",
+    "panelPrint",
+    "tokenStream",
+    "timeEvents",
+    "LatencyMetrics",
+    "latencyMetrics",
+    "PrometheusMetrics",
+    "prometheusMetrics",
+]
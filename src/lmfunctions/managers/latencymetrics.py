@@ -0,0 +1,135 @@
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from lmfunctions.eventmanager import EventManager
+from lmfunctions.utils.histogram import Histogram
+
+
+class LatencyMetrics:
+    """
+    Latency metrics of language function calls, aggregated per function name in
+    streaming histograms with constant memory:
+
+    - render: time from the call start to the first rendered input.
+    - time_to_first_token: time from the input rendering to the first token.
+    - inter_token: time between consecutive tokens.
+    - generation: time from the input rendering to the last token.
+    - parse: time from the last token to the output (parsing and validation).
+    - total: time from the call start to the output.
+
+    Calls are identified by their span, or else by their thread, and batch calls are
+    timed until the success event of their last output. Timings are taken when the
+    handlers run, so the event manager must use the synchronous dispatch.
+    """
+
+    metrics = [
+        "render",
+        "time_to_first_token",
+        "inter_token",
+        "generation",
+        "parse",
+        "total",
+    ]
+
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self.histograms: Dict[str, Dict[str, Histogram]] = {}
+        # State of the calls in progress, by call key
+        self._calls: Dict[Tuple[str, int], Dict] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, func_name: str, metric: str) -> Histogram:
+        histograms = self.histograms.get(func_name)
+        if histograms is None:
+            with self._lock:
+                histograms = self.histograms.setdefault(
+                    func_name,
+                    {metric: Histogram(self.precision) for metric in self.metrics},
+                )
+        return histograms[metric]
+
+    def call_start(self, func, **kwargs):
+        self._calls[EventManager.call_key(kwargs)] = dict(
+            name=func.name,
+            start=time.perf_counter(),
+            rendered=None,
+            last=None,
+            outputs=0,
+        )
+
+    def input_render(self, **kwargs):
+        now = time.perf_counter()
+        call = self._calls.get(EventManager.call_key(kwargs))
+        if call is None:
+            return
+        if call["rendered"] is None:
+            self.histogram(call["name"], "render").record(now - call["start"])
+        # Retried attempts are timed from their own rendering
+        call["rendered"], call["last"] = now, None
+
+    def token_or_char(self, **kwargs):
+        now = time.perf_counter()
+        call = self._calls.get(EventManager.call_key(kwargs))
+        if call is None or call["rendered"] is None:
+            return
+        last = call["last"]
+        if last is None:
+            self.histogram(call["name"], "time_to_first_token").record(
+                now - call["rendered"]
+            )
+        else:
+            self.histogram(call["name"], "inter_token").record(now - last)
+        call["last"] = now
+
+    def success(self, batch_size=1, **kwargs):
+        now = time.perf_counter()
+        call = self._calls.get(EventManager.call_key(kwargs))
+        if call is None:
+            return
+        call["outputs"] += 1
+        if call["outputs"] < batch_size:
+            return
+        self._calls.pop(EventManager.call_key(kwargs), None)
+        name, last = call["name"], call["last"]
+        if call["rendered"] is not None:
+            self.histogram(name, "generation").record((last or now) - call["rendered"])
+        if last is not None:
+            self.histogram(name, "parse").record(now - last)
+        self.histogram(name, "total").record(now - call["start"])
+
+    def exception(self, **kwargs):
+        self._calls.pop(EventManager.call_key(kwargs), None)
+
+    def event_manager(self) -> EventManager:
+        """Returns an event manager that records the metrics."""
+        return EventManager(
+            handlers={
+                "call_start": [self.call_start],
+                "input_render": [self.input_render],
+                "token_or_char": [self.token_or_char],
+                "success": [self.success],
+                "exception": [self.exception],
+            }
+        )
+
+    def summary(self, quantiles: List[float] = [0.5, 0.95, 0.99]) -> Dict:
+        """
+        Returns the count, the mean and the quantiles in seconds of each metric, by
+        function name.
+        """
+        return {
+            func_name: {
+                metric: histogram.summary(quantiles)
+                for metric, histogram in histograms.items()
+            }
+            for func_name, histograms in self.histograms.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+
+# Metrics recorded by the latencyMetrics preset
+latencyMetrics = LatencyMetrics()
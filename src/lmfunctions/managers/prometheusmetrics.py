@@ -0,0 +1,215 @@
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from lmfunctions.eventmanager import EventManager
+
+Labels = Tuple[Tuple[str, str], ...]
+
+BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf]
+
+
+def format_labels(labels: Labels, **extra) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for key, value in items
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    return "+Inf" if value == math.inf else f"{value:g}"
+
+
+class PrometheusMetrics:
+    """
+    Operational metrics of language function calls in the Prometheus text format,
+    labelled by function name, backend and model:
+
+    - lmfunctions_calls_total, lmfunctions_retries_total,
+      lmfunctions_exceptions_total and lmfunctions_cache_hits_total counters.
+    - lmfunctions_generated_chars_total counter, and with `count_tokens` the
+      lmfunctions_generated_tokens_total counter, where the completions are
+      tokenized again with the tokenizer of the backend.
+    - lmfunctions_time_to_first_token_seconds and lmfunctions_latency_seconds
+      histograms.
+    - lmfunctions_in_flight_calls and lmfunctions_event_queue_depth gauges.
+
+    Calls are identified by their span, or else by their thread, and end after the
+    success events of all their outputs. Timings are taken when the handlers run, so
+    the event manager must use the synchronous dispatch.
+    """
+
+    def __init__(self, buckets: List[float] = BUCKETS, count_tokens: bool = False):
+        self.buckets = buckets
+        self.count_tokens = count_tokens
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], List] = {}
+        # State of the calls in progress, by call key
+        self._calls: Dict[Tuple[str, int], Dict] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, labels: Labels, value: float = 1) -> None:
+        with self._lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = [
+                    [0] * len(self.buckets),
+                    0.0,
+                ]
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    histogram[0][i] += 1
+            histogram[1] += value
+
+    def labels(self, backend=None, func=None, **kwargs) -> Labels:
+        # Events without a function are labelled as the call in progress, if any
+        call = self._calls.get(EventManager.call_key(kwargs)) if func is None else None
+        if call is not None:
+            return call["labels"]
+        return (
+            ("function", getattr(func, "name", "")),
+            ("backend", getattr(backend, "name", "")),
+            ("model", getattr(backend, "model", "")),
+        )
+
+    def call_start(self, func, backend, **kwargs):
+        labels = self.labels(backend, func)
+        self._calls[EventManager.call_key(kwargs)] = dict(
+            labels=labels,
+            start=time.perf_counter(),
+            first=None,
+            outputs=0,
+            tokens=0,
+            chars=0,
+        )
+        self.increment("lmfunctions_calls_total", labels)
+
+    def token_or_char(self, token_or_char, **kwargs):
+        call = self._calls.get(EventManager.call_key(kwargs))
+        if call is None:
+            return
+        if call["first"] is None:
+            call["first"] = time.perf_counter()
+        call["chars"] += len(token_or_char)
+
+    def end_call(self, kwargs):
+        call = self._calls.pop(EventManager.call_key(kwargs), None)
+        if call is not None:
+            if self.count_tokens:
+                self.increment(
+                    "lmfunctions_generated_tokens_total", call["labels"], call["tokens"]
+                )
+            self.increment(
+                "lmfunctions_generated_chars_total", call["labels"], call["chars"]
+            )
+        return call
+
+    def success(self, backend=None, completion="", batch_size=1, **kwargs):
+        now = time.perf_counter()
+        call = self._calls.get(EventManager.call_key(kwargs))
+        if call is None:
+            return
+        counter = getattr(backend, "count_tokens", None) if self.count_tokens else None
+        if completion and counter is not None:
+            call["tokens"] += counter(completion)
+        call["outputs"] += 1
+        # Batch calls end with the success event of their last output
+        if call["outputs"] < batch_size:
+            return
+        self.end_call(kwargs)
+        if call["first"] is not None:
+            self.observe(
+                "lmfunctions_time_to_first_token_seconds",
+                call["labels"],
+                call["first"] - call["start"],
+            )
+        self.observe("lmfunctions_latency_seconds", call["labels"], now - call["start"])
+
+    def retry(self, backend=None, **kwargs):
+        self.increment("lmfunctions_retries_total", self.labels(backend, **kwargs))
+
+    def exception(self, **kwargs):
+        call = self.end_call(kwargs)
+        labels = call["labels"] if call is not None else self.labels(**kwargs)
+        self.increment("lmfunctions_exceptions_total", labels)
+
+    def cache_hit(self, backend=None, func=None, inputs=[None], **kwargs):
+        self.increment(
+            "lmfunctions_cache_hits_total",
+            self.labels(backend, func, **kwargs),
+            len(inputs),
+        )
+
+    def event_manager(self) -> EventManager:
+        """Returns an event manager that records the metrics."""
+        return EventManager(
+            handlers={
+                "call_start": [self.call_start],
+                "token_or_char": [self.token_or_char],
+                "success": [self.success],
+                "retry": [self.retry],
+                "exception": [self.exception],
+                "cache_hit": [self.cache_hit],
+            }
+        )
+
+    def installed(self, event_manager: EventManager) -> bool:
+        """Returns whether the event manager records the metrics."""
+        return self.call_start in event_manager.handlers.get("call_start", [])
+
+    def render(self, event_manager: Optional[EventManager] = None) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format, with the depth
+        of the queue of the event manager dispatching the events, by default the
+        default one.
+        """
+        from lmfunctions.default import default
+
+        if event_manager is None:
+            event_manager = default.event_manager
+
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: (list(counts), total)
+                for key, (counts, total) in self.histograms.items()
+            }
+            calls = list(self._calls.values())
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, labels), value in counters.items():
+                if counter_name == name:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (histogram_name, labels), (counts, total) in histograms.items():
+                if histogram_name != name:
+                    continue
+                for bucket, count in zip(self.buckets, counts):
+                    le = format_labels(labels, le=format_value(bucket))
+                    lines.append(f"{name}_bucket{le} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{format_labels(labels)} {counts[-1]}")
+        in_flight: Dict[Labels, int] = {}
+        for call in calls:
+            in_flight[call["labels"]] = in_flight.get(call["labels"], 0) + 1
+        lines.append("# TYPE lmfunctions_in_flight_calls gauge")
+        for labels, count in in_flight.items():
+            lines.append(f"lmfunctions_in_flight_calls{format_labels(labels)} {count}")
+        lines.append("# TYPE lmfunctions_event_queue_depth gauge")
+        lines.append(f"lmfunctions_event_queue_depth {event_manager.queue_depth}")
+        return "\n".join(lines) + "\n"
+
+
+# Metrics recorded by the prometheusMetrics preset
+prometheusMetrics = PrometheusMetrics()
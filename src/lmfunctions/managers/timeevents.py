@@ -1,35 +1,29 @@
-from pandas import DataFrame
 from rich import print
 
-from lmfunctions.eventmanager import EventManager
+from lmfunctions.eventmanager import BatchPolicy, EventManager
 from lmfunctions.handlers import OtelEventHandler
 from lmfunctions.utils.tracing import get_or_create_tracer_provider
 
 
-def time_diff(df, event_type1, event_type2):
-    return (
-        float(
-            df.loc[event_type1]["timestamp"].min()
-            - df.loc[event_type2]["timestamp"].max()
-        )
-        / 10**9
-    )
+def time_diff(timestamps, event_type1, event_type2):
+    return (timestamps[event_type1][0] - timestamps[event_type2][1]) / 10**9
 
 
-def print_stats(completion, span, **kwargs):
-    events = DataFrame.from_records(
-        [
-            {"name": e.name, "timestamp": e.timestamp, "attributes": e.attributes}
-            for e in span.events
-        ],
-        index="name",
-    )
+def print_stats(completion, span, cached=False, **kwargs):
+    if cached:
+        # Outputs served from the cache have no generation to time
+        return
+    # First and last timestamp of each event type
+    timestamps = {}
+    for e in span.events:
+        first, last = timestamps.get(e.name, (e.timestamp, e.timestamp))
+        timestamps[e.name] = (min(first, e.timestamp), max(last, e.timestamp))
     completion_length = len(completion)
-    time_to_input_render = time_diff(events, "input_render", "call_start")
-    time_to_first_token = time_diff(events, "token_or_char", "call_start")
-    time_to_first_token_lm_only = time_diff(events, "token_or_char", "input_render")
-    lm_call_time = time_diff(events, "success", "input_render")
-    total_time = time_diff(events, "success", "call_start")
+    time_to_input_render = time_diff(timestamps, "input_render", "call_start")
+    time_to_first_token = time_diff(timestamps, "token_batch", "call_start")
+    time_to_first_token_lm_only = time_diff(timestamps, "token_batch", "input_render")
+    lm_call_time = time_diff(timestamps, "success", "input_render")
+    total_time = time_diff(timestamps, "success", "call_start")
     stats = {
         "Completion Characters": completion_length,
         "Time to Input Render": time_to_input_render,
@@ -51,15 +45,21 @@ def timeEvents() -> EventManager:
         handlers={
             "call_start": [OtelEventHandler(event_name="call_start")],
             "input_render": [OtelEventHandler(event_name="input_render")],
-            "token_or_char": [
+            "token_batch": [
                 OtelEventHandler(
-                    event_name="token_or_char",
+                    event_name="token_batch",
                     attributes_vars={"token_or_char": "token_or_char"},
+                    timestamp_var="batch_start",
                 )
             ],
             "success": [OtelEventHandler(event_name="success"), print_stats],
             "exception": [
                 OtelEventHandler(event_name="exception"),
             ],
-        }
+        },
+        batching={
+            "token_or_char": BatchPolicy(
+                event_name="token_batch", interval=0.1, join=["token_or_char"]
+            )
+        },
     )
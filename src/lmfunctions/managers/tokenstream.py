@@ -1,11 +1,16 @@
-from lmfunctions.eventmanager import EventManager
+from lmfunctions.eventmanager import BatchPolicy, EventManager
 from lmfunctions.handlers import PrintHandler
 
-# EventManager preset that prints individual tokens or characters to the console as
-# they are processed.
+# EventManager preset that prints tokens or characters to the console as they are
+# processed. Tokens are printed in batches, at most every 50 milliseconds.
 
 tokenStream = EventManager(
     handlers={
-        "token_or_char": [PrintHandler(varnames=["token_or_char"], end="", flush=True)]
-    }
+        "token_batch": [PrintHandler(varnames=["token_or_char"], end="", flush=True)]
+    },
+    batching={
+        "token_or_char": BatchPolicy(
+            event_name="token_batch", interval=0.05, join=["token_or_char"]
+        )
+    },
 )
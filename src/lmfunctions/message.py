@@ -3,6 +3,7 @@ from typing import Any, Callable, Dict, Iterator, List, Optional, TypeGuard, Uni
 
 from lmfunctions.base import Base
 from lmfunctions.handlers import PrintHandler
+from lmfunctions.utils import json_loads
 
 
 class Message(Base):
@@ -28,6 +29,11 @@ class Message(Base):
         if unprocessed is not None:
             self._unprocessed = unprocessed
 
+    @property
+    def streamed(self) -> bool:
+        """Whether the message is generated while being processed."""
+        return not isinstance(self._unprocessed, str)
+
     def __repr__(self):
         self.process()
         print()
@@ -39,6 +45,7 @@ class Message(Base):
         handle_token_or_char: Optional[Callable] = PrintHandler(
             varnames=["token_or_char"], end="", flush=True
         ),
+        parse: bool = True,
         **kwargs
     ) -> Any:
         """
@@ -48,6 +55,7 @@ class Message(Base):
         Args:
             schema (Optional[Dict]): A JSON schema to parse the response.
             handle_token_or_chat (Optional[Callable]): A callback function to be called when a new token/character is processed. Defaults to PrintHandler.
+            parse (bool): Whether to parse the content as JSON. Defaults to True.
 
         Returns:
             Any: The (optionally parsed) response content.
@@ -60,40 +68,41 @@ class Message(Base):
             json_object = (schema is not None) and (
                 schema.get("type", None) == "object"
             )
-            # The response is unprocessed
+            # The response is unprocessed. The content is accumulated locally and
+            # assigned once, to avoid validating the model on every token.
             depth, in_json = 0, False
-            for token_or_char in self._unprocessed:
-                open_braces, closed_braces = token_or_char.count(
-                    "{"
-                ), token_or_char.count("}")
-                if not (json_object) or in_json or open_braces:
-                    self.content += token_or_char
-                    # New token or character callback
-                    if handle_token_or_char:
-                        handle_token_or_char(
-                            schema=schema,
-                            json_object=json_object,
-                            token_or_char=token_or_char,
-                            depth=depth,
-                            in_json=in_json,
-                            open_braces=open_braces,
-                            closed_braces=closed_braces,
-                            **kwargs
-                        )
-                if json_object:
-                    if in_json:
+            content: List[str] = []
+            try:
+                for token_or_char in self._unprocessed:
+                    if json_object or handle_token_or_char:
+                        open_braces = token_or_char.count("{")
+                        closed_braces = token_or_char.count("}")
+                    if not (json_object) or in_json or open_braces:
+                        content.append(token_or_char)
+                        # New token or character callback
+                        if handle_token_or_char:
+                            handle_token_or_char(
+                                schema=schema,
+                                json_object=json_object,
+                                token_or_char=token_or_char,
+                                depth=depth,
+                                in_json=in_json,
+                                open_braces=open_braces,
+                                closed_braces=closed_braces,
+                                **kwargs
+                            )
+                    if json_object and (in_json or open_braces):
+                        # Pieces of text can open and close several braces
                         depth += open_braces - closed_braces
-                        if depth == 0:
-                            try:
-                                return json.loads(self.content)
-                            except json.JSONDecodeError:
-                                break
-                    elif open_braces:
-                        depth, in_json = 1, True
-
-        if schema and schema.get("type", None) != "string":
+                        in_json = True
+                        if depth <= 0:
+                            break
+            finally:
+                self.content = "".join(content)
+
+        if parse and schema and schema.get("type", None) != "string":
             try:
-                return json.loads(self.content)
+                return json_loads(self.content)
             except json.JSONDecodeError:
                 # If parsing fails, return the raw text
                 return self.content
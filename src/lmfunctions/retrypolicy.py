@@ -1,7 +1,13 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
 from enum import Enum
+from typing import Any, Dict, Optional
 
 import yaml
 from tenacity import (
+    RetryCallState,
+    retry_if_not_exception_type,
     stop_after_attempt,
     stop_after_delay,
     wait_exponential,
@@ -9,8 +15,10 @@ from tenacity import (
     wait_none,
     wait_random,
 )
+from tenacity.wait import wait_base
 
 from lmfunctions.base import Base
+from lmfunctions.utils import token_bucket
 
 
 class StopType(str, Enum):
@@ -26,10 +34,147 @@ class WaitType(str, Enum):
     exponential = "exponential"
 
 
+class CircuitOpenError(Exception):
+    """Raised when calling a backend whose circuit breaker is open."""
+
+
+def retry_after(exception: Optional[BaseException]) -> Optional[float]:
+    """
+    Returns the backoff in seconds requested by the server, if any, looking for
+    `Retry-After` or `Retry-After-Ms` headers in the response attached to the
+    exception, or for a `retry_after` attribute.
+    """
+    if exception is None:
+        return None
+    value = getattr(exception, "retry_after", None)
+    if isinstance(value, (int, float)):
+        return float(value)
+    response = getattr(exception, "response", None)
+    headers = getattr(response, "headers", None) or getattr(exception, "headers", None)
+    if not headers:
+        return None
+    headers = {key.lower(): value for key, value in dict(headers).items()}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                # HTTP date format
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class wait_retry_after(wait_base):
+    """
+    Wait strategy that honors the backoff requested by the server, falling back
+    to another wait strategy when the server does not provide one.
+    """
+
+    def __init__(self, fallback: wait_base, max_wait: float):
+        self.fallback = fallback
+        self.max_wait = max_wait
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        outcome = retry_state.outcome
+        delay = retry_after(outcome.exception() if outcome else None)
+        if delay is None:
+            return self.fallback(retry_state)
+        return min(delay, self.max_wait)
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures of a backend. After `threshold` consecutive
+    failures the circuit opens and calls fail fast until `cooldown` seconds have
+    passed. The circuit is then half-open: a single call is let through as a probe,
+    while the other calls keep failing fast until the outcome of the probe closes
+    the circuit or opens it again. A probe without an outcome after `cooldown`
+    seconds is replaced by the next call.
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def check(self, cooldown: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self.probe_at is not None:
+                if now - self.probe_at < cooldown:
+                    raise CircuitOpenError(
+                        f"Circuit half-open after {self.failures} consecutive "
+                        "failures, waiting for the probe call"
+                    )
+            elif self.opened_at is None:
+                return
+            else:
+                remaining = cooldown - (now - self.opened_at)
+                if remaining > 0:
+                    raise CircuitOpenError(
+                        f"Circuit open after {self.failures} consecutive failures, "
+                        f"retry in {remaining:.1f}s"
+                    )
+            # Half-open: this call is the probe
+            self.opened_at, self.probe_at = None, now
+
+    def record(self, success: bool, threshold: int) -> None:
+        with self._lock:
+            if success:
+                self.failures, self.opened_at, self.probe_at = 0, None, None
+            else:
+                self.failures += 1
+                if self.probe_at is not None or self.failures >= threshold:
+                    # A failure of the probe opens the circuit again
+                    self.opened_at, self.probe_at = time.monotonic(), None
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def backend_key(backend: Any) -> str:
+    """
+    Returns the key identifying the state shared by calls to the same backend:
+    the key of its rate limit when the backend has one, so that backends with
+    the same configuration share a circuit breaker, and its name and model
+    otherwise.
+    """
+    rate_key = getattr(backend, "rate_key", None)
+    if isinstance(rate_key, str):
+        return rate_key
+    return f"{getattr(backend, 'name', '')}:{getattr(backend, 'model', '')}"
+
+
+def circuit_breaker(key: str) -> CircuitBreaker:
+    """Returns the circuit breaker registered under the given key."""
+    breaker = _circuit_breakers.get(key)
+    if breaker is None:
+        with _circuit_breakers_lock:
+            breaker = _circuit_breakers.get(key)
+            if breaker is None:
+                breaker = _circuit_breakers[key] = CircuitBreaker()
+    return breaker
+
+
 class RetryPolicy(Base):
     """
     A retry policy in a serializable format. It generates retry arguments
     for the tenacity library. See https://tenacity.readthedocs.io/en/latest/.
+
+    The policy can also protect overloaded backends: `wait_retry_after` honors
+    the backoff requested by the server (e.g. on 429 responses), the circuit
+    breaker fails fast after `circuit_breaker_threshold` consecutive backend
+    failures for `circuit_breaker_cooldown` seconds, and `requests_per_minute`
+    limits the calls (including retries) with a token bucket. The circuit breaker
+    and token bucket are shared by all language functions using backends with the
+    same configuration (see `backend_key`).
     """
 
     stop: StopType = StopType.after_attempt
@@ -43,6 +188,11 @@ class RetryPolicy(Base):
     wait_exponential_max: int = 2
     wait_exponential_multiplier: float = 2.0
     reraise: bool = True
+    wait_retry_after: bool = False
+    wait_retry_after_max: float = 60
+    circuit_breaker_threshold: int | None = None
+    circuit_breaker_cooldown: float = 30
+    requests_per_minute: float | None = None
 
     @property
     def args(self) -> dict:
@@ -69,9 +219,38 @@ class RetryPolicy(Base):
                 max=self.wait_exponential_max,
                 multiplier=self.wait_exponential_multiplier,
             )
+        if self.wait_retry_after:
+            retry_args["wait"] = wait_retry_after(
+                retry_args["wait"], self.wait_retry_after_max
+            )
+        retry_args["retry"] = retry_if_not_exception_type(CircuitOpenError)
         retry_args["reraise"] = self.reraise
         return retry_args
 
+    def before_call(self, backend: Any) -> None:
+        """
+        Called before each call to the backend. Fails fast if the circuit breaker
+        of the backend is open, and waits for the shared rate limit.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker of the backend is open.
+        """
+        key = backend_key(backend)
+        if self.circuit_breaker_threshold:
+            circuit_breaker(key).check(self.circuit_breaker_cooldown)
+        if self.requests_per_minute:
+            token_bucket(f"retrypolicy:{key}", self.requests_per_minute / 60).acquire()
+
+    def after_call(self, backend: Any, success: bool) -> None:
+        """
+        Records the outcome of a call to the backend in its circuit breaker. The
+        outcome of a streamed call is only known once its response is consumed.
+        """
+        if self.circuit_breaker_threshold:
+            circuit_breaker(backend_key(backend)).record(
+                success, self.circuit_breaker_threshold
+            )
+
 
 # Workaround for issue with YAML serialization of enums
 # See https://github.com/yaml/pyyaml/issues/722
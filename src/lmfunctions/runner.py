@@ -0,0 +1,297 @@
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import fsspec
+from pydantic import BaseModel, Field, TypeAdapter
+from typing_extensions import Annotated
+
+from lmfunctions.backends import LMBackend
+from lmfunctions.default import default
+from lmfunctions.lmfunc import LMFunc
+from lmfunctions.message import Message
+from lmfunctions.utils import json_dumps, lazy_import, loadf
+
+FORMATS = ["jsonl", "csv", "parquet"]
+
+# Backends running a model in the process, which cannot be called concurrently
+LOCAL_BACKENDS = ("llamacpp", "transformers", "vllm")
+
+
+def input_format(path: str, format: Optional[str] = None) -> str:
+    """Returns the format of the input, given explicitly or by the file extension."""
+    format = format or os.path.splitext(path)[1][1:].lower()
+    format = "jsonl" if format in ("json", "ndjson") else format
+    if format not in FORMATS:
+        raise ValueError(f"Unsupported input format: {format}")
+    return format
+
+
+def count_records(path: str, format: str) -> Optional[int]:
+    """Returns the number of records of the input, counting the lines of text files."""
+    if format == "parquet":
+        lazy_import("pyarrow")
+        import pyarrow.parquet as pq
+
+        with fsspec.open(path, "rb") as file:
+            return pq.ParquetFile(file).metadata.num_rows
+    lines, last = 0, b""
+    with fsspec.open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            lines += chunk.count(b"\n")
+            last = chunk
+        if lines and not last.endswith(b"\n"):
+            lines += 1
+    # CSV files have a header line, and records with newlines are overcounted
+    return lines - 1 if format == "csv" else lines
+
+
+def read_records(path: str, format: str, offset: int = 0) -> Iterator[Dict[str, Any]]:
+    """Streams the records of the input as dictionaries, skipping the first `offset`."""
+    if format == "parquet":
+        lazy_import("pyarrow")
+        import pyarrow.parquet as pq
+
+        with fsspec.open(path, "rb") as file:
+            parquet = pq.ParquetFile(file)
+            for batch in parquet.iter_batches():
+                if offset >= batch.num_rows:
+                    offset -= batch.num_rows
+                    continue
+                yield from batch.slice(offset).to_pylist()
+                offset = 0
+    elif format == "csv":
+        with fsspec.open(path, "r", newline="", encoding="utf-8") as file:
+            yield from islice(csv.DictReader(file), offset, None)
+    else:
+        with fsspec.open(path, "r", encoding="utf-8") as file:
+            lines = (line for line in file if line.strip())
+            for line in islice(lines, offset, None):
+                yield json.loads(line)
+
+
+def load_function(reference: str) -> LMFunc:
+    """Loads a language function from a file or URL, or from the object store."""
+    if os.path.exists(reference) or "://" in reference:
+        return LMFunc.from_file(reference)
+    return LMFunc.from_store(reference)
+
+
+def load_backend(reference: str) -> LMBackend:
+    """Loads a backend configuration from a file or URL."""
+    adapter = TypeAdapter(Annotated[LMBackend, Field(discriminator="name")])
+    return adapter.validate_python(loadf(reference))
+
+
+def is_local(backend: Any) -> bool:
+    """Returns whether the backend (or any backend of a composite) is local."""
+    if getattr(backend, "name", None) == "composite":
+        return any(is_local(item) for item in backend.backends)
+    return getattr(backend, "name", None) in LOCAL_BACKENDS
+
+
+def to_jsonable(output: Any) -> Any:
+    if isinstance(output, BaseModel):
+        return output.model_dump(mode="json")
+    if isinstance(output, Message):
+        return output.content
+    if isinstance(output, list):
+        return [to_jsonable(item) for item in output]
+    return output
+
+
+class Checkpoint:
+    """
+    The progress of a job, stored in a JSON file next to the output: the number of
+    processed input records and the size of the output written for them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.output_bytes = 0
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as file:
+            data = json.load(file)
+        self.offset, self.output_bytes = data["offset"], data["output_bytes"]
+        return True
+
+    def save(self) -> None:
+        # Written atomically, so that a killed job leaves a consistent checkpoint
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(dict(offset=self.offset, output_bytes=self.output_bytes), file)
+        os.replace(temporary, self.path)
+
+
+class Progress:
+    """Reports the throughput and the estimated time to completion of a job."""
+
+    def __init__(
+        self, total: Optional[int], done: int = 0, interval: float = 5, file=sys.stderr
+    ):
+        self.total = total
+        self.start_done = self.done = done
+        self.errors = 0
+        self.interval = interval
+        self.file = file
+        self.start = self.last = time.perf_counter()
+        self.reported = None
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return (self.done - self.start_done) / elapsed if elapsed else 0.0
+
+    def report(self, force: bool = False) -> None:
+        now = time.perf_counter()
+        if self.reported == self.done or (
+            not force and now - self.last < self.interval
+        ):
+            return
+        self.last, self.reported = now, self.done
+        rate = self.rate
+        message = f"{self.done}"
+        if self.total is not None:
+            message += f"/{self.total}"
+        message += f" records, {rate:.2f} records/s"
+        if self.errors:
+            message += f", {self.errors} errors"
+        if self.total is not None and rate:
+            eta = int(max(self.total - self.done, 0) / rate)
+            message += f", ETA {eta // 3600:d}:{eta // 60 % 60:02d}:{eta % 60:02d}"
+        print(message, file=self.file, flush=True)
+
+
+def record_input(record: Dict[str, Any], column: Optional[str] = None) -> Any:
+    """Returns the input of a record: a column, the only string field, or the record."""
+    if column is not None:
+        return record[column]
+    if len(record) == 1:
+        value = next(iter(record.values()))
+        if isinstance(value, str):
+            return value
+    return record
+
+
+def write_batch(
+    results: List[Dict],
+    errors: int,
+    file: io.BufferedIOBase,
+    checkpoint: Checkpoint,
+    progress: Progress,
+) -> None:
+    """Writes the results of a batch, of which `errors` failed, and checkpoints."""
+    file.write("".join(json_dumps(result) + "\n" for result in results).encode())
+    file.flush()
+    checkpoint.offset += len(results)
+    checkpoint.output_bytes = file.tell()
+    checkpoint.save()
+    progress.done += len(results)
+    progress.errors += errors
+    progress.report()
+
+
+def run(
+    func: LMFunc,
+    input: str,
+    output: str,
+    format: Optional[str] = None,
+    column: Optional[str] = None,
+    output_key: str = "output",
+    batch_size: int = 1,
+    concurrency: int = 1,
+    fail_fast: bool = False,
+    restart: bool = False,
+    progress_interval: float = 5,
+    **kwargs,
+) -> Progress:
+    """
+    Runs a language function over the records of a JSONL, CSV or Parquet input,
+    writing each record with its output (or its error) to a JSONL output.
+
+    Records are processed in batches of `batch_size` records, with at most
+    `concurrency` batches in flight, and written in the input order as soon as
+    they are completed. Calls to local backends (running the model in the process)
+    are serialized, so that only the reading and writing of records overlap. After
+    each batch, the progress is checkpointed in the `<output>.checkpoint` file, so
+    that a job that was interrupted resumes from the last written record, unless
+    `restart` is set.
+
+    Args:
+        func (LMFunc): The language function.
+        input (str): The path or URL of the input.
+        output (str): The path of the output.
+        format (str, optional): The input format, by default from the extension.
+        column (str, optional): The column used as input, by default the record.
+        output_key (str, optional): The key of the output in the output records.
+        batch_size (int, optional): The number of records of each call.
+        concurrency (int, optional): The maximum number of calls in flight.
+        fail_fast (bool, optional): Whether to stop at the first error.
+        restart (bool, optional): Whether to ignore the checkpoint.
+        progress_interval (float, optional): Seconds between progress reports.
+        **kwargs: Additional arguments of the calls, e.g. the backend.
+
+    Returns:
+        Progress: The progress of the job.
+    """
+    format = input_format(input, format)
+    checkpoint = Checkpoint(output + ".checkpoint")
+    if restart or not checkpoint.load():
+        checkpoint.offset = checkpoint.output_bytes = 0
+    progress = Progress(
+        count_records(input, format), checkpoint.offset, progress_interval
+    )
+
+    backend_lock = (
+        threading.Lock()
+        if concurrency > 1 and is_local(kwargs.get("backend") or default.backend)
+        else nullcontext()
+    )
+
+    def call(records: List[Dict]) -> Tuple[List[Dict], int]:
+        """Returns the results of the records and the number of failed records."""
+        inputs = [record_input(record, column) for record in records]
+        try:
+            # Batch calls for any batch size, so that records are rendered the same
+            with backend_lock:
+                outputs = func(inputs, batch_call=True, **kwargs)
+            results = [
+                record | {output_key: to_jsonable(output)}
+                for record, output in zip(records, outputs)
+            ]
+            return results, 0
+        except Exception as exception:
+            if fail_fast:
+                raise
+            errors = [record | dict(error=repr(exception)) for record in records]
+            return errors, len(errors)
+
+    records = read_records(input, format, checkpoint.offset)
+    batches = iter(lambda: list(islice(records, batch_size)), [])
+    mode = "r+b" if os.path.exists(output) else "wb"
+    with open(output, mode) as file, ThreadPoolExecutor(concurrency) as executor:
+        # Output written after the last checkpoint is discarded
+        file.truncate(checkpoint.output_bytes)
+        file.seek(checkpoint.output_bytes)
+        pending: deque = deque()
+        for batch in batches:
+            pending.append(executor.submit(call, batch))
+            while pending and (len(pending) > concurrency or pending[0].done()):
+                write_batch(*pending.popleft().result(), file, checkpoint, progress)
+        while pending:
+            write_batch(*pending.popleft().result(), file, checkpoint, progress)
+    progress.report(force=True)
+    return progress
@@ -1,9 +1,14 @@
 from .cuda_check import cuda_check
-from .dictutils import dumps, loadf, loads
+from .dictutils import changed_keys, dumps, loadf, loads
+from .histogram import Histogram
+from .jsonutils import json_dumps, json_loads, set_json_serializer
 from .importutils import lazy_import, pip_install
 from .panelprint import panelprint
+from .profiler import SamplingProfiler
 from .pydantic import model_from_schema
+from .ratelimit import TokenBucket, token_bucket
 from .tracing import get_or_create_tracer_provider
+from .vectorindex import VectorIndex
 
 __all__ = [
     "panelprint",
@@ -12,7 +17,16 @@ __all__ = [
     "dumps",
     "loads",
     "loadf",
+    "changed_keys",
     "pip_install",
     "cuda_check",
     "get_or_create_tracer_provider",
+    "TokenBucket",
+    "token_bucket",
+    "Histogram",
+    "SamplingProfiler",
+    "VectorIndex",
+    "json_dumps",
+    "json_loads",
+    "set_json_serializer",
 ]
@@ -1,10 +1,11 @@
-import json
 import os
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 import fsspec
 import yaml
 
+from .jsonutils import json_dumps, json_loads
+
 
 def dumps(data, format="yaml"):
     """
@@ -24,7 +25,7 @@ def dumps(data, format="yaml"):
     if format == "yaml":
         return yaml.safe_dump(data, default_flow_style=False)
     elif format == "json":
-        return json.dumps(data)
+        return json_dumps(data)
     else:
         raise ValueError("Unsupported format")
 
@@ -46,7 +47,7 @@ def loads(data, format="yaml") -> Dict[str, Any]:
     if format == "yaml":
         return yaml.safe_load(data)
     elif format == "json":
-        return json.loads(data)
+        return json_loads(data)
     else:
         raise ValueError("Unsupported format")
 
@@ -67,3 +68,20 @@ def loadf(url: str, **kwargs) -> Dict[str, Any]:
     extension = os.path.splitext(url)[1][1:]
     with fsspec.open(url, **kwargs) as file:
         return loads(file, format=extension)
+
+
+def changed_keys(old: Optional[Dict], new: Optional[Dict]) -> List[str]:
+    """
+    Return the keys whose values differ between two dictionaries.
+
+    Args:
+        old (dict): The reference dictionary.
+        new (dict): The dictionary to compare against the reference.
+
+    Returns:
+        List[str]: The sorted list of keys that were added, removed or modified.
+    """
+    old, new = old or {}, new or {}
+    return sorted(
+        key for key in old.keys() | new.keys() if old.get(key) != new.get(key)
+    )
@@ -0,0 +1,115 @@
+from enum import Enum
+from typing import Any, Dict, Iterator, List, Optional
+
+from pydantic import BaseModel
+
+# Column types of the JSON schema types, for pandas and Arrow
+PANDAS_DTYPES = {
+    "integer": "Int64",
+    "number": "Float64",
+    "boolean": "boolean",
+    "string": "string",
+}
+ARROW_TYPES = ["integer", "number", "boolean", "string"]
+
+
+def is_arrow(frame: Any) -> bool:
+    """Returns whether the frame is an Arrow table (or record batch)."""
+    return type(frame).__module__.startswith("pyarrow")
+
+
+def num_rows(frame: Any) -> int:
+    return frame.num_rows if is_arrow(frame) else len(frame)
+
+
+def column_chunks(
+    frame: Any, columns: List[str], batch_size: int
+) -> Iterator[List[List[Any]]]:
+    """
+    Yields the values of the columns in chunks of `batch_size` rows, as one list
+    per column. Arrow tables are sliced without copying the underlying buffers.
+    """
+    for start in range(0, num_rows(frame), batch_size):
+        if is_arrow(frame):
+            chunk = frame.slice(start, batch_size)
+            yield [chunk.column(column).to_pylist() for column in columns]
+        else:
+            yield [
+                frame[column].iloc[start : start + batch_size].tolist()
+                for column in columns
+            ]
+
+
+def record_chunks(
+    frame: Any, fields: Dict[str, str], batch_size: int
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yields the rows of the columns in chunks of `batch_size` rows, as dictionaries
+    keyed by the field of each column. pandas chunks are converted with
+    `to_dict("records")`, and the columns of each Arrow slice are converted one at a
+    time before being zipped into rows.
+    """
+    names, columns = list(fields), list(fields.values())
+    if is_arrow(frame):
+        table = frame.select(columns)
+        for start in range(0, num_rows(frame), batch_size):
+            chunk = table.slice(start, batch_size)
+            values = [column.to_pylist() for column in chunk.itercolumns()]
+            yield [dict(zip(names, row)) for row in zip(*values)]
+    else:
+        selected = frame[columns].set_axis(names, axis=1)
+        for start in range(0, num_rows(frame), batch_size):
+            yield selected.iloc[start : start + batch_size].to_dict("records")
+
+
+def resolve_schema(schema: Dict, defs: Dict) -> Dict:
+    """Resolves the references of a JSON schema property."""
+    while "$ref" in schema:
+        schema = defs.get(schema["$ref"].split("/")[-1], {})
+    return schema
+
+
+def plain(value: Any) -> Any:
+    """Converts a value of an output field to plain Python objects."""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    return value
+
+
+def to_column(frame: Any, values: List[Any], schema: Optional[Dict] = None) -> Any:
+    """
+    Builds a column of the frame type from the values of an output field, typed
+    after the JSON schema of the field when it is a scalar type.
+    """
+    schema_type = (schema or {}).get("type")
+    values = [plain(value) for value in values]
+    if is_arrow(frame):
+        import pyarrow as pa
+
+        types = dict(
+            zip(ARROW_TYPES, [pa.int64(), pa.float64(), pa.bool_(), pa.string()])
+        )
+        return pa.array(values, type=types.get(schema_type))
+    import pandas as pd
+
+    return pd.Series(values, dtype=PANDAS_DTYPES.get(schema_type, object))
+
+
+def with_columns(frame: Any, columns: Dict[str, Any]) -> Any:
+    """Returns a copy of the frame with the given columns added or replaced."""
+    if is_arrow(frame):
+        for name, column in columns.items():
+            if name in frame.column_names:
+                frame = frame.set_column(frame.column_names.index(name), name, column)
+            else:
+                frame = frame.append_column(name, column)
+        return frame
+    return frame.assign(
+        **{name: column.set_axis(frame.index) for name, column in columns.items()}
+    )
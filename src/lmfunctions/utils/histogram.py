@@ -0,0 +1,84 @@
+import math
+import threading
+from typing import Dict, Sequence
+
+
+class Histogram:
+    """
+    A thread-safe streaming histogram with logarithmic buckets, in the style of HDR
+    histograms. Values between `min_value` and `max_value` are recorded with a
+    relative error of at most `precision`, using constant memory regardless of the
+    number of recorded values. Values outside the range are counted in the first or
+    last bucket.
+    """
+
+    def __init__(
+        self, precision: float = 0.01, min_value: float = 1e-6, max_value: float = 3600
+    ):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.log_growth = math.log1p(2 * precision)
+        self.counts = [0] * (int(math.log(max_value / min_value) / self.log_growth) + 2)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._lock = threading.Lock()
+
+    def record(self, value: float) -> None:
+        """Records a value."""
+        if value <= self.min_value:
+            index = 0
+        else:
+            index = min(
+                int(math.log(value / self.min_value) / self.log_growth) + 1,
+                len(self.counts) - 1,
+            )
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns an estimate of the q-quantile of the recorded values, or NaN if no
+        value has been recorded.
+        """
+        with self._lock:
+            if not self.count:
+                return math.nan
+            rank = q * (self.count - 1)
+            cumulative = 0
+            for index, count in enumerate(self.counts):
+                cumulative += count
+                if cumulative > rank:
+                    break
+            if index == 0:
+                return self.min
+            if index == len(self.counts) - 1:
+                return self.max
+            # Geometric midpoint of the bucket, within the observed range
+            value = self.min_value * math.exp((index - 0.5) * self.log_growth)
+            return min(max(value, self.min), self.max)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else math.nan
+
+    def summary(self, quantiles: Sequence[float] = (0.5, 0.95, 0.99)) -> Dict:
+        """Returns the count, the mean and the given quantiles of the values."""
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            **{f"p{round(q * 100):g}": self.quantile(q) for q in quantiles},
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts = [0] * len(self.counts)
+            self.count = 0
+            self.sum = 0.0
+            self.min = math.inf
+            self.max = -math.inf
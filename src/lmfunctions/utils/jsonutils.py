@@ -0,0 +1,95 @@
+import json
+import re
+from importlib.util import find_spec
+from typing import Any
+
+
+class JSONSerializer:
+    """JSON serializer based on the standard library."""
+
+    name = "json"
+
+    def dumps(self, obj: Any, sort_keys: bool = False) -> str:
+        return json.dumps(obj, default=str, sort_keys=sort_keys)
+
+    def loads(self, data: str | bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    JSON serializer parsing with orjson, with the same results as the standard
+    library. Documents that orjson parses differently are parsed with the standard
+    library: integers larger than 64 bits, which orjson parses as floats, and the
+    documents it rejects (e.g. with NaN or lone surrogates).
+
+    Objects are serialized with the standard library, since the output of orjson
+    differs (separators, non-ASCII characters, floats, datetimes, NaN), and prompts
+    and cache keys must not depend on whether orjson is installed.
+    """
+
+    name = "orjson"
+
+    # Integer literals with at least 19 digits may not fit in 64 bits
+    long_digits = re.compile(r"[0-9]{19}")
+    long_digits_bytes = re.compile(rb"[0-9]{19}")
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+
+    def loads(self, data: str | bytes) -> Any:
+        pattern = self.long_digits if isinstance(data, str) else self.long_digits_bytes
+        if pattern.search(data) is None:  # type: ignore
+            try:
+                return self.orjson.loads(data)
+            except self.orjson.JSONDecodeError:
+                pass
+        return json.loads(data)
+
+
+_serializer: JSONSerializer = JSONSerializer()
+
+
+def set_json_serializer(name: str = "auto") -> JSONSerializer:
+    """
+    Sets the JSON serializer used to parse outputs and deserialize objects. Both
+    serializers give the same results, and both serialize objects with the
+    standard library.
+
+    Args:
+        name (str): "json" for the standard library, "orjson" for orjson, or "auto"
+        for orjson if it is installed and the standard library otherwise.
+
+    Returns:
+        JSONSerializer: The serializer.
+    """
+    global _serializer
+    if name == "auto":
+        name = "orjson" if find_spec("orjson") else "json"
+    if name == "orjson":
+        _serializer = OrjsonSerializer()
+    elif name == "json":
+        _serializer = JSONSerializer()
+    else:
+        raise ValueError(f"Unsupported JSON serializer: {name}")
+    return _serializer
+
+
+def json_dumps(obj: Any, sort_keys: bool = False) -> str:
+    """
+    Serializes an object to a JSON string, like `json.dumps(obj, default=str)`:
+    objects that are not JSON serializable are converted to strings. With
+    `sort_keys`, dictionary keys are sorted, so that equal objects have the same
+    canonical representation (e.g. to be used as cache keys).
+    """
+    return _serializer.dumps(obj, sort_keys=sort_keys)
+
+
+def json_loads(data: str | bytes) -> Any:
+    """Deserializes a JSON string."""
+    return _serializer.loads(data)
+
+
+set_json_serializer()
@@ -0,0 +1,108 @@
+import os
+import sys
+import threading
+from typing import Dict
+
+# Innermost frames of threads waiting for work, e.g. idle server and pool threads
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+}
+
+
+class SamplingProfiler:
+    """
+    A statistical profiler that samples the stacks of all the running threads every
+    `interval` seconds in a background thread, with low overhead on the profiled
+    code. Samples are aggregated by stack in the folded format used by flame graph
+    tools (e.g. flamegraph.pl or speedscope), at most `max_stacks` distinct stacks
+    being kept. Threads waiting for work (on a condition, a queue, a selector or a
+    socket) are not sampled, unless `idle` is set.
+    """
+
+    def __init__(
+        self, interval: float = 0.01, max_stacks: int = 10000, idle: bool = False
+    ):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.idle = idle
+        self.samples: Dict[str, int] = {}
+        self.dropped = 0
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def sample(self) -> None:
+        """Takes a sample of the stacks of all the threads but the profiler."""
+        current = threading.get_ident()
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == current:
+                continue
+            code = frame.f_code
+            if not self.idle and (
+                (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+            ):
+                continue
+            names = []
+            while frame is not None:
+                names.append(self.frame_name(frame))
+                frame = frame.f_back
+            stacks.append(";".join(reversed(names)))
+        with self._lock:
+            for stack in stacks:
+                if stack in self.samples or len(self.samples) < self.max_stacks:
+                    self.samples[stack] = self.samples.get(stack, 0) + 1
+                else:
+                    self.dropped += 1
+
+    def run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Starts sampling in a background thread."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="lmfunctions-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def folded(self) -> str:
+        """Returns the samples in the folded stacks format, one stack per line."""
+        with self._lock:
+            samples = sorted(self.samples.items(), key=lambda item: -item[1])
+        return "".join(f"{stack} {count}\n" for stack, count in samples)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.samples = {}
+            self.dropped = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
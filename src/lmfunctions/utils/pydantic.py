@@ -1,6 +1,7 @@
 import importlib.util
-import json
 import sys
+import threading
+from functools import lru_cache
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Dict, Type
@@ -8,20 +9,31 @@ from typing import Dict, Type
 from datamodel_code_generator import DataModelType, InputFileType, generate
 from pydantic import BaseModel
 
+from .jsonutils import json_dumps, json_loads
+
+# Code generation and the import of the generated module are not thread-safe
+_lock = threading.Lock()
+
 
 def model_from_schema(schema: Dict) -> Type[BaseModel]:
     """Generate a Pydantic Model from a json schema.
 
+    Models are cached by schema, so equal schemas share the same class.
+
     Args:
     schema: Source json schema to create Pydantic model from
 
     Returns:
     The newly created and loaded Pydantic class
     """
+    return model_from_json_schema(json_dumps(schema))
+
+
+@lru_cache(maxsize=256)
+def model_from_json_schema(json_schema: str) -> Type[BaseModel]:
     # Ref: https://github.com/koxudaxi/datamodel-code-generator/issues/278
-    class_name = schema.get("title", "Model")
-    json_schema = json.dumps(schema)
-    with TemporaryDirectory() as temporary_directory_name:
+    class_name = json_loads(json_schema).get("title", "Model")
+    with _lock, TemporaryDirectory() as temporary_directory_name:
         temporary_directory = Path(temporary_directory_name)
         temporary_file_path = Path(temporary_directory / "tempmodel.py")
         generate(
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket. Tokens are refilled continuously at `rate` tokens
+    per second, up to `capacity`. Acquiring more tokens than are available waits
+    until the bucket has refilled, so that the long-run throughput never exceeds
+    the configured rate.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+        Takes tokens from the bucket, possibly going into debt.
+
+        Returns:
+            float: The number of seconds to wait before the tokens can be used.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Blocks the current thread until the tokens are available."""
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+    async def aacquire(self, tokens: float = 1.0) -> None:
+        """Suspends the current task until the tokens are available."""
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def token_bucket(key: str, rate: float, capacity: Optional[float] = None):
+    """
+    Returns the process-wide token bucket registered under the given key,
+    creating it if needed. The rate and capacity of an existing bucket are
+    updated to the given values.
+
+    Args:
+        key (str): The key identifying the shared bucket (e.g. a model name).
+        rate (float): The refill rate in tokens per second.
+        capacity (float, optional): The maximum burst size. Defaults to the rate.
+
+    Returns:
+        TokenBucket: The shared token bucket.
+    """
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(rate, capacity)
+        else:
+            bucket.rate = rate
+            bucket.capacity = capacity or max(rate, 1.0)
+        return bucket
@@ -0,0 +1,98 @@
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+class VectorIndex:
+    """
+    A thread-safe in-memory index of at most `capacity` entries, each with a key, a
+    vector and a value. Entries are looked up by key, or by cosine similarity of
+    their vectors with a brute force search in NumPy. When the index is full, the
+    oldest entry is evicted. Entries without a vector are only looked up by key.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self.vectors = None
+        self.keys: List[Optional[str]] = []
+        self.values: List[Any] = []
+        self.slots: Dict[str, int] = {}
+        self.next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @staticmethod
+    def normalize(vector: Sequence[float]):
+        import numpy as np
+
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def add(self, key: str, vector: Optional[Sequence[float]], value: Any) -> None:
+        """Adds an entry, replacing the entry with the same key if any."""
+        import numpy as np
+
+        if vector is not None:
+            vector = self.normalize(vector)
+        with self._lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self.next
+                self.next = (self.next + 1) % self.capacity
+                if slot < len(self.keys):
+                    # Evict the oldest entry
+                    self.slots.pop(self.keys[slot], None)
+                else:
+                    self.keys.append(None)
+                    self.values.append(None)
+            self.keys[slot], self.values[slot] = key, value
+            self.slots[key] = slot
+            if vector is None:
+                if self.vectors is not None and slot < len(self.vectors):
+                    self.vectors[slot] = 0
+                return
+            if self.vectors is None:
+                self.vectors = np.zeros(
+                    (min(self.capacity, max(16, slot + 1)), len(vector)),
+                    dtype=np.float32,
+                )
+            elif slot >= len(self.vectors):
+                # Grow the matrix geometrically up to the capacity
+                grown = np.zeros(
+                    (
+                        min(self.capacity, max(2 * len(self.vectors), slot + 1)),
+                        self.vectors.shape[1],
+                    ),
+                    dtype=np.float32,
+                )
+                grown[: len(self.vectors)] = self.vectors
+                self.vectors = grown
+            self.vectors[slot] = vector
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Returns whether an entry has the key, and its value."""
+        with self._lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                return False, None
+            return True, self.values[slot]
+
+    def search(self, vector: Sequence[float]) -> Tuple[float, Optional[str], Any]:
+        """
+        Returns the cosine similarity, the key and the value of the entry most similar
+        to the vector, or a similarity of -1 if the index is empty.
+        """
+        with self._lock:
+            if self.vectors is None or not self.keys:
+                return -1.0, None, None
+            similarities = self.vectors[: len(self.keys)] @ self.normalize(vector)
+            slot = int(similarities.argmax())
+            return float(similarities[slot]), self.keys[slot], self.values[slot]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.vectors = None
+            self.keys, self.values, self.slots = [], [], {}
+            self.next = 0
@@ -0,0 +1,142 @@
+import json
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Dict
+
+# Minimal stand-in for the OpenAI chat completions, files, batches and embeddings
+# endpoints. Each chat completion request, alone or in a batch, is answered with the
+# content of its last message, and texts are embedded as the counts of their
+# lowercase words hashed in 64 buckets.
+
+
+def embedding(text: str):
+    vector = [0.0] * 64
+    for word in text.lower().split():
+        vector[sum(map(ord, word)) % 64] += 1
+    return vector
+
+
+def chat_completion(completion_id: str, body: Dict) -> Dict:
+    return dict(
+        id=completion_id,
+        object="chat.completion",
+        created=0,
+        model=body["model"],
+        choices=[
+            dict(
+                index=0,
+                finish_reason="stop",
+                message=dict(role="assistant", content=body["messages"][-1]["content"]),
+            )
+        ],
+    )
+
+
+class BatchRequestHandler(BaseHTTPRequestHandler):
+    files: Dict[str, bytes] = {}
+    batches: Dict[str, Dict] = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        body = self.rfile.read(length)
+        if self.path == "/v1/chat/completions":
+            self.send_json(chat_completion("chatcmpl-0", json.loads(body)))
+        elif self.path == "/v1/files":
+            header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+            form = BytesParser(policy=HTTP).parsebytes(header + body)
+            for part in form.iter_parts():  # type: ignore
+                if part.get_param("name", header="content-disposition") == "file":
+                    file_id = f"file-{len(self.files)}"
+                    self.files[file_id] = part.get_payload(decode=True)
+            self.send_json(
+                dict(
+                    id=file_id,
+                    object="file",
+                    bytes=len(self.files[file_id]),
+                    created_at=0,
+                    filename="batch.jsonl",
+                    purpose="batch",
+                )
+            )
+        elif self.path == "/v1/batches":
+            request = json.loads(body)
+            batch_id = f"batch-{len(self.batches)}"
+            results = []
+            for line in self.files[request["input_file_id"]].decode().splitlines():
+                item = json.loads(line)
+                completion = chat_completion(item["custom_id"], item["body"])
+                results.append(
+                    dict(
+                        custom_id=item["custom_id"],
+                        response=dict(status_code=200, body=completion),
+                        error=None,
+                    )
+                )
+            # Results are returned out of order
+            output_file_id = f"file-{len(self.files)}"
+            self.files[output_file_id] = "\n".join(
+                json.dumps(result) for result in reversed(results)
+            ).encode()
+            self.batches[batch_id] = dict(
+                id=batch_id,
+                object="batch",
+                endpoint=request["endpoint"],
+                input_file_id=request["input_file_id"],
+                completion_window=request["completion_window"],
+                created_at=0,
+                status="in_progress",
+                output_file_id=output_file_id,
+            )
+            self.send_json(self.batches[batch_id] | dict(output_file_id=None))
+        elif self.path == "/v1/embeddings":
+            request = json.loads(body)
+            texts = request["input"]
+            self.send_json(
+                dict(
+                    object="list",
+                    model=request["model"],
+                    data=[
+                        dict(object="embedding", index=i, embedding=embedding(text))
+                        for i, text in enumerate(texts)
+                    ],
+                    usage=dict(prompt_tokens=0, total_tokens=0),
+                )
+            )
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        path = self.path.strip("/").split("/")
+        if path[:2] == ["v1", "batches"]:
+            batch = self.batches[path[2]]
+            batch["status"] = "completed"
+            self.send_json(batch)
+        elif path[:2] == ["v1", "files"] and path[3:] == ["content"]:
+            content = self.files[path[2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_error(404)
+
+
+def start_batch_server() -> ThreadingHTTPServer:
+    """Starts the stand-in server on a free local port in a background thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BatchRequestHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,5 +1,17 @@
+import asyncio
+import time
+
+import pytest
+
 import lmfunctions as lmf
+from lmfunctions.backends.fastforward import (
+    FastForwardDecoder,
+    advance,
+    forced_text,
+    schema_parser,
+)
 
+from .batchserver import start_batch_server
 from .models import test_models
 
 prompt = "1, 2, 3, "
@@ -134,6 +146,160 @@ def test_litellm():
     assert isinstance(out, lmf.Message)
 
 
+@pytest.mark.asyncio
+async def test_litellm_async():
+    backend = lmf.backends.LiteLLMBackend(
+        mock_response="4", max_concurrency=2, requests_per_minute=6000
+    )
+    # Test chat mode (default)
+    out = await backend.acall(prompt)  # Single string
+    assert isinstance(out, lmf.Message)
+    out = await backend.acall([prompt] * 3, schema)  # List of strings with schema
+    assert (
+        isinstance(out, list)
+        and len(out) == 3
+        and all(isinstance(m, lmf.Message) for m in out)
+    )
+    out = await backend.acall(conversation)  # Message list
+    assert isinstance(out, lmf.Message)
+    # Test text generation mode
+    backend.chat = False
+    out = await backend.acall(prompt)  # Single string
+    assert isinstance(out, lmf.Message)
+    await backend.aclose()
+
+
+def test_litellm_async_session():
+    server = start_batch_server()
+    backend = lmf.backends.LiteLLMBackend(
+        model="openai/gpt-4o-mini",
+        base_url=f"http://127.0.0.1:{server.server_port}/v1",
+        api_key="test",
+        max_concurrency=2,
+        max_connections=4,
+    )
+    limited = backend.model_copy(update=dict(requests_per_minute=600))
+    assert limited.rate_key != backend.model_copy(update=dict(api_key="other")).rate_key
+
+    async def run():
+        out = await backend.acall([f"{prompt}{i}" for i in range(3)])
+        assert [m.process(handle_token_or_char=None) for m in out] == [
+            f"{prompt}{i}" for i in range(3)
+        ]
+        session, semaphore = backend.session, backend.semaphore
+        assert session.connector.limit == 4
+        # Assigning other fields keeps the semaphores of the requests in flight
+        backend.temperature = 0.5
+        assert backend.semaphore is semaphore
+        backend.max_concurrency += 1
+        assert backend.semaphore is not semaphore
+        await backend.aclose()
+        assert session.closed
+        return session
+
+    # Each event loop has its own session
+    assert asyncio.run(run()) is not asyncio.run(run())
+    server.shutdown()
+
+
+def test_litellm_batch_api():
+    server = start_batch_server()
+    backend = lmf.backends.LiteLLMBackend(
+        base_url=f"http://127.0.0.1:{server.server_port}/v1",
+        api_key="test",
+        batch_api=True,
+        batch_poll_interval=0,
+    )
+    inputs = [f"{prompt}{i}" for i in range(5)]
+    out = backend(inputs, schema)
+    assert [m.process(handle_token_or_char=None) for m in out] == inputs
+    server.shutdown()
+
+
+def test_composite():
+    events, states, failovers = [], [], []
+
+    def retry(failover_backend, **kwargs):
+        events.append("retry")
+        failovers.append(failover_backend)
+
+    lmf.default.event_manager = lmf.eventmanager.EventManager(
+        handlers={
+            "retry": [retry],
+            "hedge": [lambda **kwargs: events.append("hedge")],
+        }
+    )
+    failing = lmf.backends.LiteLLMBackend(
+        base_url="http://127.0.0.1:1", api_key="test", max_retries=0
+    )
+    working = lmf.backends.LiteLLMBackend(mock_response="4")
+    # Failover
+    lmf.set_backend.composite(backends=[failing, working])
+    out = lmf.complete(prompt)
+    assert isinstance(out, lmf.Message)
+    assert events == ["retry"]
+    # Failover events are emitted on the event manager of the call
+    event_manager = lmf.eventmanager.EventManager(
+        handlers={
+            "retry": [
+                lambda retry_call_state, **kwargs: states.append(retry_call_state)
+            ]
+        }
+    )
+    lmf.LMFunc(name="echo")(prompt, event_manager=event_manager)
+    assert events == ["retry"] and len(states) == 1
+    assert states[0].attempt_number == 1 and states[0].outcome.failed
+
+    # Streams failing before their first token fail over
+    def broken():
+        raise ConnectionError("The stream failed")
+        yield
+
+    stream = lmf.default.backend.stream(
+        lmf.Message(broken()), 0, prompt, None, time.monotonic(), {}
+    )
+    assert "".join(stream) == "4" and events == ["retry", "retry"]
+    # Hedging returns the first response valid against the schema, with the text
+    # around its JSON object, streaming its tokens to the handlers of the call
+    events.clear()
+    failovers.clear()
+    valid = lmf.backends.LiteLLMBackend(
+        mock_response='Sure: {"country": "France", "population": 68, '
+        '"languages_spoken": ["French"]} Done.'
+    )
+    lmf.default.backend.backends = [working, valid]
+    lmf.default.backend.hedge = True
+    # Without a delay, the invalid response is retried on the next backend
+    out = lmf.complete([prompt] * 2, schema)
+    assert isinstance(out, list) and len(out) == 2
+    assert events == ["retry"] and failovers == [valid]
+    lmf.default.backend.hedge_delay = 0
+    out = lmf.complete([prompt] * 2, schema)
+    assert isinstance(out, list) and len(out) == 2
+    assert "hedge" in events
+    tokens = []
+    message = lmf.complete(prompt, schema)
+    output = message.process(
+        schema,
+        handle_token_or_char=lambda token_or_char, **kwargs: tokens.append(
+            token_or_char
+        ),
+    )
+    assert output["country"] == "France" and tokens
+    # Latencies are only reset when the backends are changed
+    lmf.default.backend._latencies.append(1.0)
+    lmf.default.backend.hedge_quantile = 0.5
+    assert len(lmf.default.backend._latencies) > 0
+    lmf.default.backend.backends = [failing, failing]
+    assert len(lmf.default.backend._latencies) == 0
+    with pytest.raises(Exception):
+        lmf.complete(prompt)
+    # Serialization
+    backend = lmf.backends.CompositeBackend.from_string(lmf.default.backend.dumps())
+    assert backend.backends == lmf.default.backend.backends
+    lmf.set_event_manager.default()
+
+
 def test_llamacpp():
     lmf.default.backend = TEST_CHAT_BACKEND
     # Test chat mode (default)
@@ -151,3 +317,138 @@ def test_llamacpp():
     lmf.complete(prompt, schema)
     lmf.set_backend.llamacpp()
     TEST_CHAT_BACKEND.llama.metadata["tokenizer.chat_template"] = chat_template
+
+
+def test_llamacpp_reload():
+    reloads = []
+    lmf.default.event_manager = lmf.eventmanager.EventManager(
+        handlers={"model_reload": [lambda **kwargs: reloads.append(kwargs)]}
+    )
+    llama = TEST_CHAT_BACKEND.llama
+    generation = TEST_CHAT_BACKEND.generation.dump()
+    # Generation parameters and chat mode do not affect the loaded model
+    TEST_CHAT_BACKEND.generation = dict(generation, temperature=0.2)
+    TEST_CHAT_BACKEND.chat = False
+    TEST_CHAT_BACKEND.chat = True
+    assert TEST_CHAT_BACKEND.llama is llama
+    assert not reloads
+    # Load parameters force a reload
+    TEST_CHAT_BACKEND.verbose = True
+    assert len(reloads) == 1 and reloads[0]["changed_params"] == ["verbose"]
+    TEST_CHAT_BACKEND.verbose = False
+    TEST_CHAT_BACKEND.generation = generation
+    assert TEST_CHAT_BACKEND.llama is not llama
+    # Prompt lookup decoding is set up when the model is loaded
+    TEST_CHAT_BACKEND.prompt_lookup_num_tokens = 5
+    assert reloads[-1]["changed_params"] == ["prompt_lookup_num_tokens"]
+    assert TEST_CHAT_BACKEND.llama.draft_model is not None
+    assert isinstance(TEST_CHAT_BACKEND(prompt), lmf.Message)
+    TEST_CHAT_BACKEND.prompt_lookup_num_tokens = None
+    # Prompt states cache
+    TEST_CHAT_BACKEND.prompt_cache = "ram"
+    assert TEST_CHAT_BACKEND.llama.cache is not None
+    TEST_CHAT_BACKEND.prompt_cache = None
+    lmf.set_event_manager.default()
+
+
+def test_forced_text():
+    parser = schema_parser(schema)
+    text, parser = forced_text(parser)
+    assert text == '{"country":"'
+    parser = advance(parser, 'France"')
+    assert forced_text(parser)[0] == ',"population":'
+    assert advance(parser, " ") is None
+
+
+def test_fast_forward_decoding():
+    import string
+    from types import SimpleNamespace
+
+    import numpy as np
+
+    # A character vocabulary, where the model alternates "a" and "b" in the string
+    # until the sequence has 30 tokens
+    vocabulary = list(string.printable)
+    eos = len(vocabulary)
+    tokenizer_data = SimpleNamespace(
+        regular_tokens=[(i, c, False) for i, c in enumerate(vocabulary)],
+        eos_token_id=eos,
+    )
+
+    def extend(tokens, state):
+        state = state + len(tokens)
+        logits = np.zeros(eos + 1)
+        logits[vocabulary.index("a" if state % 2 else "b")] = 2
+        logits[vocabulary.index('"')] = 1 if state < 30 else 3
+        logits[eos] = 0.5
+        return logits, state
+
+    decoder = FastForwardDecoder(
+        tokenizer_data,
+        tokenize=lambda text: [vocabulary.index(c) for c in text],
+        prefill=lambda tokens: extend(tokens, 0),
+        extend=extend,
+    )
+    string_schema = dict(
+        type="object", properties=dict(name=dict(type="string")), required=["name"]
+    )
+    # Interleaved decodings have their own states and counts
+    first = decoder(list(range(10)), string_schema, temperature=0)
+    second = decoder(list(range(11)), string_schema, temperature=0)
+    assert next(first) == next(second) == '{"name":"'
+    first_text = '{"name":"' + "".join(first)
+    second_text = '{"name":"' + "".join(second)
+    assert first_text == '{"name":"abababababa"}'
+    assert second_text == '{"name":"bababababa"}'
+    # The closing quote is sampled, the braces and the key are forced
+    assert (first.forced_tokens, first.sampled_tokens) == (9, 12)
+    assert (second.forced_tokens, second.sampled_tokens) == (9, 11)
+
+
+def test_llamacpp_interleaved_sequences(monkeypatch):
+    import ctypes
+
+    import llama_cpp
+    import numpy as np
+
+    class FakeLlama:
+        # The context of a model with a vocabulary of 4 tokens
+        def __init__(self):
+            self.input_ids = np.zeros(64, dtype=np.intc)
+            self.n_tokens, self.ctx, self.evaluated = 0, None, []
+            self.logits = (ctypes.c_float * 4)()
+
+        def eval(self, tokens):
+            self.evaluated.append(list(tokens))
+            self.input_ids[self.n_tokens : self.n_tokens + len(tokens)] = tokens
+            self.n_tokens += len(tokens)
+
+        def n_vocab(self):
+            return 4
+
+    llama = FakeLlama()
+    monkeypatch.setattr(llama_cpp, "llama_get_logits_ith", lambda ctx, i: llama.logits)
+    backend = lmf.backends.LlamaCppBackend(n_gpu_layers=0)
+    backend._llama = llama
+    _, first = backend._extend([1, 2, 3])
+    _, second = backend._extend([1, 2, 0])
+    # The first sequence is evaluated again after the shared prefix
+    _, first = backend._extend([3], first)
+    _, first = backend._extend([0], first)
+    assert first == [1, 2, 3, 3, 0]
+    assert llama.evaluated == [[1, 2, 3], [0], [3, 3], [0]]
+
+
+def test_llamacpp_fast_forward():
+    TEST_CHAT_BACKEND.fast_forward = True
+    for chat in (False, True):
+        TEST_CHAT_BACKEND.chat = chat
+        out = TEST_CHAT_BACKEND(prompt, schema, temperature=0, stream=False)
+        assert test_models[0].model_validate(out.process(schema=schema))
+        # The counts of tokens belong to each decoding
+        decoding = TEST_CHAT_BACKEND.decoder(
+            TEST_CHAT_BACKEND.prompt_tokens(prompt), schema, temperature=0
+        )
+        assert "".join(decoding) == out.content
+        assert decoding.forced_tokens > 0 and decoding.sampled_tokens > 0
+    TEST_CHAT_BACKEND.fast_forward = False
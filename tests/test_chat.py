@@ -1,3 +1,7 @@
+import time
+
+import pytest
+
 import lmfunctions as lmf
 
 from .test_backends import TEST_CHAT_BACKEND
@@ -19,3 +23,113 @@ def test_chat(mocker):
     ]
     mocker.patch("builtins.input", side_effect=inputs)
     lmf.chat(system_message="You are a helpful assistant")
+
+
+def test_chat_session():
+    backend = lmf.backends.LiteLLMBackend(
+        mock_response='{"output": "They introduced themselves"}'
+    )
+    session = lmf.ChatSession(
+        system_message="You are a helpful assistant", max_tokens=200, summarize=True
+    )
+    for i in range(10):
+        response = session.send(f"Message {i} of the conversation", backend=backend)
+        assert isinstance(response, lmf.Message)
+        context = session.context
+        assert context[0].content == "You are a helpful assistant"
+        assert [m.role for m in context].index("user") in (1, 2)
+        # The context sent with the last message was within the budget
+        assert sum(session.count_tokens(m, backend) for m in context[:-1]) <= 200
+    # The history was truncated in chunks, and summarized
+    assert len(session.messages) < 20
+    assert session.summary == "They introduced themselves"
+    # The summary follows the unchanged system message
+    assert session.context[0].content == "You are a helpful assistant"
+    assert session.context[1].role == "system"
+    assert "They introduced themselves" in session.context[1].content
+    # A turn failing to summarize the history leaves it unchanged
+    failing = lmf.backends.LiteLLMBackend(
+        base_url="http://127.0.0.1:1", api_key="test", max_retries=0
+    )
+    session.max_messages = len(session.messages)
+    messages, summary = list(session.messages), session.summary
+    with pytest.raises(Exception):
+        session.send("Hi", backend=failing)
+    assert session.messages == messages and session.summary == summary
+    session = lmf.ChatSession(max_messages=4)
+    for i in range(3):
+        session.send(f"Message {i}", backend=backend)
+    assert [m.content for m in session.messages][0] == "Message 2"
+    session.clear()
+    assert session.context == []
+
+
+def test_chat_server(tmp_path):
+    from fastapi.testclient import TestClient
+
+    from lmfunctions.chatserver import chat_app
+
+    backend = lmf.backends.LiteLLMBackend(mock_response="Hello!")
+    store = lmf.SessionStore(
+        template=lmf.ChatSession(system_message="You are a helpful assistant"),
+        max_sessions=2,
+        spill_dir=str(tmp_path),
+    )
+    client = TestClient(chat_app(backend, store))
+    for session_id in ("alice", "bob", "carol"):
+        response = client.post(
+            f"/sessions/{session_id}/messages", json=dict(content="Hi")
+        )
+        assert response.json() == dict(role="assistant", content="Hello!")
+    # The least recently used session is spilled to disk, and reloaded
+    assert len(store) == 2 and len(list(tmp_path.iterdir())) == 1
+    response = client.post(
+        "/sessions/alice/messages", json=dict(content="Again", stream=True)
+    )
+    assert response.text == "Hello!"
+    session = client.get("/sessions/alice").json()
+    contents = [message["content"] for message in session["messages"]]
+    assert contents == ["Hi", "Hello!", "Again", "Hello!"]
+    assert store.exists("bob") and len(list(tmp_path.iterdir())) == 1
+    # Only the sessions in memory keep their lock
+    assert set(store._session_locks) == set(store._sessions)
+    assert client.delete("/sessions/alice").status_code == 200
+    assert client.get("/sessions/alice").status_code == 404
+    assert "alice" not in store._session_locks
+    # Sessions exist while their turn is in progress
+    with store.session("bob"):
+        assert store.exists("bob") and "bob" not in store._sessions
+    assert store.get("bob") is not None and store.get("dave") is None
+    # Streams are complete with a threaded default event manager
+    default_manager = lmf.default.event_manager
+    lmf.default.event_manager = lmf.eventmanager.EventManager(
+        handlers={"token_or_char": [lambda **kwargs: time.sleep(0.05)]},
+        dispatch="thread",
+    )
+    try:
+        response = client.post(
+            "/sessions/erin/messages", json=dict(content="Hi", stream=True)
+        )
+        assert response.text == "Hello!"
+    finally:
+        lmf.default.event_manager.close()
+        lmf.default.event_manager = default_manager
+    store.clear()
+    assert len(store) == 0 and not store._session_locks
+    assert not store.exists("bob") and not list(tmp_path.iterdir())
+
+
+def test_chat_server_errors():
+    from fastapi.testclient import TestClient
+
+    from lmfunctions.chatserver import chat_app
+
+    backend = lmf.backends.LiteLLMBackend(
+        base_url="http://127.0.0.1:1", api_key="test", max_retries=0
+    )
+    client = TestClient(chat_app(backend), raise_server_exceptions=False)
+    # Failed streamed turns are errors rather than empty responses
+    response = client.post(
+        "/sessions/alice/messages", json=dict(content="Hi", stream=True)
+    )
+    assert response.status_code == 500
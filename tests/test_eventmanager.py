@@ -1,7 +1,11 @@
+import gc
+import threading
+import time
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
 import pytest
+from opentelemetry import trace
 
 import lmfunctions as lmf
 
@@ -31,3 +35,244 @@ def test_eventmanager():
     lmf.default.event_manager += lmf.eventmanager.EventManager()
     with pytest.raises(NotImplementedError):
         lmf.default.event_manager += "not a manager"
+
+
+def test_has_handlers():
+    assert not lmf.eventmanager.EventManager().has_handlers("token_or_char")
+    assert lmf.managers.tokenStream.has_handlers("token_or_char")
+    assert not lmf.managers.tokenStream.has_handlers("success")
+
+
+def test_thread_dispatch():
+    tokens = []
+
+    def slow_handler(token_or_char, **kwargs):
+        time.sleep(0.001)
+        tokens.append(token_or_char)
+
+    manager = lmf.eventmanager.EventManager(
+        handlers={"token_or_char": [slow_handler]}, dispatch="thread"
+    )
+    for i in range(100):
+        manager("token_or_char", token_or_char=i)
+    # Success events flush the queue
+    manager("success")
+    assert tokens == list(range(100))
+    manager = lmf.eventmanager.EventManager(
+        handlers={"token_or_char": [slow_handler]},
+        dispatch="thread",
+        overflow="drop",
+        queue_size=1,
+    )
+    for i in range(100):
+        manager("token_or_char", token_or_char=i)
+    manager.flush()
+    assert manager.dropped > 0
+    assert (manager + lmf.managers.tokenStream).dispatch == "thread"
+    # Flush events only wait for the queued events of their own call, not for the
+    # events of other calls queued after them
+    release = threading.Event()
+
+    def success_handler(**kwargs):
+        manager("token_or_char", token_or_char="a", span="other")
+
+    manager = lmf.eventmanager.EventManager(
+        handlers={
+            "token_or_char": [lambda **kwargs: release.wait(5)],
+            "success": [success_handler],
+        },
+        dispatch="thread",
+    )
+    start = time.monotonic()
+    manager("success", span="call")
+    assert time.monotonic() - start < 1
+    release.set()
+    manager.flush()
+    # The worker thread stops when the manager is closed or garbage collected
+    manager.close()
+    assert manager.queue_depth == 0
+    manager("token_or_char", token_or_char=0)
+    worker = manager._worker
+    assert worker.is_alive()
+    del manager
+    gc.collect()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+
+
+def test_dispatch_table():
+    tokens, batches = [], []
+    manager = lmf.eventmanager.EventManager(
+        handlers={"token_batch": [lambda events, **kwargs: batches.append(events)]},
+        batching={
+            "token_or_char": lmf.eventmanager.BatchPolicy(
+                event_name="token_batch", size=4, join=["token_or_char"]
+            )
+        },
+    )
+    assert manager.has_handlers("token_or_char")
+    # Items set on the handlers are picked up by the compiled table
+    manager.handlers["token_or_char"] = [
+        lambda token_or_char, **kwargs: tokens.append(token_or_char)
+    ]
+    for char in "abcdefghij":
+        manager("token_or_char", token_or_char=char)
+    assert tokens == list("abcdefghij")
+    assert [len(events) for events in batches] == [4, 4]
+    # Success events flush the pending batches
+    manager("success")
+    assert [len(events) for events in batches] == [4, 4, 2]
+    joined = []
+    manager.handlers["token_batch"] = [
+        lambda token_or_char, **kwargs: joined.append(token_or_char)
+    ]
+    for char in "abcde":
+        manager("token_or_char", token_or_char=char)
+    manager.flush()
+    assert joined == ["abcd", "e"]
+    # Lists of handlers modified in place are picked up as well
+    manager.handlers["success"] = []
+    manager.handlers["success"].append(lambda **kwargs: joined.append("success"))
+    manager("success")
+    assert joined[-1] == "success"
+    manager.handlers["success"].clear()
+    assert not manager.has_handlers("success")
+    composed = manager + lmf.managers.tokenStream + lmf.eventmanager.EventManager()
+    assert len(composed.table["token_batch"]) == 2
+    assert composed.has_handlers("token_or_char")
+    assert not composed.has_handlers("retry")
+
+
+def test_token_batch():
+    batches = []
+    manager = lmf.eventmanager.EventManager(
+        handlers={"token_batch": [lambda **kwargs: batches.append(kwargs)]},
+        batching={
+            "token_or_char": lmf.eventmanager.BatchPolicy(
+                event_name="token_batch",
+                size=1000,
+                interval=0.01,
+                join=["token_or_char"],
+            )
+        },
+    )
+    manager("token_or_char", token_or_char="a")
+    manager("token_or_char", token_or_char="b")
+    time.sleep(0.02)
+    # The interval has elapsed, so the next token closes the batch
+    manager("token_or_char", token_or_char="c")
+    manager("token_or_char", token_or_char="d")
+    manager("exception")
+    assert [batch["token_or_char"] for batch in batches] == ["abc", "d"]
+    assert batches[0]["batch_start"] < batches[1]["batch_start"]
+
+
+def test_token_batch_calls():
+    batches = []
+    manager = lmf.eventmanager.EventManager(
+        handlers={"token_batch": [lambda **kwargs: batches.append(kwargs)]},
+        batching={
+            "token_or_char": lmf.eventmanager.BatchPolicy(
+                event_name="token_batch", size=1000, join=["token_or_char"]
+            )
+        },
+    )
+    # Interleaved events of two calls are batched by call
+    first, second = object(), object()
+    for token in "abc":
+        manager("token_or_char", token_or_char=token, span=first)
+        manager("token_or_char", token_or_char=token.upper(), span=second)
+    manager("success", span=first)
+    assert [(batch["token_or_char"], batch["span"]) for batch in batches] == [
+        ("abc", first)
+    ]
+    manager("success", span=second)
+    assert [batch["token_or_char"] for batch in batches] == ["abc", "ABC"]
+
+    # Without spans, the events are batched by thread
+    batches.clear()
+    thread = threading.Thread(
+        target=lambda: manager("token_or_char", token_or_char="x")
+    )
+    manager("token_or_char", token_or_char="y")
+    thread.start()
+    thread.join()
+    manager("success")
+    assert [batch["token_or_char"] for batch in batches] == ["y"]
+    manager.flush()
+    assert [batch["token_or_char"] for batch in batches] == ["y", "x"]
+
+    # Spans which are not recorded identify calls by thread
+    assert manager.call_key(dict(span=trace.INVALID_SPAN)) == manager.call_key({})
+
+
+def test_latency_metrics():
+    metrics = lmf.managers.LatencyMetrics()
+    manager = metrics.event_manager()
+    manager("call_start", func=route)
+    manager("input_render")
+    for char in "abc":
+        time.sleep(0.001)
+        manager("token_or_char", token_or_char=char)
+    manager("success")
+    summary = metrics.summary()[route.name]
+    assert summary["time_to_first_token"]["count"] == 1
+    assert summary["inter_token"]["count"] == 2
+    assert summary["inter_token"]["p50"] >= 0.001
+    assert summary["total"]["p99"] >= summary["generation"]["p99"]
+    # Failed calls are not recorded
+    manager("call_start", func=route)
+    manager("exception", exception=ValueError())
+    assert metrics.summary()[route.name]["total"]["count"] == 1
+
+
+def test_prometheus_metrics():
+    metrics = lmf.managers.PrometheusMetrics(count_tokens=True)
+    manager = metrics.event_manager()
+    assert metrics.installed(manager + lmf.managers.tokenStream)
+    backend = lmf.backends.LiteLLMBackend(model="test-model")
+    manager("call_start", func=route, backend=backend)
+    manager("retry", retry_call_state=None)
+    for char in "abc":
+        manager("token_or_char", token_or_char=char)
+    manager("success", backend=backend, completion="abc")
+    manager("call_start", func=route, backend=backend)
+    manager("exception", exception=ValueError())
+    # A batch call ends with the success event of its last output
+    manager("call_start", func=route, backend=backend)
+    manager("success", backend=backend, completion="abc", batch_size=2)
+    assert len(metrics._calls) == 1
+    manager("success", backend=backend, completion="abc", batch_size=2)
+    assert not metrics._calls
+    labels = f'function="{route.name}",backend="litellm",model="test-model"'
+    tokens = backend.count_tokens("abc")
+    text = metrics.render()
+    assert f"lmfunctions_calls_total{{{labels}}} 3" in text
+    assert f"lmfunctions_generated_tokens_total{{{labels}}} {3 * tokens}" in text
+    assert f"lmfunctions_retries_total{{{labels}}} 1" in text
+    assert f"lmfunctions_exceptions_total{{{labels}}} 1" in text
+    assert f"lmfunctions_generated_chars_total{{{labels}}} 3" in text
+    assert f'lmfunctions_latency_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert "lmfunctions_event_queue_depth 0" in text
+    # Tokens are only counted on demand
+    metrics = lmf.managers.PrometheusMetrics()
+    manager = metrics.event_manager()
+    manager("call_start", func=route, backend=backend)
+    manager("success", backend=backend, completion="abc")
+    assert "lmfunctions_generated_tokens_total" not in metrics.render()
+    # The queue depth is the one of the event manager dispatching the events
+    started, release = threading.Event(), threading.Event()
+
+    def blocking(**kwargs):
+        started.set()
+        release.wait(5)
+
+    queued = lmf.eventmanager.EventManager(
+        handlers={"token_or_char": [blocking]}, dispatch="thread"
+    )
+    for char in "abc":
+        queued("token_or_char", token_or_char=char)
+    started.wait(5)
+    assert "lmfunctions_event_queue_depth 2" in metrics.render(queued)
+    release.set()
+    queued.close()
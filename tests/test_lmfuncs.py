@@ -1,7 +1,9 @@
+import json
 import time
 from multiprocessing import get_context
 from typing import Dict, List, Literal, Tuple
 
+import pydantic
 import pytest
 import requests
 
@@ -9,6 +11,7 @@ import lmfunctions as lmf
 from lmfunctions import LMFunc, Message, lmdef
 
 from .models import CityInfo, Entities, FlightRoute, NERInput, Plan, TwoCities
+from .batchserver import start_batch_server
 from .test_backends import TEST_CHAT_BACKEND
 
 
@@ -132,6 +135,244 @@ def test_lmfuncs():
     func.info()
 
 
+def test_render():
+    examples = [
+        ("London", CityInfo(country="UK", population=9, languages_spoken=["English"]))
+    ]
+    for func, input in [(city_info, "Paris"), (none, None), (sum, dict(x=3, y=4))]:
+        for examples_list in [[], examples]:
+            prompt = func.template.render(
+                inputs=func.to_json_str(input),
+                examples=[
+                    (func.to_json_str(i), func.to_json_str(o)) for i, o in examples_list
+                ],
+            )
+            # Cached prompts are rendered as the full template
+            assert func.render(input, examples_list) == prompt
+            assert func.render(input, examples_list) == prompt
+            assert func.render(input, examples_list, cache=False) == prompt
+    # Prompts are cached by the content of the examples, not their identity
+    examples[0][1].country = "United Kingdom"
+    assert "United Kingdom" in city_info.render("Paris", examples)
+    # The least recently used prompts are evicted
+    city_info.render("Paris", [])
+    for i in range(lmf.lmfunc.MAX_CACHED_PROMPTS - 1):
+        city_info.render("Paris", [(f"City {i}", "")])
+    city_info.render("Paris", [])
+    city_info.render("Paris", [("City", "")])
+    assert len(city_info._prompts) == lmf.lmfunc.MAX_CACHED_PROMPTS
+    assert () in city_info._prompts
+    assert (("City 0", ""),) not in city_info._prompts
+
+
+def test_phases():
+    phases = []
+    event_manager = lmf.eventmanager.EventManager(
+        handlers={"phase": [lambda phase, **kwargs: phases.append(phase)]}
+    )
+    city_info("Paris", backend=TEST_CHAT_BACKEND, event_manager=event_manager)
+    assert phases == ["assemble", "render", "backend", "parse", "validate"]
+
+
+def test_validation_modes():
+    def backend(input, schema=None):
+        return Message(
+            iter(
+                ['{"country": "France", "languages_spoken": []', ', "population": "2"}']
+            )
+        )
+
+    outputs = {
+        validation: city_info("Paris", backend=backend, validation=validation)
+        for validation in ["full", "fast", "trusted"]
+    }
+    assert outputs["full"].population == 2
+    assert outputs["fast"] == outputs["full"]
+    # Trusted outputs are not validated
+    assert outputs["trusted"].population == "2"
+
+
+def test_example_selector():
+    pool = [
+        ("Paris, the capital", "France"),
+        ("Rome, the eternal city", "Italy"),
+        ("Berlin and its wall", "Germany"),
+        ("Paris, Texas", "USA"),
+    ]
+    selector = lmf.ExampleSelector(examples=pool, k=2)
+    # The most relevant example is the last one
+    assert selector.select("Berlin") == [pool[0], pool[2]]
+    assert set(selector.select("Paris")) == {pool[0], pool[3]}
+    # Examples are packed under the token budget
+    selector.max_tokens = min(selector.token_counts(None))
+    assert len(selector.select("Paris")) == 1
+
+    class Backend:
+        model, context_size = "large", 2000
+
+        def count_tokens(self, text):
+            counted.append(text)
+            return len(text)
+
+        def __call__(self, input, schema=None):
+            prompts.append(input)
+            if len(prompts) in failures:
+                raise ConnectionError("Backend unavailable")
+            return Message("France")
+
+    prompts, counted, failures = [], [], []
+    selector = lmf.ExampleSelector(examples=pool, k=None, reserve_tokens=0)
+    city_name = lmf.LMFunc(name="city_name", description="Returns the country")
+    city_name("Paris", examples=selector, backend=Backend())
+    assert all(city in prompts[-1] for city in ["Rome", "Berlin", "Texas"])
+    # Examples that do not fit the context are dropped
+    Backend.model, Backend.context_size = "small", len(city_name.render("Paris")) + 40
+    city_name("Paris", examples=selector, backend=Backend())
+    assert "Texas" in prompts[-1] and "Rome" not in prompts[-1]
+    # The prompt is counted once for all the inputs and attempts of a call
+    counted.clear()
+    failures.append(len(prompts) + 1)
+    city_name(["Paris", "Nice"], batch_call=True, examples=selector, backend=Backend())
+    assert len(prompts) == 4 and counted[1:] == ["Paris", "Nice"]
+
+
+def test_semantic_cache():
+    server = start_batch_server()
+    cache = lmf.SemanticCache(
+        backend=lmf.backends.LiteLLMBackend(
+            model="openai/text-embedding-3-small",
+            base_url=f"http://127.0.0.1:{server.server_port}/v1",
+            api_key="test",
+        ),
+        threshold=0.9,
+    )
+    calls = []
+
+    def backend(input, schema=None):
+        calls.append(input)
+        return (
+            [Message("France")] * len(input)
+            if isinstance(input, list)
+            else Message("France")
+        )
+
+    country = lmf.LMFunc(name="country", description="Returns the country")
+    hits = []
+    event_manager = lmf.eventmanager.EventManager(
+        handlers={"cache_hit": [lambda inputs, **kwargs: hits.extend(inputs)]}
+    )
+    kwargs = dict(backend=backend, cache=cache, event_manager=event_manager)
+    assert country("Paris is in", **kwargs) == "France"
+    # Exact and near-duplicate inputs are served from the cache
+    assert country("  Paris is  in ", **kwargs) == "France"
+    assert country("paris IS in", **kwargs) == "France"
+    assert len(calls) == 1 and len(hits) == 2
+    # Inputs with different numbers are not near-duplicates
+    country("Paris is in 1900", **kwargs)
+    country("Paris is in 2000", **kwargs)
+    assert len(calls) == 3
+    # Only the inputs missing the cache are generated in batches
+    outputs = country(["Paris is in", "Rome is in"], batch_call=True, **kwargs)
+    assert outputs == ["France", "France"] and len(calls[-1]) == 1
+    # Near-duplicate matches can be disabled by function
+    cache.thresholds = {"country": 1.1}
+    country("Paris is in", **kwargs)
+    country("paris IS in", **kwargs)
+    assert len(calls) == 5
+    # Outputs served from the cache emit success events
+    successes = []
+    kwargs["event_manager"] = lmf.eventmanager.EventManager(
+        handlers={"success": [lambda cached=False, **kwargs: successes.append(cached)]}
+    )
+    country("Paris is in", **kwargs)
+    assert successes == [True]
+    # A changed definition does not share the outputs of the previous one
+    country.description = "Returns the country of the city"
+    country("Paris is in", **kwargs)
+    assert len(calls) == 6 and successes == [True, False]
+    server.shutdown()
+
+
+def test_semantic_cache_exact(monkeypatch):
+    embedded = []
+
+    def embed(self, texts):
+        embedded.extend(texts)
+        raise ConnectionError("Embedding backend unavailable")
+
+    monkeypatch.setattr(lmf.backends.LiteLLMBackend, "embed", embed)
+    cache = lmf.SemanticCache(
+        backend=lmf.backends.LiteLLMBackend(model="openai/text-embedding-3-small"),
+        thresholds={"country": 1.1},
+    )
+    calls = []
+
+    def backend(input, schema=None):
+        calls.append(input)
+        return Message("France")
+
+    country = lmf.LMFunc(name="country", description="Returns the country")
+    kwargs = dict(backend=backend, cache=cache)
+    # Inputs are not embedded when near-duplicate matches are disabled
+    country("Paris is in", **kwargs)
+    country(" Paris is in", **kwargs)
+    assert len(calls) == 1 and not embedded
+    # When the embedding backend fails, the cache falls back to exact matches
+    cache.thresholds = {}
+    country("Rome is in", **kwargs)
+    country("Rome  is in", **kwargs)
+    assert len(calls) == 2 and embedded == ["Rome is in"]
+
+
+def test_apply_frame():
+    import pandas as pd
+
+    def backend(input, schema=None):
+        output = dict(country="France", population=2, languages_spoken=["French"])
+        return [Message(json.dumps(output)) for _ in input]
+
+    frame = pd.DataFrame({"name": ["Paris", "Lyon", "Nice"]}, index=[5, 6, 7])
+    output = city_info.apply_frame(
+        frame, columns={"city": "name"}, batch_size=2, backend=backend
+    )
+    assert list(output.columns) == ["name", "country", "population", "languages_spoken"]
+    assert str(output["population"].dtype) == "Int64"
+    assert output.loc[7, "country"] == "France" and "country" not in frame
+
+    failing = lambda input, schema=None: [Message("{}") for _ in input]
+    with pytest.raises(Exception):
+        city_info.apply_frame(frame, columns={"city": "name"}, backend=failing)
+    output = city_info.apply_frame(
+        frame,
+        columns={"city": "name"},
+        backend=failing,
+        on_error="null",
+        output_prefix="info_",
+        retry_policy=lmf.retrypolicy.RetryPolicy(stop_max_attempt=1),
+    )
+    assert output["info_country"].isna().all()
+    # Rows are validated against the input model
+    questions = pd.DataFrame({"context": ["Paris", "Rome"], "query": ["Country?", 2]})
+    answer = lambda input, schema=None: [Message('{"output": "A"}') for _ in input]
+    with pytest.raises(pydantic.ValidationError):
+        contextual_qa.apply_frame(questions, backend=answer)
+    output = contextual_qa.apply_frame(
+        questions, batch_size=1, backend=answer, on_error="null"
+    )
+    assert output["output"].tolist()[0] == "A" and output["output"].isna()[1]
+    # Functions of a single string take the values of a single column
+    with pytest.raises(ValueError):
+        city_info.apply_frame(frame, columns=["name", "country"], backend=backend)
+
+    pa = pytest.importorskip("pyarrow")
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    output = city_info.apply_frame(table, columns={"city": "name"}, backend=backend)
+    assert output.schema.field("population").type == pa.int64()
+    table = pa.Table.from_pandas(questions.iloc[:1], preserve_index=False)
+    output = contextual_qa.apply_frame(table, backend=answer)
+    assert output.column("output").to_pylist() == ["A"]
+
+
 def test_serialize_deserialize():
     lmf.default.backend = TEST_CHAT_BACKEND
     for format in ["json", "yaml"]:
@@ -190,6 +431,60 @@ def test_serve(server):
     server.terminate()
 
 
+def test_fastapi_metrics():
+    from fastapi.testclient import TestClient
+
+    backend = lmf.default.backend
+    completion = json.dumps(dict(output="Elvis"))
+    lmf.default.backend = lmf.backends.LiteLLMBackend(mock_response=completion)
+    default_manager = lmf.default.event_manager
+    lmf.managers.prometheusMetrics.count_tokens = True
+    try:
+        client = TestClient(anagram.fastapi_app(metrics=True))
+        assert client.post("/anagram", json=dict(sentence="Lives")).json() == "Elvis"
+        # The default event manager is unchanged
+        assert lmf.default.event_manager is default_manager
+        assert not lmf.managers.prometheusMetrics.installed(default_manager)
+        text = client.get("/metrics").text
+        tokens = lmf.default.backend.count_tokens(completion)
+    finally:
+        lmf.default.backend = backend
+        lmf.managers.prometheusMetrics.count_tokens = False
+    labels = 'function="anagram",backend="litellm",model="gpt-4o-mini"'
+    assert f"lmfunctions_calls_total{{{labels}}} 1" in text
+    assert f"lmfunctions_generated_tokens_total{{{labels}}} {tokens}" in text
+    assert f"lmfunctions_latency_seconds_count{{{labels}}} 1" in text
+
+
+def test_fastapi_profile():
+    import threading
+
+    from fastapi.testclient import TestClient
+
+    def profiler_running():
+        return any(t.name == "lmfunctions-profiler" for t in threading.enumerate())
+
+    backend = lmf.default.backend
+    completion = json.dumps(dict(output="Elvis"))
+    lmf.default.backend = lmf.backends.LiteLLMBackend(mock_response=completion)
+    try:
+        app = anagram.fastapi_app(profile=True, profile_interval=0.001)
+        # The profiler runs from the startup to the shutdown of the application
+        assert not profiler_running()
+        with TestClient(app) as client:
+            assert profiler_running()
+            response = client.post("/anagram", json=dict(sentence="Lives"))
+            assert response.json() == "Elvis"
+            time.sleep(0.05)
+            response = client.get("/debug/profile", params=dict(reset=True))
+            assert response.status_code == 200
+            assert response.text.strip()
+            assert "wait (threading.py" not in response.text
+        assert not profiler_running()
+    finally:
+        lmf.default.backend = backend
+
+
 @pytest.mark.asyncio
 async def test_fastapi_app():
     lmf.default.backend = TEST_CHAT_BACKEND
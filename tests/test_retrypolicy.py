@@ -1,3 +1,10 @@
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
 import lmfunctions as lmf
 
 from .test_backends import TEST_CHAT_BACKEND
@@ -12,3 +19,99 @@ def test_retry_policy():
     for waittype in lmf.retrypolicy.WaitType:
         lmf.default.retry_policy.wait = waittype
         route(*args, **kwargs)
+
+
+def test_retry_after():
+    response = httpx.Response(
+        429,
+        headers={"Retry-After": "2"},
+        request=httpx.Request("POST", "http://127.0.0.1"),
+    )
+    exception = openai.RateLimitError("Rate limited", response=response, body=None)
+    assert lmf.retrypolicy.retry_after(exception) == 2
+    assert lmf.retrypolicy.retry_after(ValueError()) is None
+    route, args, kwargs = test_functions["route"]
+    policy = lmf.retrypolicy.RetryPolicy(wait_retry_after=True)
+    route(*args, retry_policy=policy, backend=TEST_CHAT_BACKEND, **kwargs)
+
+
+def test_circuit_breaker_probe():
+    breaker = lmf.retrypolicy.CircuitBreaker()
+    breaker.record(False, threshold=1)
+    with pytest.raises(lmf.retrypolicy.CircuitOpenError):
+        breaker.check(cooldown=0.05)
+    time.sleep(0.05)
+    # After the cooldown, only one of the concurrent calls is let through
+    probes = []
+
+    def call():
+        try:
+            breaker.check(cooldown=0.05)
+            probes.append(threading.get_ident())
+        except lmf.retrypolicy.CircuitOpenError:
+            pass
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(probes) == 1
+    # A failure of the probe opens the circuit again
+    breaker.record(False, threshold=1)
+    with pytest.raises(lmf.retrypolicy.CircuitOpenError, match="retry in"):
+        breaker.check(cooldown=0.05)
+    time.sleep(0.05)
+    breaker.check(cooldown=0.05)
+    # A success of the probe closes the circuit
+    breaker.record(True, threshold=1)
+    breaker.check(cooldown=0.05)
+    breaker.check(cooldown=0.05)
+
+
+def test_circuit_breaker():
+    route, args, kwargs = test_functions["route"]
+    failing = lmf.backends.LiteLLMBackend(
+        base_url="http://127.0.0.1:1", api_key="test", max_retries=0
+    )
+    policy = lmf.retrypolicy.RetryPolicy(
+        stop_max_attempt=5,
+        circuit_breaker_threshold=2,
+        circuit_breaker_cooldown=60,
+        requests_per_minute=6000,
+    )
+    # The circuit opens after two failures and the third attempt fails fast
+    with pytest.raises(lmf.retrypolicy.CircuitOpenError):
+        route(*args, backend=failing, retry_policy=policy, **kwargs)
+    with pytest.raises(lmf.retrypolicy.CircuitOpenError):
+        route(*args, backend=failing, retry_policy=policy, **kwargs)
+
+
+def test_circuit_breaker_stream():
+    def stream():
+        yield "Fra"
+        raise ConnectionError("Stream interrupted")
+
+    class Backend:
+        name, model = "stream", "test"
+
+        def __call__(self, input, schema=None):
+            return lmf.Message(stream())
+
+    city_name = lmf.LMFunc(name="city_name", description="Returns the country")
+    policy = lmf.retrypolicy.RetryPolicy(
+        stop_max_attempt=1, circuit_breaker_threshold=1, circuit_breaker_cooldown=60
+    )
+    # A failure while consuming the stream opens the circuit
+    with pytest.raises(ConnectionError):
+        city_name("Paris", backend=Backend(), retry_policy=policy)
+    with pytest.raises(lmf.retrypolicy.CircuitOpenError):
+        city_name("Paris", backend=Backend(), retry_policy=policy)
+
+
+def test_backend_key():
+    backend = lmf.backends.LiteLLMBackend(api_key="a")
+    key = lmf.retrypolicy.backend_key(backend)
+    assert key == backend.rate_key
+    assert key == lmf.retrypolicy.backend_key(lmf.backends.LiteLLMBackend(api_key="a"))
+    assert key != lmf.retrypolicy.backend_key(lmf.backends.LiteLLMBackend(api_key="b"))
@@ -0,0 +1,128 @@
+import csv
+import json
+
+import lmfunctions as lmf
+from lmfunctions import runner
+from lmfunctions.__main__ import main
+
+
+@lmf.lmdef
+def country(city: str) -> str:
+    """
+    Returns the country of the city
+    """
+    ...  # pragma: no cover
+
+
+def test_run(tmp_path):
+    function_path = tmp_path / "country.yaml"
+    function_path.write_text(country.dumps())
+    backend_path = tmp_path / "backend.yaml"
+    backend = lmf.backends.LiteLLMBackend(mock_response='{"output": "France"}')
+    backend_path.write_text(backend.dumps())
+    input_path = tmp_path / "cities.jsonl"
+    input_path.write_text(
+        "".join(json.dumps(dict(city=f"City {i}")) + "\n" for i in range(10))
+    )
+    output_path = tmp_path / "countries.jsonl"
+    args = [str(function_path), str(input_path), str(output_path)]
+    args += ["--backend", str(backend_path), "--batch-size", "3"]
+    assert main(["run", *args, "--concurrency", "2"]) == 0
+    output = output_path.read_text()
+    records = [json.loads(line) for line in output.splitlines()]
+    assert records == [dict(city=f"City {i}", output="France") for i in range(10)]
+
+    # An interrupted job resumes from the checkpoint, discarding partial output
+    lines = output.splitlines(keepends=True)
+    output_path.write_text("".join(lines[:4]) + '{"city": "Ci')
+    checkpoint = runner.Checkpoint(str(output_path) + ".checkpoint")
+    checkpoint.offset, checkpoint.output_bytes = 4, len("".join(lines[:4]))
+    checkpoint.save()
+    calls = []
+    event_manager = lmf.eventmanager.EventManager(
+        handlers={"call_start": [lambda **kwargs: calls.append(kwargs)]}
+    )
+    progress = runner.run(
+        country,
+        str(input_path),
+        str(output_path),
+        backend=backend,
+        event_manager=event_manager,
+    )
+    assert output_path.read_text() == output
+    assert len(calls) == 6 and progress.done == 10
+
+    # CSV input with a column used as input, and errors recorded in the output
+    csv_path = tmp_path / "cities.csv"
+    with open(csv_path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=["id", "city", "error"])
+        writer.writeheader()
+        writer.writerows(dict(id=i, city=f"City {i}", error="") for i in range(5))
+    assert runner.count_records(str(csv_path), "csv") == 5
+    failing = lmf.backends.LiteLLMBackend(mock_response='{"country": 1}')
+    progress = runner.run(
+        country,
+        str(csv_path),
+        str(tmp_path / "errors.jsonl"),
+        column="city",
+        backend=failing,
+        retry_policy=lmf.retrypolicy.RetryPolicy(stop_max_attempt=1),
+    )
+    assert progress.errors == 5
+    records = [json.loads(line) for line in open(tmp_path / "errors.jsonl")]
+    assert records[0]["id"] == "0" and records[0]["error"]
+    # Records with an error column are not counted as errors when they succeed
+    progress = runner.run(
+        country,
+        str(csv_path),
+        str(tmp_path / "countries.jsonl"),
+        column="city",
+        backend=backend,
+        restart=True,
+    )
+    assert progress.done == 5 and progress.errors == 0
+
+
+@lmf.lmdef
+def distance(origin: str, destination: str) -> int:
+    """
+    Returns the distance between the cities in kilometers
+    """
+    ...  # pragma: no cover
+
+
+def test_run_records(tmp_path):
+    input_path = tmp_path / "routes.jsonl"
+    input_path.write_text(
+        "".join(
+            json.dumps(dict(origin=f"City {i}", destination="Paris")) + "\n"
+            for i in range(4)
+        )
+    )
+    backend = lmf.backends.LiteLLMBackend(mock_response='{"output": 100}')
+    # Records are rendered the same regardless of the batch size
+    rendered = {}
+    for batch_size in (1, 2):
+        inputs = []
+        event_manager = lmf.eventmanager.EventManager(
+            handlers={
+                "input_render": [
+                    lambda **kwargs: inputs.append(kwargs["backend_input"])
+                ]
+            }
+        )
+        runner.run(
+            distance,
+            str(input_path),
+            str(tmp_path / f"distances{batch_size}.jsonl"),
+            batch_size=batch_size,
+            backend=backend,
+            event_manager=event_manager,
+        )
+        rendered[batch_size] = inputs
+    assert rendered[1] == rendered[2]
+    assert '"origin": "City 0"' in rendered[1][0]
+    assert '"origin": {"origin"' not in rendered[1][0]
+    # Calls to local backends are serialized
+    assert runner.is_local(lmf.backends.LlamaCppBackend())
+    assert not runner.is_local(backend)
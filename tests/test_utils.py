@@ -1,3 +1,12 @@
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from uuid import UUID
+
+import numpy
 import pytest
 
 import lmfunctions as lmf
@@ -27,3 +36,110 @@ def test_from_jsonschema():
     assert model(
         country="USA", population=1, languages_spoken=["English"]
     ).model_dump_json()
+
+
+def test_histogram():
+    histogram = lmf.utils.Histogram(precision=0.01)
+    assert math.isnan(histogram.quantile(0.5))
+    for i in range(1, 10001):
+        histogram.record(i / 1000)
+    summary = histogram.summary()
+    assert summary["count"] == 10000
+    assert summary["mean"] == pytest.approx(5.0005)
+    assert summary["p50"] == pytest.approx(5, rel=0.02)
+    assert summary["p99"] == pytest.approx(9.9, rel=0.02)
+    histogram.record(10**6)
+    assert histogram.quantile(1) == 10**6
+
+
+def test_sampling_profiler():
+    def busy():
+        end = time.time() + 0.2
+        while time.time() < end:
+            pass
+
+    # Idle threads are only sampled on demand
+    idle = threading.Event()
+    waiting = threading.Thread(target=idle.wait)
+    waiting.start()
+    with lmf.utils.SamplingProfiler(interval=0.001) as profiler:
+        busy()
+    with lmf.utils.SamplingProfiler(interval=0.001, idle=True) as idle_profiler:
+        busy()
+    idle.set()
+    waiting.join()
+    folded = profiler.folded()
+    assert "busy (test_utils.py" in folded
+    assert "wait (threading.py" not in folded
+    assert "wait (threading.py" in idle_profiler.folded()
+    stack, count = folded.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0
+    profiler.reset()
+    assert profiler.folded() == ""
+
+
+def test_json_serializers():
+    @dataclass
+    class Point:
+        x: int
+
+    data = {
+        "b": [1, 2.5, 1e-05, 1e16, None, True, math.nan, math.inf],
+        "a": {"é": "ü", "d": "one"},
+        "c": 2**70,
+        "date": datetime(2024, 1, 2, 3, 4, 5),
+        "uuid": UUID(int=1),
+        "point": Point(1),
+        "array": numpy.arange(3),
+        "scalar": numpy.float64(0.1),
+    }
+    documents = ['{"a": NaN, "b": 123456789012345678901234567890}', '"\\ud800"']
+    outputs, parsed = [], []
+    for name in ["json", "orjson"]:
+        lmf.utils.set_json_serializer(name)
+        outputs.append(
+            (lmf.utils.json_dumps(data), lmf.utils.json_dumps(data, sort_keys=True))
+        )
+        assert lmf.utils.json_loads(outputs[-1][0])["a"]["é"] == "ü"
+        assert lmf.utils.json_dumps({1: "one"}) == '{"1": "one"}'
+        parsed.append([repr(lmf.utils.json_loads(document)) for document in documents])
+    lmf.utils.set_json_serializer()
+    # The output is the one of the standard library with the default separators
+    assert (
+        outputs[0]
+        == outputs[1]
+        == (
+            json.dumps(data, default=str),
+            json.dumps(data, default=str, sort_keys=True),
+        )
+    )
+    assert parsed[0] == parsed[1]
+    assert "123456789012345678901234567890" in parsed[1][0]
+    with pytest.raises(ValueError):
+        lmf.utils.set_json_serializer("unsupported")
+    schema = test_models[0].model_json_schema()
+    assert lmf.utils.model_from_schema(schema) is lmf.utils.model_from_schema(schema)
+
+
+def test_vector_index():
+    index = lmf.utils.VectorIndex(capacity=20)
+    for i in range(30):
+        index.add(f"key{i}", [1, i, 0], i)
+    # The oldest entries are evicted
+    assert len(index) == 20
+    assert index.get("key5") == (False, None)
+    assert index.get("key25") == (True, 25)
+    similarity, key, value = index.search([1, 29, 0])
+    assert key == "key29" and value == 29 and similarity > 0.999
+    index.add("key29", [0, 0, 1], "replaced")
+    assert index.search([0, 0, 1])[1:] == ("key29", "replaced")
+    index.clear()
+    assert index.search([0, 0, 1]) == (-1.0, None, None)
+    # Entries without a vector are only looked up by key
+    for i in range(20):
+        index.add(f"exact{i}", None, i)
+    index.add("key", [1, 0, 0], "vector")
+    assert index.get("exact19") == (True, 19)
+    assert index.search([1, 0, 0])[1:] == ("key", "vector")
+    index.add("key", None, "exact")
+    assert index.search([1, 0, 0])[0] == 0